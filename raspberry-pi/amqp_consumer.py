@@ -0,0 +1,163 @@
+"""
+Result Consumer
+Consumes classification results on its own connection, owned by a
+dedicated thread. pika connections are not thread-safe, so nothing else
+touches this connection: the connection is opened, drained, acked and
+closed on the consumer thread only. Images go out on the separate
+ConfirmingPublisher connection, so both directions run concurrently.
+
+Up to prefetch_count results are in flight at once, and acks are sent
+in batches with multiple=True. on_message should only hand results off
+(e.g. to the actuator queue), so delivery never waits on the gate.
+"""
+import time
+import logging
+import threading
+import pika
+import config
+from backoff import Backoff
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+
+class ResultConsumer:
+    """Consumer with a connection owned by its own I/O thread"""
+        
+    def __init__(self, parameters, queue, on_message, prefetch_count=None,
+                 ack_batch=None, ack_interval=None):
+        """
+        Args:
+            parameters (pika.ConnectionParameters): Broker connection parameters
+            queue (str): Queue to consume from
+            on_message (callable): Called as on_message(body, properties) on the
+                consumer thread; raising rejects the message
+            prefetch_count (int): Max unacknowledged deliveries
+            ack_batch (int): Deliveries acknowledged together with one multiple ack
+            ack_interval (float): Max seconds a processed delivery waits for its ack
+        """
+        self.parameters = parameters
+        self.queue = queue
+        self.on_message = on_message
+        self.prefetch_count = prefetch_count or config.RESULT_PREFETCH_COUNT
+        self.ack_batch = min(ack_batch or config.RESULT_ACK_BATCH, self.prefetch_count)
+        self.ack_interval = ack_interval or config.RESULT_ACK_INTERVAL
+        
+        # Highest processed but unacknowledged delivery tag (consumer thread only)
+        self._ack_tag = None
+        self._ack_pending = 0
+        self._ack_since = None
+        
+        self.is_ready = False
+        self.is_running = False
+        self.thread = None
+        self._stop_event = threading.Event()
+        self._backoff = Backoff()
+        
+        # Statistics
+        self.received_count = 0
+        self.acked_count = 0
+        self.ack_batches = 0
+        self.rejected_count = 0
+        
+    def start(self):
+        """Start the consumer thread; connects in the background"""
+        if self.is_running:
+            return
+        self.is_running = True
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._io_loop, name="amqp-consumer", daemon=True)
+        self.thread.start()
+        
+    def stop(self, timeout=5):
+        """Stop consuming and close the connection (from the consumer thread)"""
+        self.is_running = False
+        self._stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=timeout)
+            self.thread = None
+        
+    def _io_loop(self):
+        """Connect, consume until stopped or disconnected, then retry with backoff"""
+        while self.is_running:
+            connection = None
+            try:
+                connection = pika.BlockingConnection(self.parameters)
+                channel = connection.channel()
+                channel.queue_declare(queue=self.queue, durable=True)
+                channel.basic_qos(prefetch_count=self.prefetch_count)
+                channel.basic_consume(queue=self.queue, on_message_callback=self._on_delivery)
+                
+                # Delivery tags restart on every channel
+                self._ack_tag = None
+                self._ack_pending = 0
+                self._backoff.reset()
+                self.is_ready = True
+                logger.info(f"Consuming from '{self.queue}' (prefetch {self.prefetch_count})")
+                while self.is_running:
+                    connection.process_data_events(time_limit=self.ack_interval)
+                    if self._ack_pending and time.monotonic() - self._ack_since >= self.ack_interval:
+                        self._flush_acks(channel)
+                self._flush_acks(channel)
+            
+            except Exception as e:
+                if self.is_running:
+                    logger.error(f"Consumer connection error: {e}")
+            
+            finally:
+                self.is_ready = False
+                self._close(connection)
+            
+            if self.is_running:
+                delay = self._backoff.next_delay()
+                logger.info(f"Consumer reconnecting in {delay:.1f}s")
+                self._stop_event.wait(delay)
+        
+    def _close(self, connection):
+        """Close a connection owned by this thread"""
+        if connection is None or connection.is_closed:
+            return
+        try:
+            connection.close()
+        except Exception as e:
+            logger.debug(f"Error closing consumer connection: {e}")
+        
+    def _on_delivery(self, channel, method, properties, body):
+        """Hand one delivery to on_message, then batch its ack or reject it"""
+        self.received_count += 1
+        try:
+            self.on_message(body, properties)
+        except Exception as e:
+            logger.error(f"Error processing message from '{self.queue}': {e}")
+            # Ack everything before it first so the multiple ack cannot cover it
+            self._flush_acks(channel)
+            channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            self.rejected_count += 1
+            return
+        
+        self._ack_tag = method.delivery_tag
+        if self._ack_pending == 0:
+            self._ack_since = time.monotonic()
+        self._ack_pending += 1
+        if self._ack_pending >= self.ack_batch:
+            self._flush_acks(channel)
+        
+    def _flush_acks(self, channel):
+        """Acknowledge every processed delivery up to the last tag in one frame"""
+        if not self._ack_pending or not channel.is_open:
+            return
+        channel.basic_ack(delivery_tag=self._ack_tag, multiple=True)
+        self.acked_count += self._ack_pending
+        self.ack_batches += 1
+        self._ack_tag = None
+        self._ack_pending = 0
+        
+    def get_stats(self):
+        """Get consumer statistics"""
+        return {
+            'ready': self.is_ready,
+            'received': self.received_count,
+            'acked': self.acked_count,
+            'ack_batches': self.ack_batches,
+            'rejected': self.rejected_count
+        }
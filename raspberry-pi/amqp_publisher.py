@@ -0,0 +1,320 @@
+"""
+Confirming AMQP Publisher
+Publishes on its own connection from a dedicated I/O thread with
+publisher confirms enabled. Callers only append to an outbound backlog,
+so the capture path never waits for a broker round-trip. At most
+PUBLISH_WINDOW messages are unconfirmed at a time; nacked or timed-out
+messages are published again.
+"""
+import time
+import logging
+import threading
+from collections import deque
+import pika
+import config
+from backoff import Backoff
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+
+class OutboundMessage:
+    """A message waiting to be published or confirmed"""
+    
+    __slots__ = ('fruit_id', 'routing_key', 'body', 'properties',
+                 'attempts', 'delivery_tag', 'sent_at')
+        
+    def __init__(self, fruit_id, routing_key, body, properties):
+        self.fruit_id = fruit_id
+        self.routing_key = routing_key
+        self.body = body
+        self.properties = properties
+        self.attempts = 0
+        self.delivery_tag = None
+        self.sent_at = None
+
+
+class ConfirmingPublisher:
+    """Publisher with an outbound window of unconfirmed messages"""
+        
+    def __init__(self, parameters, window=None, backlog=None, confirm_timeout=None,
+                 max_attempts=None, on_confirmed=None, on_failed=None):
+        """
+        Args:
+            parameters (pika.ConnectionParameters): Broker connection parameters
+            window (int): Max unconfirmed messages in flight
+            backlog (int): Max messages waiting to be published
+            confirm_timeout (float): Seconds before an unconfirmed message is resent
+            max_attempts (int): Publish attempts before a message is given up
+            on_confirmed (callable): Called with the OutboundMessage once the broker acks it
+            on_failed (callable): Called with the OutboundMessage when it is given up
+        """
+        self.parameters = parameters
+        self.window = window or config.PUBLISH_WINDOW
+        self.backlog = backlog or config.PUBLISH_BACKLOG
+        self.confirm_timeout = confirm_timeout or config.PUBLISH_CONFIRM_TIMEOUT
+        self.max_attempts = max_attempts or config.MAX_RETRIES
+        self.on_confirmed = on_confirmed
+        self.on_failed = on_failed
+        
+        self._pending = deque()  # Written by any thread, drained on the I/O thread
+        self._unconfirmed = {}  # delivery_tag -> OutboundMessage, I/O thread only
+        self._next_tag = 1
+        self._lock = threading.Lock()
+        
+        self._connection = None
+        self._channel = None
+        self.is_ready = False
+        self.is_running = False
+        self.thread = None
+        self._stop_event = threading.Event()
+        self._backoff = Backoff()
+        
+        # Statistics
+        self.published_count = 0
+        self.confirmed_count = 0
+        self.nacked_count = 0
+        self.resent_count = 0
+        self.failed_count = 0
+        self.dropped_count = 0
+        
+    def start(self):
+        """Start the I/O thread; connects in the background"""
+        if self.is_running:
+            return
+        self.is_running = True
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._io_loop, name="amqp-publisher", daemon=True)
+        self.thread.start()
+        
+    def stop(self, timeout=5):
+        """Close the connection and stop the I/O thread"""
+        self.is_running = False
+        self._stop_event.set()
+        connection = self._connection
+        if connection is not None:
+            try:
+                connection.ioloop.add_callback_threadsafe(self._close)
+            except Exception as e:
+                logger.debug(f"Publisher already closed: {e}")
+        if self.thread:
+            self.thread.join(timeout=timeout)
+            self.thread = None
+        
+    def publish(self, routing_key, body, properties, fruit_id=None):
+        """
+        Queue a message for publishing. Never waits on the broker.
+        
+        Args:
+            routing_key (str): Target queue
+            body (bytes): Message body
+            properties (pika.BasicProperties): Message properties
+            fruit_id (str): Fruit the message belongs to
+        
+        Returns:
+            bool: True if the message was accepted into the backlog
+        """
+        with self._lock:
+            if len(self._pending) >= self.backlog:
+                self.dropped_count += 1
+                logger.warning("Publish backlog full, dropping image")
+                return False
+            self._pending.append(OutboundMessage(fruit_id, routing_key, body, properties))
+        
+        self._wake()
+        return True
+        
+    def _wake(self):
+        """Ask the I/O thread to drain the backlog"""
+        connection = self._connection
+        if connection is not None and self.is_ready:
+            try:
+                connection.ioloop.add_callback_threadsafe(self._drain)
+            except Exception as e:
+                logger.debug(f"Could not wake publisher: {e}")
+        
+    def _io_loop(self):
+        """Connect, run the ioloop until the connection drops, then retry with backoff"""
+        while self.is_running:
+            try:
+                self._connection = pika.SelectConnection(
+                    self.parameters,
+                    on_open_callback=self._on_connection_open,
+                    on_open_error_callback=self._on_connection_open_error,
+                    on_close_callback=self._on_connection_closed
+                )
+                self._connection.ioloop.start()
+            except Exception as e:
+                logger.error(f"Publisher I/O loop error: {e}")
+            
+            self.is_ready = False
+            self._connection = None
+            self._channel = None
+            if self.is_running:
+                delay = self._backoff.next_delay()
+                logger.info(f"Publisher reconnecting in {delay:.1f}s")
+                self._stop_event.wait(delay)
+        
+    def _close(self):
+        """Close the connection from the I/O thread"""
+        if self._connection is None:
+            return
+        if self._connection.is_open:
+            self._connection.close()
+        elif self._connection.is_closed:
+            self._connection.ioloop.stop()
+        
+    def _on_connection_open(self, connection):
+        connection.channel(on_open_callback=self._on_channel_open)
+        
+    def _on_connection_open_error(self, connection, error):
+        logger.error(f"Publisher could not connect to RabbitMQ: {error}")
+        connection.ioloop.stop()
+        
+    def _on_connection_closed(self, connection, reason):
+        if self.is_running:
+            logger.warning(f"Publisher connection closed: {reason}")
+        self.is_ready = False
+        self._requeue_unconfirmed()
+        connection.ioloop.stop()
+        
+    def _on_channel_open(self, channel):
+        self._channel = channel
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.confirm_delivery(
+            ack_nack_callback=self._on_delivery_confirmation,
+            callback=self._on_confirm_mode
+        )
+        
+    def _on_channel_closed(self, channel, reason):
+        if self.is_running:
+            logger.warning(f"Publisher channel closed: {reason}")
+        self.is_ready = False
+        self._requeue_unconfirmed()
+        if self._connection is not None and self._connection.is_open:
+            self._connection.close()
+        
+    def _on_confirm_mode(self, frame):
+        self._channel.queue_declare(
+            queue=config.IMAGE_QUEUE, durable=True,
+            callback=self._on_queue_declared
+        )
+        
+    def _on_queue_declared(self, frame):
+        # Delivery tags restart at 1 on every confirm-mode channel
+        self._next_tag = 1
+        self._backoff.reset()
+        self.is_ready = True
+        logger.info("Publisher ready (publisher confirms enabled)")
+        self._connection.ioloop.call_later(1.0, self._check_timeouts)
+        self._drain()
+        
+    def _drain(self):
+        """Publish backlog messages while the window has room"""
+        while self.is_ready and len(self._unconfirmed) < self.window:
+            with self._lock:
+                if not self._pending:
+                    return
+                message = self._pending.popleft()
+            
+            try:
+                self._channel.basic_publish(
+                    exchange='',
+                    routing_key=message.routing_key,
+                    body=message.body,
+                    properties=message.properties
+                )
+            except Exception as e:
+                logger.error(f"Publish failed: {e}")
+                with self._lock:
+                    self._pending.appendleft(message)
+                return
+            
+            message.attempts += 1
+            message.sent_at = time.monotonic()
+            message.delivery_tag = self._next_tag
+            self._unconfirmed[self._next_tag] = message
+            self._next_tag += 1
+            self.published_count += 1
+        
+    def _on_delivery_confirmation(self, method_frame):
+        """Handle Basic.Ack / Basic.Nack for one or many delivery tags"""
+        method = method_frame.method
+        confirmation = method.NAME.split('.')[1].lower()
+        tag = method.delivery_tag
+        
+        if method.multiple:
+            tags = [t for t in self._unconfirmed if t <= tag]
+        else:
+            tags = [tag] if tag in self._unconfirmed else []
+        
+        for t in tags:
+            message = self._unconfirmed.pop(t)
+            if confirmation == 'ack':
+                self.confirmed_count += 1
+                if self.on_confirmed:
+                    self.on_confirmed(message)
+            else:
+                self.nacked_count += 1
+                logger.warning(f"Broker nacked image for fruit {message.fruit_id}")
+                self._retry(message)
+        
+        self._drain()
+        
+    def _check_timeouts(self):
+        """Resend messages the broker has not confirmed in time"""
+        if not self.is_ready:
+            return
+        
+        now = time.monotonic()
+        for tag, message in list(self._unconfirmed.items()):
+            if now - message.sent_at >= self.confirm_timeout:
+                # A late ack for the old tag is ignored: it is no longer tracked
+                del self._unconfirmed[tag]
+                logger.warning(f"No confirm for fruit {message.fruit_id} "
+                               f"after {self.confirm_timeout:.1f}s, resending")
+                self._retry(message)
+        
+        self._drain()
+        self._connection.ioloop.call_later(1.0, self._check_timeouts)
+        
+    def _retry(self, message):
+        """Put a message back at the head of the backlog, or give up on it"""
+        if message.attempts >= self.max_attempts:
+            self.failed_count += 1
+            logger.error(f"Giving up on image for fruit {message.fruit_id} "
+                         f"after {message.attempts} attempts")
+            if self.on_failed:
+                self.on_failed(message)
+            return
+        
+        self.resent_count += 1
+        message.delivery_tag = None
+        with self._lock:
+            self._pending.appendleft(message)
+        
+    def _requeue_unconfirmed(self):
+        """Move everything in flight back to the backlog after a connection loss"""
+        messages = sorted(self._unconfirmed.values(), key=lambda m: m.sent_at, reverse=True)
+        self._unconfirmed.clear()
+        with self._lock:
+            for message in messages:
+                message.delivery_tag = None
+                self._pending.appendleft(message)
+        
+    def get_stats(self):
+        """Get publisher statistics"""
+        with self._lock:
+            backlog = len(self._pending)
+        return {
+            'ready': self.is_ready,
+            'backlog': backlog,
+            'unconfirmed': len(self._unconfirmed),
+            'window': self.window,
+            'published': self.published_count,
+            'confirmed': self.confirmed_count,
+            'nacked': self.nacked_count,
+            'resent': self.resent_count,
+            'failed': self.failed_count,
+            'dropped': self.dropped_count
+        }
@@ -0,0 +1,35 @@
+"""
+Reconnect Backoff
+Capped exponential backoff with jitter, so a fleet of devices does not
+hammer the broker in lockstep after an outage.
+"""
+import random
+import config
+
+
+class Backoff:
+    """Delay generator: initial * 2^n, capped, randomized downwards by up to jitter"""
+        
+    def __init__(self, initial=None, maximum=None, jitter=None):
+        """
+        Args:
+            initial (float): First delay in seconds
+            maximum (float): Largest delay in seconds
+            jitter (float): Fraction (0-1) of each delay that is randomized
+        """
+        self.initial = initial or config.RETRY_DELAY
+        self.maximum = maximum or config.RETRY_MAX_DELAY
+        self.jitter = config.RETRY_JITTER if jitter is None else jitter
+        self.attempts = 0
+        
+    def next_delay(self):
+        """Delay before the next attempt; grows with every call until reset()"""
+        delay = min(self.maximum, self.initial * (2 ** self.attempts))
+        if delay < self.maximum:
+            # Stop growing at the cap: 2.0 ** 1024 overflows after a long outage
+            self.attempts += 1
+        return delay * (1 - self.jitter * random.random())
+        
+    def reset(self):
+        """Start over after a successful connection"""
+        self.attempts = 0
@@ -0,0 +1,264 @@
+"""
+Belt Position Model and Gate Actuation Scheduler
+Tracks how far the conveyor has travelled so each classified fruit can be
+located on the belt from its detection time, and flips the diverter gate
+just before the fruit arrives, without stopping the conveyor
+"""
+import time
+import logging
+import threading
+from collections import deque
+import config
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+
+class BeltModel:
+    """
+    Belt odometer built from conveyor speed changes
+    
+    The belt distance is piecewise linear in time: every speed change
+    starts a new segment (start_time, start_distance, speed_mm_s).
+    """
+        
+    def __init__(self, history=256):
+        """
+        Args:
+            history (int): Number of speed segments to keep
+        """
+        self._segments = deque(maxlen=history)
+        self._segments.append((time.monotonic(), 0.0, 0.0))
+        self._lock = threading.Lock()
+        
+    @staticmethod
+    def percent_to_mm_s(speed_percent):
+        """Convert conveyor duty cycle (0-100) to belt speed in mm/s"""
+        return config.BELT_SPEED_AT_FULL_PWM * max(0.0, speed_percent) / 100.0
+        
+    def set_speed(self, speed_percent, now=None):
+        """
+        Record a conveyor speed change
+        
+        Args:
+            speed_percent (float): New duty cycle (0-100)
+            now (float): time.monotonic() of the change, defaults to now
+        """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            distance = self._distance_at_locked(now)
+            self._segments.append((now, distance, self.percent_to_mm_s(speed_percent)))
+        
+    def position_at(self, t=None):
+        """
+        Get the belt odometer reading (mm) at a monotonic time
+        
+        Args:
+            t (float): time.monotonic() timestamp, defaults to now
+        """
+        if t is None:
+            t = time.monotonic()
+        with self._lock:
+            return self._distance_at_locked(t)
+        
+    def current_speed(self):
+        """Current belt speed in mm/s"""
+        with self._lock:
+            return self._segments[-1][2]
+        
+    def _distance_at_locked(self, t):
+        """Odometer at time t, caller holds the lock"""
+        # Walk back to the segment that contains t (usually the last one)
+        for start, distance, speed in reversed(self._segments):
+            if t >= start:
+                return distance + speed * (t - start)
+        # Older than the retained history: clamp to the oldest segment start
+        return self._segments[0][1]
+
+
+class ScheduledFruit:
+    """A classified fruit waiting for its gate move"""
+        
+    def __init__(self, classification, angle, target, on_done=None):
+        self.classification = classification
+        self.angle = angle
+        self.target = target  # Odometer reading when the fruit reaches the gate
+        self.actuated = False
+        self.on_done = on_done  # Called with (fired, start, end) once the move is made or missed
+
+
+class GateScheduler:
+    """Runs timed servo moves so the gate is set just before each fruit arrives"""
+        
+    def __init__(self, motor):
+        """
+        Args:
+            motor (MotorController): Controller that owns the belt model and servo
+        """
+        self.motor = motor
+        self.belt = motor.belt
+        self.pending = []  # Sorted by target position (belt order)
+        self.is_running = False
+        self.thread = None
+        self._cond = threading.Condition()
+        self._missed = []  # Missed fruit whose on_done is still to be called
+        
+        # Statistics
+        self.scheduled_count = 0
+        self.actuated_count = 0
+        self.missed_count = 0
+        
+    def start(self):
+        """Start the scheduler thread"""
+        if self.is_running:
+            return
+        self.is_running = True
+        self.thread = threading.Thread(target=self._run, name="gate-scheduler", daemon=True)
+        self.thread.start()
+        logger.info("Gate scheduler started")
+        
+    def stop(self):
+        """Stop the scheduler thread"""
+        with self._cond:
+            self.is_running = False
+            self._cond.notify_all()
+        if self.thread:
+            self.thread.join(timeout=2)
+            self.thread = None
+        logger.info("Gate scheduler stopped")
+        
+    def notify(self):
+        """Wake the scheduler, e.g. after a belt speed change"""
+        with self._cond:
+            self._cond.notify_all()
+        
+    def schedule(self, classification, detection_time, gate_distance=None, on_done=None):
+        """
+        Queue a gate move for a fruit detected at detection_time
+        
+        Args:
+            classification (str): Classification result
+            detection_time (float): time.monotonic() when the fruit was detected
+            gate_distance (float): Belt mm from the detection point to the gate
+                (defaults to IR_TO_GATE_DISTANCE)
+            on_done (callable): Called from the scheduler thread with (fired, start, end)
+                once the servo has moved (fired=True) or the fruit passed the gate
+                unsorted (fired=False); start/end are time.monotonic()
+        
+        Returns:
+            bool: True if the fruit can still reach the gate in time
+        """
+        if gate_distance is None:
+            gate_distance = config.IR_TO_GATE_DISTANCE
+        target = self.belt.position_at(detection_time) + gate_distance
+        now_position = self.belt.position_at()
+        
+        if now_position >= target:
+            self.missed_count += 1
+            logger.warning(f"Fruit ({classification}) already passed the gate "
+                           f"by {now_position - target:.0f}mm, cannot sort")
+            return False
+        
+        fruit = ScheduledFruit(classification, self.motor.angle_for(classification), target, on_done)
+        with self._cond:
+            self.pending.append(fruit)
+            self.pending.sort(key=lambda f: f.target)
+            self.scheduled_count += 1
+            self._cond.notify_all()
+        
+        logger.info(f"Scheduled {classification} gate move, "
+                    f"{target - now_position:.0f}mm before the gate")
+        return True
+        
+    def _run(self):
+        """Scheduler loop: fire gate moves when fruit come within servo lead distance"""
+        while self.is_running:
+            fire = None
+            with self._cond:
+                now = time.monotonic()
+                position = self.belt.position_at(now)
+                speed = self.belt.current_speed()
+                wait = self._next_action(position, speed)
+                missed, self._missed = self._missed, []
+                
+                if not missed:
+                    if wait is None:
+                        self._cond.wait(timeout=0.5)
+                        continue
+                    if wait > 0:
+                        self._cond.wait(timeout=min(wait, 0.5))
+                        continue
+                    fire = next(f for f in self.pending if not f.actuated)
+                    fire.actuated = True
+            
+            # Callbacks run outside the lock, they may take other locks
+            for fruit in missed:
+                self._done(fruit, False, now, now)
+            if fire is None:
+                continue
+            
+            # Move the servo outside the lock so new fruit can still be scheduled
+            start = time.monotonic()
+            self.motor.set_servo_for(fire.classification)
+            self.actuated_count += 1
+            self._done(fire, True, start, time.monotonic())
+        
+    def _done(self, fruit, fired, start, end):
+        """Report a fruit's gate move (or miss) to whoever scheduled it"""
+        if fruit.on_done is None:
+            return
+        try:
+            fruit.on_done(fired, start, end)
+        except Exception as e:
+            logger.error(f"Gate move callback for {fruit.classification} failed: {e}")
+        
+    def _next_action(self, position, speed):
+        """
+        Retire passed fruit and work out when the next gate move is due
+        
+        Returns:
+            float: Seconds until the next move (<= 0 means now), or None if idle
+        """
+        lead = speed * config.SERVO_MOVE_TIME
+        clear = config.GATE_CLEAR_DISTANCE
+        
+        # Drop fruit that have fully passed the gate
+        remaining = []
+        for fruit in self.pending:
+            if position >= fruit.target + clear:
+                if not fruit.actuated:
+                    self.missed_count += 1
+                    logger.warning(f"Missed gate move for {fruit.classification}")
+                    self._missed.append(fruit)
+                continue
+            remaining.append(fruit)
+        self.pending = remaining
+        
+        waiting = [f for f in self.pending if not f.actuated]
+        if not waiting:
+            return None
+        fruit = waiting[0]
+        
+        # The gate is busy while a fruit routed to a different angle is still passing
+        for passing in self.pending:
+            if passing.actuated and passing.angle != fruit.angle:
+                if speed <= 0:
+                    return None
+                return (passing.target + clear - position) / speed
+        
+        if position >= fruit.target - lead:
+            return 0
+        if speed <= 0:
+            return None  # Belt stopped, wait for a speed change
+        return (fruit.target - lead - position) / speed
+        
+    def get_stats(self):
+        """Get scheduler statistics"""
+        with self._cond:
+            return {
+                'pending': len([f for f in self.pending if not f.actuated]),
+                'scheduled': self.scheduled_count,
+                'actuated': self.actuated_count,
+                'missed': self.missed_count
+            }
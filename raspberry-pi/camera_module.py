@@ -6,10 +6,14 @@ Advanced image processing and quality optimization
 import time
 import logging
 import os
-from io import BytesIO
-from PIL import Image, ImageEnhance, ImageFilter
+import threading
+from PIL import Image
 import numpy as np
 import config
+from enhance_kernel import FusedEnhancer
+from image_stats import ImageStatsEngine, BestShotSelector
+from jpeg_encoder import select_encoder
+from frame_buffer import FrameRingBuffer, FrameGrabber
 
 # Try picamera2 first, fallback to OpenCV
 CAMERA_TYPE = None
@@ -44,6 +48,36 @@ except ImportError:
 logging.basicConfig(level=config.LOG_LEVEL)
 
 
+def normalize_roi(roi=None, output_size=None):
+    """
+    Validate an ROI and output size
+    
+    Args:
+        roi (sequence): (x, y, width, height) in sensor pixels, None for the full frame
+        output_size (sequence): (width, height), None to keep the ROI size
+        
+    Returns:
+        tuple: (roi, output_size) as tuples of ints (or None)
+        
+    Raises:
+        ValueError: If a value is malformed or not positive
+    """
+    try:
+        if roi is not None:
+            x, y, width, height = (int(v) for v in roi)
+            if x < 0 or y < 0 or width <= 0 or height <= 0:
+                raise ValueError(f"invalid ROI {roi}")
+            roi = (x, y, width, height)
+        if output_size is not None:
+            out_width, out_height = (int(v) for v in output_size)
+            if out_width <= 0 or out_height <= 0:
+                raise ValueError(f"invalid output size {output_size}")
+            output_size = (out_width, out_height)
+    except TypeError:
+        raise ValueError(f"invalid ROI {roi} or output size {output_size}")
+    return roi, output_size
+
+
 class CameraModule:
     def __init__(self):
         """Initialize the camera module with advanced processing capabilities"""
@@ -51,6 +85,8 @@ class CameraModule:
         self.is_initialized = False
         self.camera_type = CAMERA_TYPE
         self.cap = None  # For OpenCV camera
+        self._cap_lock = threading.Lock()  # cv2.VideoCapture is not thread-safe
+        self.has_lores = False  # picamera2 lores stream running
         
         # Image processing settings
         self.auto_exposure = True
@@ -61,12 +97,30 @@ class CameraModule:
         # Capture statistics
         self.capture_count = 0
         self.last_capture_time = 0
+        self.stale_capture_count = 0  # Targets older than the frame buffer
         
         # Quality settings
         self.jpeg_quality = 95
         self.brightness_adjust = 0  # -100 to 100
         self.contrast_adjust = 1.0  # 0.5 to 2.0
         self.saturation_adjust = 1.0  # 0.0 to 2.0
+        # One strided statistics pass per frame, shared by calibration,
+        # the enhancement noise gate and focus scoring
+        self.stats_engine = ImageStatsEngine()
+        self.enhancer = FusedEnhancer(self.stats_engine)
+        self.best_shot = BestShotSelector(self.stats_engine)
+        
+        # Region of interest and output size, applied right after capture
+        self.roi = None
+        self.output_size = None
+        self.set_roi(config.CAMERA_ROI, config.CAMERA_OUTPUT_SIZE)
+        
+        # Fastest installed JPEG backend, benchmarked once at the output size
+        self.encoder = select_encoder(quality=self.jpeg_quality)
+        
+        # Background grabber keeping the last frames (see start_frame_buffer)
+        self.frame_buffer = None
+        self.frame_grabber = None
         
     def initialize(self):
         """Initialize and configure the camera with optimal settings"""
@@ -106,10 +160,21 @@ class CameraModule:
             
             # Configure camera for high-quality image capture with basic settings
             try:
-                camera_config = self.camera.create_still_configuration(
-                    main={"size": config.CAMERA_RESOLUTION, "format": config.CAMERA_FORMAT},
-                    buffer_count=2,  # Double buffering for smoother capture
-                )
+                if config.CAMERA_STREAM_MODE == 'dual':
+                    # Streams run continuously: a full-res frame is at most one frame
+                    # period away, and analysis reads the small lores frames
+                    camera_config = self.camera.create_video_configuration(
+                        main={"size": config.CAMERA_RESOLUTION, "format": config.CAMERA_FORMAT},
+                        lores={"size": config.CAMERA_LORES_SIZE, "format": "YUV420"},
+                        buffer_count=config.CAMERA_BUFFER_COUNT,
+                    )
+                    self.has_lores = True
+                else:
+                    camera_config = self.camera.create_still_configuration(
+                        main={"size": config.CAMERA_RESOLUTION, "format": config.CAMERA_FORMAT},
+                        buffer_count=2,  # Double buffering for smoother capture
+                    )
+                    self.has_lores = False
                 
                 # Try to apply advanced camera controls (may not be supported)
                 try:
@@ -128,7 +193,7 @@ class CameraModule:
                 
                 # Start camera
                 self.camera.start()
-                logger.info("Camera started successfully")
+                logger.info(f"Camera started successfully ({config.CAMERA_STREAM_MODE} stream mode)")
                 
             except Exception as e:
                 logger.error(f"Camera configuration failed: {e}")
@@ -169,8 +234,8 @@ class CameraModule:
             for i in range(3):
                 try:
                     time.sleep(0.5)
-                    # Use a simpler capture method for calibration
-                    test_array = self.camera.capture_array()
+                    # Exposure statistics only need the cheap lores frames
+                    test_array = self.capture_lores()
                     if test_array is not None and test_array.size > 0:
                         test_images.append(test_array)
                         successful_captures += 1
@@ -184,8 +249,9 @@ class CameraModule:
             
             # Analyze image statistics safely
             try:
-                avg_brightness = np.mean([np.mean(img) for img in test_images])
-                avg_contrast = np.mean([np.std(img) for img in test_images])
+                stats = [self.frame_stats(img) for img in test_images]
+                avg_brightness = np.mean([s.brightness for s in stats])
+                avg_contrast = np.mean([s.contrast for s in stats])
                 
                 logger.info(f"Auto-calibration: brightness={avg_brightness:.1f}, contrast={avg_contrast:.1f}")
                 
@@ -277,6 +343,27 @@ class CameraModule:
         Returns:
             bytes: Processed image data in JPEG format, or None if failed
         """
+        frame = self.capture_frame(save_raw=save_raw)
+        if frame is None:
+            return None
+        
+        try:
+            image = self.enhance_frame(frame, enhance=enhance)
+            return self.encode_image(image)
+        except Exception as e:
+            logger.error(f"Failed to process captured image: {e}")
+            return None
+    
+    def capture_frame(self, save_raw=False):
+        """
+        Capture a raw RGB frame without enhancement or encoding
+        
+        Args:
+            save_raw (bool): Also save raw unprocessed image
+            
+        Returns:
+            numpy.ndarray: RGB frame (H x W x 3, uint8), or None if failed
+        """
         if not self.is_initialized:
             logger.error("Camera not initialized")
             return None
@@ -285,134 +372,395 @@ class CameraModule:
             self.capture_count += 1
             capture_start = time.time()
             
-            if self.camera_type == 'picamera2':
-                result = self._capture_picamera2(enhance, save_raw)
-            elif self.camera_type == 'opencv':
-                result = self._capture_opencv(enhance, save_raw)
+            if self.is_streaming():
+                # The grabber owns the camera; use its newest (already cropped) frame
+                frame, _ = self.frame_buffer.latest()
+                if frame is not None:
+                    frame = self.resize_output(frame)
             else:
-                logger.error("Unknown camera type")
-                return None
+                if self.camera_type == 'picamera2':
+                    frame = self._capture_picamera2_frame(save_raw)
+                elif self.camera_type == 'opencv':
+                    frame = self._capture_opencv_frame(save_raw)
+                else:
+                    logger.error("Unknown camera type")
+                    return None
+                
+                # Crop to the belt and shrink to the classifier size before any processing
+                if frame is not None:
+                    frame = self.crop_and_resize(frame)
             
             capture_time = time.time() - capture_start
             self.last_capture_time = capture_time
             
-            if result is not None:
-                logger.info(f"Image captured #{self.capture_count} in {capture_time:.3f}s, size: {len(result)} bytes")
+            if frame is not None:
+                logger.info(f"Image captured #{self.capture_count} in {capture_time:.3f}s, "
+                           f"frame: {frame.shape[1]}x{frame.shape[0]}")
             else:
                 logger.error(f"Image capture #{self.capture_count} failed after {capture_time:.3f}s")
             
-            return result
+            return frame
                 
         except Exception as e:
             logger.error(f"Failed to capture image: {e}")
             return None
     
-    def _capture_picamera2(self, enhance=True, save_raw=False):
-        """Capture image using picamera2 with safe processing"""
-        logger.debug("Capturing image with picamera2 (safe processing)...")
+    def capture_frame_at(self, target_time, timeout=0.5):
+        """
+        Get the frame showing the belt at a given moment
+        
+        With the frame buffer running this picks the sharpest of the
+        buffered frames closest to target_time, waiting only if that moment
+        is still in the future. A moment the buffer no longer holds is
+        refused rather than served with a later frame. Without the buffer
+        it sleeps until target_time and captures a new frame.
+        
+        Args:
+            target_time (float): time.monotonic() of the wanted frame
+            timeout (float): Max seconds to wait for a frame after target_time
+            
+        Returns:
+            numpy.ndarray: Cropped and resized RGB frame, or None if failed
+        """
+        if not self.is_streaming():
+            wait = target_time - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            return self.capture_frame()
+        
+        capture_start = time.time()
+        self.frame_buffer.wait_until(target_time, timeout)
+        if not self.frame_buffer.covers(target_time):
+            self.stale_capture_count += 1
+            logger.warning(f"Frame at {(time.monotonic() - target_time) * 1000:.0f}ms ago is no longer "
+                           f"buffered (FRAME_BUFFER_SIZE={self.frame_buffer.capacity}), capture skipped")
+            return None
+        # Closest frames first, so an early stop keeps the best-timed sharp frame
+        candidates = self.frame_buffer.nearest(target_time, self.best_shot.candidates)
+        best, _ = self.best_shot.select(candidates, view=lambda item: item[0])
+        if best is None:
+            logger.error("Frame buffer is empty")
+            return None
+        frame, timestamp = best
+        
+        self.capture_count += 1
+        self.last_capture_time = time.time() - capture_start
+        logger.info(f"Image captured #{self.capture_count} from buffer, "
+                    f"frame offset {(timestamp - target_time) * 1000:+.1f} ms")
+        return self.resize_output(frame)
+    
+    def start_frame_buffer(self, capacity=None):
+        """
+        Start streaming frames into the ring buffer in the background
+        
+        Args:
+            capacity (int): Frames kept (defaults to config.FRAME_BUFFER_SIZE)
+            
+        Returns:
+            bool: True if the grabber is running
+        """
+        if not self.is_initialized:
+            logger.error("Camera not initialized")
+            return False
+        if self.is_streaming():
+            return True
+        
+        self.frame_buffer = FrameRingBuffer(capacity)
+        self.frame_grabber = FrameGrabber(self._grab_timestamped_frame, self.frame_buffer)
+        self.frame_grabber.start()
+        logger.info(f"Frame buffer started ({self.frame_buffer.capacity} frames)")
+        return True
+    
+    def stop_frame_buffer(self):
+        """Stop the background grabber"""
+        if self.frame_grabber:
+            self.frame_grabber.stop()
+            self.frame_grabber = None
+    
+    def is_streaming(self):
+        """True while the background grabber owns the camera"""
+        return self.frame_grabber is not None and self.frame_grabber.is_running
+    
+    def _grab_timestamped_frame(self):
+        """
+        Read the next frame for the ring buffer (grabber thread)
+        
+        Returns:
+            tuple: (ROI-cropped RGB frame, time.monotonic() timestamp), or (None, None)
+        """
+        if self.camera_type == 'picamera2':
+            request = self.camera.capture_request()
+            try:
+                frame = request.make_array("main")
+                metadata = request.get_metadata()
+            finally:
+                request.release()
+            # SensorTimestamp is nanoseconds on CLOCK_MONOTONIC, like time.monotonic()
+            sensor_ns = metadata.get('SensorTimestamp')
+            timestamp = sensor_ns / 1e9 if sensor_ns else time.monotonic()
+        elif self.camera_type == 'opencv':
+            with self._cap_lock:
+                ret, bgr = self.cap.read()
+            timestamp = time.monotonic()
+            if not ret:
+                return None, None
+            frame = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+        else:
+            return None, None
+        
+        # Keep only the belt region in the buffer
+        return self.crop_roi(frame), timestamp
+    
+    def capture_lores(self):
+        """
+        Grab a small grayscale frame for analysis (presence, tracking, focus)
+        
+        Lores frames always show the ROI (the full frame without one) at
+        CAMERA_LORES_SIZE, whichever source they come from: the picamera2
+        lores stream (full field of view, cropped here), the frame buffer
+        (already cropped) or a new full frame.
+        
+        Returns:
+            numpy.ndarray: Luma frame (H x W, uint8), or None if failed
+        """
+        if self.camera is None and self.cap is None:
+            return None
         
+        width, height = config.CAMERA_LORES_SIZE
         try:
-            # Capture high-quality image with error handling
-            image_array = self.camera.capture_array()
+            if self.has_lores:
+                # YUV420: the first `height` rows are the Y (luma) plane
+                yuv = self.camera.capture_array("lores")
+                return self._resize_lores(self._crop_lores_roi(yuv[:height, :width]))
+            
+            if self.is_streaming():
+                frame, _ = self.frame_buffer.latest()
+            elif self.camera_type == 'picamera2':
+                frame = self.crop_roi(self.camera.capture_array())
+            elif self.camera_type == 'opencv':
+                with self._cap_lock:
+                    ret, bgr = self.cap.read()
+                if not ret:
+                    return None
+                return self._resize_lores(cv2.cvtColor(self.crop_roi(bgr), cv2.COLOR_BGR2GRAY))
+            else:
+                return None
             
-            if image_array is None or image_array.size == 0:
-                logger.error("Camera returned empty image array")
+            if frame is None or frame.size == 0:
                 return None
+            gray = Image.fromarray(np.ascontiguousarray(frame)).convert('L')
+            return np.asarray(gray.resize((width, height), Image.BILINEAR, reducing_gap=2.0))
+        
+        except Exception as e:
+            logger.error(f"Lores capture failed: {e}")
+            return None
+    
+    def _crop_lores_roi(self, luma):
+        """Crop a full field of view lores frame to the ROI, scaled from CAMERA_RESOLUTION pixels"""
+        if self.roi is None:
+            return luma
+        x, y, width, height = self.roi
+        scale_x = luma.shape[1] / config.CAMERA_RESOLUTION[0]
+        scale_y = luma.shape[0] / config.CAMERA_RESOLUTION[1]
+        x0, y0 = int(x * scale_x), int(y * scale_y)
+        x1 = max(x0 + 1, int(round((x + width) * scale_x)))
+        y1 = max(y0 + 1, int(round((y + height) * scale_y)))
+        cropped = luma[y0:y1, x0:x1]
+        return cropped if cropped.size else luma
+    
+    def _resize_lores(self, luma):
+        """Resize a luma frame to CAMERA_LORES_SIZE (no copy if it already is)"""
+        size = tuple(config.CAMERA_LORES_SIZE)
+        if (luma.shape[1], luma.shape[0]) == size:
+            return luma
+        if CAMERA_TYPE == 'opencv':
+            return cv2.resize(luma, size, interpolation=cv2.INTER_AREA)
+        resized = Image.fromarray(np.ascontiguousarray(luma)).resize(size, Image.BILINEAR, reducing_gap=2.0)
+        return np.asarray(resized)
+    
+    def set_roi(self, roi=None, output_size=None):
+        """
+        Set the belt region of interest and the output frame size
+        
+        Args:
+            roi (tuple): (x, y, width, height) in sensor pixels, None for the full frame
+            output_size (tuple): (width, height) to resize to, None to keep the ROI size
             
-            # Save raw image if requested
-            if save_raw:
-                try:
-                    raw_filename = f"raw_capture_{int(time.time())}.jpg"
-                    raw_image = Image.fromarray(image_array)
-                    raw_image.save(raw_filename)
-                    logger.debug(f"Raw image saved: {raw_filename}")
-                except Exception as e:
-                    logger.warning(f"Could not save raw image: {e}")
+        Returns:
+            bool: True if the values were valid and applied
+        """
+        try:
+            roi, output_size = normalize_roi(roi, output_size)
+        except ValueError as e:
+            logger.error(f"ROI not changed: {e}")
+            return False
+        
+        self.roi = roi
+        self.output_size = output_size
+        logger.info(f"Camera ROI: {roi or 'full frame'}, output size: {output_size or 'unchanged'}")
+        return True
+    
+    def crop_and_resize(self, frame):
+        """
+        Crop a frame to the ROI and resize it to the output size
+        
+        Args:
+            frame (numpy.ndarray): Full RGB frame
+            
+        Returns:
+            numpy.ndarray: Cropped and resized RGB frame
+        """
+        return self.resize_output(self.crop_roi(frame))
+    
+    def crop_roi(self, frame):
+        """Crop a full frame to the ROI (a view, no copy)"""
+        if self.roi is not None:
+            x, y, width, height = self.roi
+            # Slicing is a view; clamps automatically to the frame bounds
+            cropped = frame[y:y + height, x:x + width]
+            if cropped.size == 0:
+                logger.warning(f"ROI {self.roi} is outside the {frame.shape[1]}x{frame.shape[0]} frame, ignoring")
+            else:
+                frame = cropped
+        return frame
+    
+    def resize_output(self, frame):
+        """Resize a cropped frame to the output size"""
+        if self.output_size is None or (frame.shape[1], frame.shape[0]) == self.output_size:
+            return frame
+        
+        if CAMERA_TYPE == 'opencv':
+            # INTER_AREA averages the discarded pixels instead of aliasing them
+            return cv2.resize(frame, self.output_size, interpolation=cv2.INTER_AREA)
+        resized = Image.fromarray(frame).resize(self.output_size, Image.BILINEAR, reducing_gap=2.0)
+        return np.asarray(resized)
+    
+    def frame_stats(self, frame):
+        """
+        Brightness, contrast, noise and focus of a frame (computed once, then cached)
+        
+        Args:
+            frame (numpy.ndarray): RGB or luma frame
+            
+        Returns:
+            FrameStats: Statistics of the frame
+        """
+        return self.stats_engine.compute(frame)
+    
+    def enhance_frame(self, frame, enhance=True):
+        """
+        Apply image enhancement to a raw RGB frame if enabled
+        
+        Args:
+            frame (numpy.ndarray): RGB frame from capture_frame()
+            enhance (bool): Apply image enhancement
             
-            # Convert to PIL Image for processing
+        Returns:
+            numpy.ndarray: Processed RGB frame
+        """
+        if enhance and self.image_enhancement:
             try:
-                image = Image.fromarray(image_array)
+                # Brightness/contrast/saturation, sharpening, noise blur and fruit
+                # colour balance in two or three fused full-frame passes
+                frame = self.enhancer.enhance(
+                    frame,
+                    brightness=self.brightness_adjust,
+                    contrast=self.contrast_adjust,
+                    saturation=self.saturation_adjust,
+                    noise_reduction=self.noise_reduction
+                )
+                logger.debug("Image enhancement completed")
             except Exception as e:
-                logger.error(f"Failed to convert array to PIL image: {e}")
+                logger.warning(f"Image enhancement failed, using original: {e}")
+        
+        return frame
+    
+    def encode_image(self, image):
+        """
+        Encode a processed image as JPEG, straight from the numpy frame
+        
+        Args:
+            image (numpy.ndarray): RGB frame from enhance_frame() (a PIL image also works)
+            
+        Returns:
+            bytes: JPEG data, or None if encoding failed
+        """
+        try:
+            if isinstance(image, Image.Image):
+                image = np.asarray(image.convert('RGB'))
+            image_bytes = self.encoder.encode(image, self.jpeg_quality)
+            
+            if len(image_bytes) == 0:
+                logger.error("JPEG conversion resulted in empty data")
                 return None
             
-            # Apply advanced image processing
-            if enhance and self.image_enhancement:
-                try:
-                    image = self._enhance_image(image)
-                except Exception as e:
-                    logger.warning(f"Image enhancement failed, using original: {e}")
+            logger.debug(f"Processed image: {len(image_bytes)} bytes, quality={self.jpeg_quality}%, "
+                         f"encoder={self.encoder.name}")
+            return image_bytes
             
-            # Convert to optimized JPEG
-            try:
-                buffer = BytesIO()
-                image.save(buffer, format='JPEG', quality=self.jpeg_quality, optimize=True)
-                image_bytes = buffer.getvalue()
-                
-                if len(image_bytes) == 0:
-                    logger.error("JPEG conversion resulted in empty data")
-                    return None
-                
-                logger.debug(f"Processed image: {len(image_bytes)} bytes, quality={self.jpeg_quality}%")
-                return image_bytes
-                
-            except Exception as e:
-                logger.error(f"JPEG conversion failed: {e}")
+        except Exception as e:
+            logger.error(f"JPEG conversion failed: {e}")
+            return None
+    
+    def _capture_picamera2_frame(self, save_raw=False):
+        """Capture the sharpest of a few raw RGB frames using picamera2"""
+        logger.debug("Capturing image with picamera2 (best shot)...")
+        
+        def read():
+            image_array = self.camera.capture_array()
+            if image_array is None or image_array.size == 0:
+                logger.warning("Camera returned empty image array")
                 return None
-                
+            return image_array
+        
+        try:
+            return self._capture_best_shot(read, save_raw)
         except Exception as e:
             logger.error(f"picamera2 capture failed: {e}")
             return None
     
-    def _capture_opencv(self, enhance=True, save_raw=False):
-        """Capture image using OpenCV with advanced processing"""
-        import cv2
-        logger.debug("Capturing image with OpenCV (advanced processing)...")
+    def _capture_opencv_frame(self, save_raw=False):
+        """Capture the sharpest of a few raw RGB frames using OpenCV"""
+        logger.debug("Capturing image with OpenCV (best shot)...")
         
-        # Capture multiple frames and select the best
-        best_frame = None
-        best_score = 0
+        def read():
+            with self._cap_lock:
+                ret, frame = self.cap.read()
+            # Reversed channel view: BGR reads as RGB without a conversion pass
+            return frame[..., ::-1] if ret else None
         
-        for i in range(3):  # Capture 3 frames
-            ret, frame = self.cap.read()
-            if not ret:
-                continue
-                
-            # Calculate image quality score (using Laplacian variance)
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            score = cv2.Laplacian(gray, cv2.CV_64F).var()
-            
-            if score > best_score:
-                best_score = score
-                best_frame = frame.copy()
+        frame = self._capture_best_shot(read, save_raw)
+        return np.ascontiguousarray(frame) if frame is not None else None
+    
+    def _capture_best_shot(self, read, save_raw=False):
+        """
+        Read candidate frames until one is sharp enough, keep the sharpest
+        
+        Candidates are scored on the ROI only, on the strided luma subsample.
         
-        if best_frame is None:
+        Args:
+            read (callable): Returns the next full RGB frame, or None on failure
+            save_raw (bool): Also save the selected frame unprocessed
+            
+        Returns:
+            numpy.ndarray: Selected full RGB frame, or None if every read failed
+        """
+        candidates = (read() for _ in range(self.best_shot.candidates))
+        frame, stats = self.best_shot.select(candidates, view=self.crop_roi)
+        if frame is None:
             logger.error("Failed to capture any frame")
             return None
         
-        # Save raw frame if requested
         if save_raw:
-            raw_filename = f"raw_capture_opencv_{int(time.time())}.jpg"
-            cv2.imwrite(raw_filename, best_frame)
-            logger.debug(f"Raw frame saved: {raw_filename}")
-        
-        # Convert BGR to RGB
-        frame_rgb = cv2.cvtColor(best_frame, cv2.COLOR_BGR2RGB)
-        
-        # Convert to PIL Image
-        image = Image.fromarray(frame_rgb)
-        
-        # Apply advanced image processing
-        if enhance and self.image_enhancement:
-            image = self._enhance_image(image)
-        
-        # Convert to optimized JPEG
-        buffer = BytesIO()
-        image.save(buffer, format='JPEG', quality=self.jpeg_quality, optimize=True)
-        image_bytes = buffer.getvalue()
+            try:
+                raw_filename = f"raw_capture_{int(time.time())}.jpg"
+                Image.fromarray(np.ascontiguousarray(frame)).save(raw_filename)
+                logger.debug(f"Raw image saved: {raw_filename}")
+            except Exception as e:
+                logger.warning(f"Could not save raw image: {e}")
         
-        logger.debug(f"Processed OpenCV image: {len(image_bytes)} bytes, focus_score={best_score:.1f}")
-        return image_bytes
+        logger.debug(f"Frame selected, focus_score={stats.focus:.1f}")
+        return frame
     
     def capture_image_file(self, filename):
         """
@@ -429,7 +777,8 @@ class CameraModule:
             if self.camera_type == 'picamera2':
                 self.camera.capture_file(filename)
             elif self.camera_type == 'opencv':
-                ret, frame = self.cap.read()
+                with self._cap_lock:
+                    ret, frame = self.cap.read()
                 if ret:
                     import cv2
                     cv2.imwrite(filename, frame)
@@ -445,6 +794,7 @@ class CameraModule:
     def cleanup(self):
         """Clean up camera resources"""
         try:
+            self.stop_frame_buffer()
             if self.camera_type == 'picamera2' and self.camera:
                 self.camera.stop()
                 self.camera.close()
@@ -456,66 +806,6 @@ class CameraModule:
         except Exception as e:
             logger.error(f"Error during camera cleanup: {e}")
 
-    def _enhance_image(self, image):
-        """Apply advanced image enhancement for AI processing"""
-        try:
-            # 1. Brightness adjustment
-            if self.brightness_adjust != 0:
-                enhancer = ImageEnhance.Brightness(image)
-                factor = 1.0 + (self.brightness_adjust / 100.0)
-                image = enhancer.enhance(factor)
-            
-            # 2. Contrast enhancement
-            if self.contrast_adjust != 1.0:
-                enhancer = ImageEnhance.Contrast(image)
-                image = enhancer.enhance(self.contrast_adjust)
-            
-            # 3. Color saturation enhancement
-            if self.saturation_adjust != 1.0:
-                enhancer = ImageEnhance.Color(image)
-                image = enhancer.enhance(self.saturation_adjust)
-            
-            # 4. Sharpness enhancement for AI detection
-            enhancer = ImageEnhance.Sharpness(image)
-            image = enhancer.enhance(1.2)  # Slight sharpening
-            
-            # 5. Noise reduction (gentle blur for noise)
-            if self.noise_reduction:
-                # Only apply if image is noisy (detected by high variance)
-                img_array = np.array(image)
-                if np.var(img_array) > 1000:  # High variance indicates noise
-                    image = image.filter(ImageFilter.GaussianBlur(radius=0.5))
-            
-            # 6. Color balance optimization for fruit detection
-            image = self._optimize_for_fruit_detection(image)
-            
-            logger.debug("Image enhancement completed")
-            return image
-            
-        except Exception as e:
-            logger.error(f"Image enhancement failed: {e}")
-            return image  # Return original if enhancement fails
-    
-    def _optimize_for_fruit_detection(self, image):
-        """Optimize image specifically for fruit detection AI"""
-        try:
-            # Convert to numpy for processing
-            img_array = np.array(image)
-            
-            # Enhance red and orange channels (typical fruit colors)
-            img_array[:, :, 0] = np.clip(img_array[:, :, 0] * 1.1, 0, 255)  # Red
-            img_array[:, :, 1] = np.clip(img_array[:, :, 1] * 1.05, 0, 255) # Green (for contrast)
-            
-            # Reduce blue noise (common in artificial lighting)
-            img_array[:, :, 2] = np.clip(img_array[:, :, 2] * 0.95, 0, 255)  # Blue
-            
-            # Convert back to PIL
-            return Image.fromarray(img_array.astype(np.uint8))
-            
-        except Exception as e:
-            logger.debug(f"Fruit optimization skipped: {e}")
-            return image
-
     def set_camera_settings(self, brightness=None, contrast=None, saturation=None, quality=None):
         """
         Update camera settings dynamically
@@ -543,15 +833,24 @@ class CameraModule:
         """Get camera performance statistics"""
         return {
             "camera_type": self.camera_type,
+            "stream_mode": config.CAMERA_STREAM_MODE if self.camera_type == 'picamera2' else None,
+            "has_lores": self.has_lores,
             "capture_count": self.capture_count,
+            "stale_capture_count": self.stale_capture_count,
             "last_capture_time": self.last_capture_time,
             "is_initialized": self.is_initialized,
             "settings": {
                 "brightness": self.brightness_adjust,
                 "contrast": self.contrast_adjust,
                 "saturation": self.saturation_adjust,
-                "quality": self.jpeg_quality
-            }
+                "quality": self.jpeg_quality,
+                "jpeg_encoder": self.encoder.name,
+                "roi": self.roi,
+                "output_size": self.output_size
+            },
+            "frame_buffer": self.frame_buffer.get_stats() if self.is_streaming() else None,
+            "image_stats": self.stats_engine.get_stats(),
+            "best_shot": self.best_shot.get_stats()
         }
 
     def capture_burst(self, count=3, delay=0.5):
@@ -0,0 +1,139 @@
+"""
+Camera Settings Handoff
+main.py and control_server.py run as separate processes, so a camera
+change made through the control server (ROI, output size) is written to
+CAMERA_SETTINGS_FILE, and a watcher thread in main.py applies it to the
+camera the pipeline actually captures with. This is the reverse
+direction of the metrics snapshot.
+"""
+import os
+import json
+import time
+import logging
+import threading
+import config
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+
+def write_settings(settings, path=None):
+    """
+    Write requested camera settings atomically, so the watcher never reads a partial file
+    
+    Args:
+        settings (dict): e.g. {'roi': [x, y, width, height] or None, 'output_size': [width, height] or None}
+        path (str): Settings file (defaults to config.CAMERA_SETTINGS_FILE)
+    
+    Returns:
+        bool: True if written
+    """
+    path = path or config.CAMERA_SETTINGS_FILE
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, 'w') as f:
+            json.dump(dict(settings, requested_at=time.time()), f)
+        os.replace(temp_path, path)
+        return True
+    except (OSError, TypeError, ValueError) as e:
+        logger.error(f"Failed to write camera settings: {e}")
+        return False
+
+
+def read_settings(path=None):
+    """
+    Read the requested camera settings
+    
+    Args:
+        path (str): Settings file (defaults to config.CAMERA_SETTINGS_FILE)
+    
+    Returns:
+        dict: The settings, or None if missing or unreadable
+    """
+    path = path or config.CAMERA_SETTINGS_FILE
+    try:
+        with open(path) as f:
+            settings = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return settings if isinstance(settings, dict) else None
+
+
+class CameraSettingsWatcher:
+    """Background thread applying the settings file whenever it changes"""
+        
+    def __init__(self, apply, path=None, interval=None):
+        """
+        Args:
+            apply (callable): Called with the settings dict after each change
+            path (str): Settings file (defaults to config.CAMERA_SETTINGS_FILE)
+            interval (float): Seconds between checks of the file's mtime
+        """
+        self.apply = apply
+        self.path = path or config.CAMERA_SETTINGS_FILE
+        self.interval = interval or config.CAMERA_SETTINGS_POLL_INTERVAL
+        self._mtime = None
+        self._stop = threading.Event()
+        self._thread = None
+        
+        # Statistics
+        self.applied_count = 0
+        
+    def start(self):
+        """Start watching; settings left from an earlier request are applied right away"""
+        self._stop.clear()
+        self.check()
+        self._thread = threading.Thread(target=self._run, name="camera-settings", daemon=True)
+        self._thread.start()
+        logger.info(f"Watching {self.path} for camera settings")
+        
+    def stop(self):
+        """Stop watching"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        
+    def check(self):
+        """
+        Apply the settings if the file changed since the last check
+        
+        Returns:
+            bool: True if new settings were applied
+        """
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        
+        settings = read_settings(self.path)
+        if settings is None:
+            logger.warning(f"Ignoring unreadable camera settings in {self.path}")
+            return False
+        try:
+            self.apply(settings)
+        except Exception as e:
+            logger.error(f"Failed to apply camera settings {settings}: {e}")
+            return False
+        self.applied_count += 1
+        return True
+        
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+
+# Test function
+if __name__ == "__main__":
+    import tempfile
+    
+    path = os.path.join(tempfile.mkdtemp(), 'camera.json')
+    watcher = CameraSettingsWatcher(lambda settings: print(f"Applying {settings}"), path, interval=0.1)
+    watcher.start()
+    write_settings({'roi': [400, 200, 800, 600], 'output_size': [224, 224]}, path)
+    time.sleep(0.3)
+    watcher.stop()
+    print(f"Applied {watcher.applied_count} time(s)")
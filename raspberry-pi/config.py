@@ -19,6 +19,14 @@ RABBITMQ_VHOST = os.getenv('RABBITMQ_VHOST', '/')
 IMAGE_QUEUE = 'fruit_images'
 RESULT_QUEUE = 'classification_results'
 
+# Image message format (content_type tells the backend which one it got)
+# 'json': hex-encoded JSON, understood by every backend (default)
+# 'binary': raw JPEG body + metadata in AMQP headers (opt in once the backend is updated)
+# 'envelope': length-prefixed msgpack metadata + raw JPEG (requires msgpack)
+# The 'json' default keeps old backends working but makes binary opt-in: until
+# MESSAGE_FORMAT is switched, images still travel hex-encoded at twice their size
+MESSAGE_FORMAT = os.getenv('MESSAGE_FORMAT', 'json')
+
 # GPIO Pin Configuration (BCM Mode)
 SERVO_PIN = 18  # PWM capable pin for MG996R servo (via LM2596)
 CONVEYOR_ENABLE_PIN = 17  # L298N Enable A
@@ -50,19 +58,81 @@ CONVEYOR_SPEED = 75  # Speed percentage (0-100)
 CONVEYOR_STOP_TIME = 2.0  # Seconds to stop for sorting
 CONVEYOR_RESUME_DELAY = 0.5  # Delay before resuming
 
+# Sorting Mode
+# 'scheduled': conveyor keeps running, servo flips just before each fruit reaches the gate
+# 'stop_and_wait': stop conveyor, move servo, resume (fallback)
+SORTING_MODE = 'scheduled'
+BELT_SPEED_AT_FULL_PWM = 250.0  # Belt speed in mm/s at 100% duty cycle (calibrate on site)
+IR_TO_GATE_DISTANCE = 400.0  # Distance along the belt from IR sensor to diverter gate (mm)
+CAMERA_TO_GATE_DISTANCE = 250.0  # Distance from the camera trigger point (PRESENCE_ZONE, centre of view) to the gate (mm)
+GATE_CLEAR_DISTANCE = 80.0  # Belt travel for a fruit to fully pass the gate (mm)
+SERVO_MOVE_TIME = 0.5  # Seconds for the servo to reach a new position
+
 # Camera Configuration
 CAMERA_RESOLUTION = (1920, 1080)  # 5MP camera supports 1080p
 CAMERA_FORMAT = 'RGB888'
 CAMERA_WARMUP_TIME = 2  # Seconds to warm up camera
+# 'dual': continuously running video configuration with a full-res main stream and
+#         a lores stream for cheap analysis (presence, focus, exposure)
+# 'still': still configuration, every capture waits for a full-res frame (legacy)
+CAMERA_STREAM_MODE = 'dual'
+CAMERA_LORES_SIZE = (320, 240)  # Lores analysis frames (YUV420 luma), always cropped to CAMERA_ROI
+CAMERA_BUFFER_COUNT = 4  # Frame buffers for the running streams
+FRAME_BUFFER_SIZE = 8  # Recent frames kept by the background grabber (0 to capture on demand)
+# The grabber copies every full-res ROI frame into the buffer (~190 MB/s at 1080p30 without a ROI)
+# With CONTINUOUS_TRACKING a track is captured up to (TRACKER_PEAK_FRAMES + TRACKER_MAX_MISSED)
+# * PRESENCE_SAMPLE_INTERVAL after its best frame; keep that well inside the buffer span
+# (FRAME_BUFFER_SIZE / camera fps), older targets are skipped and the fruit takes the timeout route
+IMAGE_STATS_STEP = 4  # Pixel stride of the subsample used for brightness/contrast/noise/focus
+BEST_SHOT_CANDIDATES = 3  # Frames considered per capture, sharpest wins
+BEST_SHOT_FOCUS_THRESHOLD = 100.0  # Focus score that stops the search early (0 = always check all)
+JPEG_ENCODER = os.getenv('JPEG_ENCODER', 'auto')  # 'auto' (fastest installed), 'turbojpeg', 'opencv', 'pillow'
+JPEG_OPTIMIZE = False  # Pillow only: extra Huffman pass, ~5% smaller but much slower
+CAMERA_ROI = None  # Belt region (x, y, width, height) in CAMERA_RESOLUTION pixels, None for full frame
+CAMERA_OUTPUT_SIZE = (224, 224)  # Classifier input size (width, height), None to keep the ROI size
+CAMERA_SETTINGS_FILE = os.getenv('CAMERA_SETTINGS_FILE', '/tmp/fruit_sorting_camera.json')  # ROI changes from the control server, applied by main.py
+CAMERA_SETTINGS_POLL_INTERVAL = 1.0  # Seconds between checks of CAMERA_SETTINGS_FILE
 
 # Trigger Configuration (Multi-Mode Support)
-TRIGGER_MODE = 'ir_sensor'  # Options: 'ir_sensor', 'time_based', 'manual', 'continuous'
+TRIGGER_MODE = 'ir_sensor'  # Options: 'ir_sensor', 'presence', 'time_based', 'manual', 'continuous'
 CAPTURE_INTERVAL = 5.0  # Seconds between captures in time_based mode
 CAPTURE_DELAY = 0.3  # Delay before capture
 
+# Presence trigger ('presence' mode: background subtraction on the lores frames)
+PRESENCE_ZONE = (0.45, 0.0, 0.1, 1.0)  # Trigger zone (x, y, width, height) as fractions of the lores frame (the ROI)
+PRESENCE_THRESHOLD = 25  # Luma difference from the background counted as foreground
+PRESENCE_MIN_AREA = 0.15  # Fraction of the zone that must be foreground to trigger
+PRESENCE_LEARNING_RATE = 0.05  # Background adaptation per frame
+PRESENCE_GLITCH_FILTER = 0.1  # Seconds presence must hold (same role as IR_GLITCH_FILTER)
+PRESENCE_SAMPLE_INTERVAL = 0.05  # Seconds between lores samples in the main loop (presence and tracking)
+
+# Fruit tracking ('continuous' mode: one capture per fruit instead of per frame)
+CONTINUOUS_TRACKING = True  # False = submit every CAPTURE_INTERVAL as before
+TRACKER_CELL_SIZE = 8  # Lores pixels per side of a blob grid cell
+TRACKER_MIN_BLOB_CELLS = 4  # Smaller blobs are ignored
+TRACKER_MAX_DISTANCE = 60  # Max centroid movement between samples (lores pixels)
+TRACKER_MAX_MISSED = 3  # Samples a track survives without a matching blob
+TRACKER_MIN_HITS = 3  # Samples a track must be seen before it is captured
+TRACKER_PEAK_FRAMES = 2  # Samples without a better placement before capturing the best one
+
+# Processing Pipeline Configuration (capture -> enhance -> encode -> publish)
+# Queue policies: 'block' (backpressure), 'drop_oldest', 'drop_newest'
+PIPELINE_CAPTURE_QUEUE_SIZE = 8  # Pending triggers waiting for the camera
+PIPELINE_CAPTURE_POLICY = 'drop_oldest'  # A stale trigger has already passed the camera
+PIPELINE_ENHANCE_QUEUE_SIZE = 2  # Raw frames are large (~6 MB at 1080p)
+PIPELINE_ENHANCE_POLICY = 'block'
+PIPELINE_ENCODE_QUEUE_SIZE = 2
+PIPELINE_ENCODE_POLICY = 'block'
+PIPELINE_PUBLISH_QUEUE_SIZE = 8
+PIPELINE_PUBLISH_POLICY = 'drop_oldest'
+PIPELINE_BLOCK_TIMEOUT = 2.0  # Max seconds a 'block' stage waits before dropping
+ACTUATOR_QUEUE_SIZE = 32  # Sorting decisions waiting for the gate, in arrival order
+
 # IR Sensor Configuration
 IR_SENSOR_PIN = 24  # IR sensor output pin (FC-51 or similar)
-IR_DEBOUNCE_TIME = 2.0  # Minimum seconds between IR detections
+IR_GLITCH_FILTER = 0.01  # Seconds a beam change must hold to count (rejects noise, not fruit)
+IR_DETECTION_MODE = 'interrupt'  # 'interrupt' (GPIO edge events) or 'polling' (100 ms loop)
+GPIO_BOUNCE_TIME_MS = None  # Optional RPi.GPIO bouncetime for edge events (None = off)
 
 # Emergency Stop Configuration
 EMERGENCY_STOP_PIN = 23  # Physical emergency stop button (optional)
@@ -75,11 +145,92 @@ CONVEYOR_MAX_SPEED = 95  # Maximum conveyor speed (safety limit)
 MOTOR_TIMEOUT = 30  # Maximum continuous motor run time (seconds)
 
 # System Configuration
-RETRY_DELAY = 5  # Seconds to wait before reconnecting
+RETRY_DELAY = 1.0  # Seconds before the first reconnect attempt (doubles per failure)
+RETRY_MAX_DELAY = 60.0  # Cap for the reconnect backoff
+RETRY_JITTER = 0.5  # Randomize each backoff delay by up to this fraction
+RABBITMQ_HEARTBEAT = 30  # Seconds; a dead broker is detected after about twice this
+RABBITMQ_STARTUP_WAIT = 5.0  # Seconds startup waits for RabbitMQ before continuing without it
+CONNECTION_MONITOR_INTERVAL = 0.5  # Seconds between connection state checks
 MAX_RETRIES = 3  # Maximum retry attempts for message sending
+
+# Publisher Confirms
+PUBLISH_WINDOW = 16  # Max images published but not yet confirmed by the broker
+PUBLISH_BACKLOG = 32  # Max images waiting for a slot in the window
+PUBLISH_CONFIRM_TIMEOUT = 10.0  # Seconds before an unconfirmed image is resent
+
+# Result Consumer
+RESULT_PREFETCH_COUNT = 16  # Results the broker may deliver before they are acked
+RESULT_ACK_BATCH = 8  # Ack this many results at once (multiple=True)...
+RESULT_ACK_INTERVAL = 0.2  # ...or after this many seconds
+
+# Outbound Spool (images captured while the broker is unreachable)
+SPOOL_ENABLED = True
+SPOOL_DIR = os.getenv('SPOOL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spool'))
+SPOOL_MAX_BYTES = 256 * 1024 * 1024  # Oldest segments are evicted beyond this size
+SPOOL_SEGMENT_BYTES = 8 * 1024 * 1024  # Roll to a new segment file at this size
+SPOOL_FSYNC_BATCH = 8  # fsync after this many images...
+SPOOL_FSYNC_INTERVAL = 1.0  # ...or after this many seconds
+SPOOL_DRAIN_RATE = 5.0  # Max spooled images replayed per second after reconnecting
+SPOOL_REPLAY_MAX_BACKLOG = 8  # Replay pauses while this many live images wait in the publish backlog
 LOG_LEVEL = 'INFO'
 
 # Classification Categories
 CLASSIFICATION_FRESH = 'fresh_fruit'
 CLASSIFICATION_SPOILED = 'spoiled_fruit'
 CLASSIFICATION_OTHER = 'other'
+
+# In-Flight Fruit Tracking
+RESULT_TIMEOUT = None  # Seconds to wait for a result (None = derive from belt speed and gate distance)
+RESULT_TIMEOUT_MAX = 10.0  # Upper bound for the derived timeout
+RESULT_TIMEOUT_ROUTE = CLASSIFICATION_OTHER  # Route for fruit whose result is late (None = leave gate as is)
+
+# Local Classifier Fallback (on-device TFLite/ONNX model, loaded on first use)
+LOCAL_CLASSIFIER_ENABLED = os.getenv('LOCAL_CLASSIFIER_ENABLED', 'false').lower() == 'true'
+LOCAL_MODEL_PATH = os.getenv('LOCAL_MODEL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', 'fruit_classifier.tflite'))
+LOCAL_MODEL_LABELS = [CLASSIFICATION_FRESH, CLASSIFICATION_SPOILED, CLASSIFICATION_OTHER]  # Model output order
+LOCAL_MODEL_THREADS = 2  # CPU threads for inference (leave cores for capture/encode)
+LOCAL_MIN_CONFIDENCE = 0.6  # Lower-confidence local results are discarded
+LOCAL_DEADLINE_MARGIN = 1.5  # Classify locally if remaining time < expected round trip x margin
+LOCAL_QUEUE_SIZE = 2  # Frames waiting for local inference
+
+# Latency Budget Controller (degrade capture quality when results come back late)
+LATENCY_CONTROL_ENABLED = True
+LATENCY_BUDGET = None  # Capture -> result seconds (None = derived from the trigger point's distance to the gate)
+LATENCY_WINDOW = 20  # Recent fruit latencies considered
+LATENCY_PERCENTILE = 90  # Latency percentile compared with the budget
+LATENCY_MIN_SAMPLES = 5  # Latencies needed on a rung before it is judged
+LATENCY_RECOVER_RATIO = 0.6  # Step back up when the latency is below this fraction of the budget
+LATENCY_DEGRADE_COOLDOWN = 5.0  # Min seconds between steps down
+LATENCY_RECOVER_COOLDOWN = 30.0  # Min seconds on a rung before stepping back up
+LATENCY_LADDER = [  # Best quality first; 'output_scale' multiplies CAMERA_OUTPUT_SIZE
+    {'name': 'full', 'jpeg_quality': 95, 'output_scale': 1.0, 'enhancement': True},
+    {'name': 'quality_80', 'jpeg_quality': 80, 'output_scale': 1.0, 'enhancement': True},
+    {'name': 'quality_65_small', 'jpeg_quality': 65, 'output_scale': 0.75, 'enhancement': True},
+    {'name': 'no_enhancement', 'jpeg_quality': 65, 'output_scale': 0.75, 'enhancement': False},
+    {'name': 'local_fallback', 'jpeg_quality': 65, 'output_scale': 0.75, 'enhancement': False,
+     'local_fallback': True},
+]
+
+# Perceptual-Hash Result Cache (skip re-classifying near-identical captures)
+RESULT_CACHE_ENABLED = True
+RESULT_CACHE_TRIGGER_MODES = ('continuous', 'time_based')  # Modes where one fruit/empty belt is captured repeatedly (tracked captures bypass the cache)
+RESULT_CACHE_SIZE = 64  # Recent captures remembered
+RESULT_CACHE_HASH_SIZE = 8  # dHash thumbnail cells per side (8 -> 256-bit hash)
+RESULT_CACHE_MAX_DISTANCE = 3  # Max differing hash bits for a capture to reuse a result
+RESULT_CACHE_TTL = 30.0  # Seconds a cached result stays usable
+
+# Metrics (Prometheus text format, served by control_server.py at /metrics)
+METRICS_ENABLED = True
+METRICS_FILE = os.getenv('METRICS_FILE', '/tmp/fruit_sorting_metrics.prom')  # Snapshot shared with the control server
+METRICS_EXPORT_INTERVAL = 5.0  # Seconds between snapshots
+METRICS_MAX_AGE = 30.0  # Older snapshots are reported as stale (main.py not running)
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)  # Histogram bounds in seconds
+
+# Per-Fruit Tracing (spans from detection to gate move, written as JSONL)
+TRACING_ENABLED = True
+TRACE_DIR = os.getenv('TRACE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'traces'))  # None keeps traces in memory only
+TRACE_BUFFER_SIZE = 256  # Finished traces kept in memory
+TRACE_MAX_ACTIVE = 256  # Unfinished traces kept (oldest are closed as 'abandoned')
+TRACE_FILE_MAX_BYTES = 5 * 1024 * 1024  # Rotate traces.jsonl at this size
+TRACE_FILE_BACKUPS = 5  # Rotated files kept
+TRACE_FLUSH_INTERVAL = 2.0  # Seconds between batched writes
@@ -2,7 +2,7 @@
 Raspberry Pi Control Server
 Provides HTTP API for remote hardware control from web dashboard
 """
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import logging
 import sys
 import os
@@ -11,7 +11,9 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from motor_controller import MotorController
-from camera_module import CameraModule
+from camera_module import CameraModule, normalize_roi
+from camera_settings import read_settings, write_settings
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, read_exported
 import config as pi_config
 
 app = Flask(__name__)
@@ -171,6 +173,49 @@ def capture_image():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/control/camera/roi', methods=['GET', 'POST'])
+def camera_roi():
+    """
+    Get or set the camera region of interest and output size
+    
+    main.py owns the camera the sorting pipeline captures with, in its own
+    process, so a change is written to CAMERA_SETTINGS_FILE and main.py
+    applies it within CAMERA_SETTINGS_POLL_INTERVAL seconds.
+    """
+    try:
+        requested = read_settings() or {}
+        roi = requested.get('roi', pi_config.CAMERA_ROI)
+        output_size = requested.get('output_size', pi_config.CAMERA_OUTPUT_SIZE)
+        
+        if request.method == 'POST':
+            data = request.get_json() or {}
+            try:
+                roi, output_size = normalize_roi(data.get('roi', roi), data.get('output_size', output_size))
+            except ValueError:
+                return jsonify({'error': 'roi must be [x, y, width, height] and output_size [width, height]'}), 400
+            
+            if not write_settings({'roi': roi, 'output_size': output_size}):
+                return jsonify({'error': 'Failed to write camera settings'}), 500
+            # Keep manual captures from this server consistent with the pipeline
+            camera.set_roi(roi, output_size)
+            logger.info(f"Camera ROI change requested: {roi}, output size {output_size}")
+            return jsonify({
+                'status': 'accepted',
+                'roi': roi,
+                'output_size': output_size,
+                'message': f'main.py applies it within {pi_config.CAMERA_SETTINGS_POLL_INTERVAL}s'
+            }), 202
+        
+        return jsonify({
+            'status': 'success',
+            'roi': roi,
+            'output_size': output_size
+        })
+    except Exception as e:
+        logger.error(f"Error setting camera ROI: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/control/trigger-mode', methods=['POST'])
 def set_trigger_mode():
     """Change trigger mode"""
@@ -178,7 +223,7 @@ def set_trigger_mode():
         data = request.get_json()
         mode = data.get('mode')
         
-        valid_modes = ['ir_sensor', 'time_based', 'continuous', 'manual']
+        valid_modes = ['ir_sensor', 'presence', 'time_based', 'continuous', 'manual']
         if mode not in valid_modes:
             return jsonify({'error': f'Mode must be one of: {valid_modes}'}), 400
         
@@ -215,6 +260,25 @@ def emergency_stop():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Sorting pipeline metrics in the Prometheus text format"""
+    text, age = read_exported()
+    lines = [
+        "# HELP fruit_sorting_up Whether main.py exported metrics recently",
+        "# TYPE fruit_sorting_up gauge",
+        f"fruit_sorting_up {1 if text else 0}"
+    ]
+    if age is not None:
+        lines += [
+            "# HELP fruit_sorting_metrics_age_seconds Age of the metrics snapshot",
+            "# TYPE fruit_sorting_metrics_age_seconds gauge",
+            f"fruit_sorting_metrics_age_seconds {age:.3f}"
+        ]
+    body = '\n'.join(lines) + '\n' + (text or '')
+    return Response(body, content_type=METRICS_CONTENT_TYPE)
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
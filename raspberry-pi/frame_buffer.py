@@ -0,0 +1,208 @@
+"""
+Timestamped Frame Ring Buffer
+A background thread keeps the camera streaming into a preallocated ring
+of the last N frames, each tagged with its sensor timestamp on the
+time.monotonic() clock. A trigger then picks the frame closest to the
+moment the fruit was at the capture point instead of sleeping and paying
+sensor readout latency for a fresh frame.
+
+The cost is one copy of the full-resolution ROI frame for every frame
+the camera delivers, whether or not a fruit is pending: 6.2 MB per
+frame for an uncropped 1920x1080 RGB frame, about 190 MB/s of memcpy at
+30 fps. It is not limited to frames near a trigger: continuous mode
+asks for a frame from the past (each track's best-placed moment), and
+capture_lores() reads the buffer when there is no lores stream. Setting
+CAMERA_ROI to the belt shrinks the copy in proportion, and
+FRAME_BUFFER_SIZE = 0 turns the buffer off (captures go back to waiting
+for a fresh frame).
+"""
+import time
+import logging
+import threading
+import numpy as np
+import config
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+
+class FrameRingBuffer:
+    """Fixed-size ring of frames and their timestamps"""
+        
+    def __init__(self, capacity=None):
+        """
+        Args:
+            capacity (int): Number of frames kept (defaults to config.FRAME_BUFFER_SIZE)
+        """
+        self.capacity = max(1, capacity or config.FRAME_BUFFER_SIZE)
+        self._frames = None  # (capacity, H, W, C), allocated on the first frame
+        self._timestamps = np.full(self.capacity, -np.inf)
+        self._next = 0
+        self._newest = -np.inf
+        self._cond = threading.Condition()
+        
+        # Statistics
+        self.written_count = 0
+        self.served_count = 0
+        
+    def write(self, frame, timestamp):
+        """
+        Copy a frame into the next slot
+        
+        Args:
+            frame (numpy.ndarray): Frame to store
+            timestamp (float): time.monotonic() of the frame
+        """
+        with self._cond:
+            if self._frames is None or self._frames.shape[1:] != frame.shape or self._frames.dtype != frame.dtype:
+                # First frame, or the ROI changed: (re)allocate once
+                self._frames = np.empty((self.capacity,) + frame.shape, dtype=frame.dtype)
+                self._timestamps.fill(-np.inf)
+                logger.info(f"Frame buffer allocated: {self.capacity} x {frame.shape} "
+                            f"({self._frames.nbytes / 1e6:.1f} MB)")
+            
+            np.copyto(self._frames[self._next], frame)
+            self._timestamps[self._next] = timestamp
+            self._next = (self._next + 1) % self.capacity
+            self._newest = timestamp
+            self.written_count += 1
+            self._cond.notify_all()
+        
+    def _copy_slot(self, index):
+        self.served_count += 1
+        return self._frames[index].copy(), float(self._timestamps[index])
+        
+    def latest(self):
+        """
+        Newest frame
+        
+        Returns:
+            tuple: (frame copy, timestamp), or (None, None) if empty
+        """
+        with self._cond:
+            if self._frames is None or self._newest == -np.inf:
+                return None, None
+            return self._copy_slot((self._next - 1) % self.capacity)
+        
+    def nearest(self, target_time, count):
+        """
+        Yield up to count frames, closest to target_time first
+        
+        Each frame is copied only when the consumer asks for it, so a
+        caller that stops early pays for fewer copies. Slots overwritten
+        in the meantime are skipped.
+        
+        Yields:
+            tuple: (frame copy, timestamp)
+        """
+        with self._cond:
+            if self._frames is None:
+                return
+            order = np.argsort(np.abs(self._timestamps - target_time))[:count]
+            wanted = [(int(i), float(self._timestamps[i])) for i in order
+                      if np.isfinite(self._timestamps[i])]
+            frames = self._frames
+        
+        for index, timestamp in wanted:
+            with self._cond:
+                if self._frames is not frames or self._timestamps[index] != timestamp:
+                    continue
+                item = self._copy_slot(index)
+            yield item
+        
+    def covers(self, target_time):
+        """
+        True if target_time is not older than the buffered frames
+        
+        A moment from before the oldest frame (by more than one frame
+        interval) has been overwritten; nearest() would silently return a
+        later frame instead.
+        """
+        with self._cond:
+            valid = self._timestamps[np.isfinite(self._timestamps)]
+            if len(valid) == 0:
+                return False
+            oldest = valid.min()
+            interval = (valid.max() - oldest) / (len(valid) - 1) if len(valid) > 1 else 0.0
+            return target_time >= oldest - interval
+        
+    def wait_until(self, target_time, timeout=1.0):
+        """
+        Wait until a frame at or after target_time exists
+        
+        Returns immediately when target_time is already in the past.
+        
+        Args:
+            target_time (float): time.monotonic() the frame should show
+            timeout (float): Max seconds to wait beyond target_time
+        
+        Returns:
+            bool: True if such a frame arrived before the timeout
+        """
+        deadline = max(target_time, time.monotonic()) + timeout
+        with self._cond:
+            while self._newest < target_time:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+        
+    def get_stats(self):
+        """Get buffer statistics"""
+        with self._cond:
+            valid = self._timestamps[np.isfinite(self._timestamps)]
+            span = float(valid.max() - valid.min()) if len(valid) > 1 else 0.0
+            return {
+                'capacity': self.capacity,
+                'frames': len(valid),
+                'span': span,
+                'fps': (len(valid) - 1) / span if span > 0 else None,
+                'written': self.written_count,
+                'served': self.served_count
+            }
+
+
+class FrameGrabber:
+    """Background thread streaming camera frames into a FrameRingBuffer"""
+        
+    def __init__(self, grab, buffer):
+        """
+        Args:
+            grab (callable): Returns (frame, monotonic timestamp), or (None, None) on failure
+            buffer (FrameRingBuffer): Destination buffer
+        """
+        self.grab = grab
+        self.buffer = buffer
+        self.is_running = False
+        self.thread = None
+        self.error_count = 0
+        
+    def start(self):
+        """Start the grabber thread"""
+        if self.is_running:
+            return
+        self.is_running = True
+        self.thread = threading.Thread(target=self._run, name="frame-grabber", daemon=True)
+        self.thread.start()
+        
+    def stop(self):
+        """Stop the grabber thread"""
+        self.is_running = False
+        if self.thread:
+            self.thread.join(timeout=2)
+            self.thread = None
+        
+    def _run(self):
+        while self.is_running:
+            try:
+                frame, timestamp = self.grab()
+            except Exception as e:
+                frame, timestamp = None, None
+                logger.debug(f"Frame grab failed: {e}")
+            
+            if frame is None:
+                self.error_count += 1
+                time.sleep(0.05)
+                continue
+            self.buffer.write(frame, timestamp)
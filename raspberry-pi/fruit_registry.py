@@ -0,0 +1,324 @@
+"""
+In-Flight Fruit Registry
+Gives every detection an ID that travels with its image as the AMQP
+correlation_id, so classification results can be matched to the right
+fruit while several are on the belt. Fruit whose result does not arrive
+before their gate deadline are routed to a default bin.
+"""
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+import config
+import metrics
+from belt_scheduler import BeltModel
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+
+class InFlightFruit:
+    """A detected fruit waiting for its classification result"""
+    
+    __slots__ = ('fruit_id', 'detection_time', 'gate_distance', 'capture_time', 'publish_time', 'deadline')
+        
+    def __init__(self, fruit_id, detection_time, deadline, gate_distance=None):
+        self.fruit_id = fruit_id
+        self.detection_time = detection_time  # time.monotonic() of the detection
+        self.gate_distance = gate_distance  # Belt mm from the detection point to the gate (None = IR sensor)
+        self.capture_time = None
+        self.publish_time = None
+        self.deadline = deadline  # time.monotonic() after which the default route is used
+
+
+def camera_triggered():
+    """True if fruit are detected in the camera view (presence zone or tracker) instead of at the IR sensor"""
+    return config.TRIGGER_MODE == 'presence' or \
+        (config.TRIGGER_MODE == 'continuous' and config.CONTINUOUS_TRACKING)
+
+
+def default_result_timeout(gate_distance=None):
+    """
+    Seconds a fruit may wait for its result, derived from belt geometry
+    
+    The result must arrive before the fruit reaches the gate, minus the
+    time the servo needs to move.
+    
+    Args:
+        gate_distance (float): Belt mm from the detection point to the gate
+            (defaults to IR_TO_GATE_DISTANCE)
+    """
+    if config.RESULT_TIMEOUT is not None:
+        return config.RESULT_TIMEOUT
+    
+    if gate_distance is None:
+        gate_distance = config.IR_TO_GATE_DISTANCE
+    speed = BeltModel.percent_to_mm_s(config.CONVEYOR_SPEED)
+    if speed <= 0:
+        return config.RESULT_TIMEOUT_MAX
+    travel_time = gate_distance / speed - config.SERVO_MOVE_TIME
+    return max(0.1, min(config.RESULT_TIMEOUT_MAX, travel_time))
+
+
+class FruitRegistry:
+    """Tracks in-flight fruit by ID and expires them at their deadline"""
+        
+    def __init__(self, on_timeout=None, recent_size=256):
+        """
+        Args:
+            on_timeout (callable): Called with the InFlightFruit when its deadline passes
+            recent_size (int): Number of resolved IDs remembered to detect late/duplicate results
+        """
+        self.on_timeout = on_timeout
+        self._fruit = OrderedDict()  # fruit_id -> InFlightFruit, in detection order
+        self._recent = OrderedDict()  # fruit_id -> ('resolved' | 'expired' | 'dropped', InFlightFruit)
+        self._recent_size = recent_size
+        self._cond = threading.Condition()
+        self.round_trip = None  # Moving average of publish -> result seconds
+        self.is_running = False
+        self.thread = None
+        
+        # Statistics
+        self.registered_count = 0
+        self.resolved_count = 0
+        self.expired_count = 0
+        self.late_count = 0
+        self.duplicate_count = 0
+        self.unknown_count = 0
+        self.dropped_count = 0
+        
+    def start(self):
+        """Start the deadline watcher thread"""
+        if self.is_running:
+            return
+        self.is_running = True
+        self.thread = threading.Thread(target=self._expire_loop, name="fruit-registry", daemon=True)
+        self.thread.start()
+        
+    def stop(self):
+        """Stop the deadline watcher thread"""
+        with self._cond:
+            self.is_running = False
+            self._cond.notify_all()
+        if self.thread:
+            self.thread.join(timeout=2)
+            self.thread = None
+        
+    def register(self, detection_time=None, timeout=None, gate_distance=None):
+        """
+        Register a newly detected fruit
+        
+        Args:
+            detection_time (float): time.monotonic() of the detection, defaults to now
+            timeout (float): Seconds to wait for a result, defaults to default_result_timeout(gate_distance)
+            gate_distance (float): Belt mm from the detection point to the gate
+                (None = detected at the IR sensor)
+        
+        Returns:
+            str: The fruit ID (used as the AMQP correlation_id)
+        """
+        if detection_time is None:
+            detection_time = time.monotonic()
+        if timeout is None:
+            timeout = default_result_timeout(gate_distance)
+        
+        fruit_id = uuid.uuid4().hex
+        with self._cond:
+            self._fruit[fruit_id] = InFlightFruit(fruit_id, detection_time, detection_time + timeout,
+                                                 gate_distance)
+            self.registered_count += 1
+            self._cond.notify_all()
+        return fruit_id
+        
+    def mark_captured(self, fruit_id, capture_time=None):
+        """Record when the fruit's image was captured"""
+        with self._cond:
+            fruit = self._fruit.get(fruit_id)
+            if fruit:
+                fruit.capture_time = capture_time if capture_time is not None else time.monotonic()
+        
+    def mark_published(self, fruit_id, publish_time=None):
+        """Record when the fruit's image was published"""
+        with self._cond:
+            fruit = self._fruit.get(fruit_id)
+            if fruit:
+                fruit.publish_time = publish_time if publish_time is not None else time.monotonic()
+        
+    def resolve(self, fruit_id, remote=True):
+        """
+        Claim the in-flight fruit a result belongs to
+        
+        A fruit can only be resolved once; late, duplicate and unknown
+        results return None so they can never move the gate.
+        
+        Args:
+            fruit_id (str): correlation_id from the result
+            remote (bool): Result came from the backend (counts towards the round trip average)
+        
+        Returns:
+            InFlightFruit: The matching fruit, or None
+        """
+        with self._cond:
+            fruit = self._fruit.pop(fruit_id, None)
+            if fruit is not None:
+                self._remember(fruit_id, 'resolved', fruit)
+                self.resolved_count += 1
+                if remote:
+                    self._record_round_trip(fruit.publish_time)
+                return fruit
+            
+            previous, finished = self._recent.get(fruit_id, (None, None))
+            if remote and finished is not None:
+                # A backend result that lost to the local classifier or the
+                # deadline still measures the round trip; without it the
+                # average could only ever go up
+                self._record_round_trip(finished.publish_time)
+        
+        if previous == 'expired':
+            self.late_count += 1
+            logger.warning(f"Late result for fruit {fruit_id}, already sent to default route")
+        elif previous == 'resolved':
+            self.duplicate_count += 1
+            logger.warning(f"Duplicate result for fruit {fruit_id}, ignoring")
+        else:
+            self.unknown_count += 1
+            logger.warning(f"Result for unknown fruit {fruit_id}, ignoring")
+        return None
+        
+    def discard(self, fruit_id):
+        """
+        Forget a fruit that will not be classified (e.g. a duplicate capture)
+        
+        Returns:
+            bool: True if the fruit was in flight
+        """
+        with self._cond:
+            fruit = self._fruit.pop(fruit_id, None)
+            if fruit is None:
+                return False
+            self._remember(fruit_id, 'dropped', fruit)
+            self.dropped_count += 1
+            return True
+        
+    def resolve_oldest(self):
+        """
+        Claim the oldest published fruit, for results without a correlation_id
+        
+        Returns:
+            InFlightFruit: The oldest published fruit, or None
+        """
+        with self._cond:
+            for fruit_id, fruit in self._fruit.items():
+                if fruit.publish_time is not None:
+                    del self._fruit[fruit_id]
+                    self._remember(fruit_id, 'resolved', fruit)
+                    self.resolved_count += 1
+                    self._record_round_trip(fruit.publish_time)
+                    return fruit
+        return None
+        
+    def _record_round_trip(self, publish_time, alpha=0.2):
+        """Update the publish -> result moving average, caller holds the lock"""
+        if publish_time is None:
+            return
+        sample = time.monotonic() - publish_time
+        metrics.RESULT_ROUND_TRIP.observe(sample)
+        self.round_trip = sample if self.round_trip is None else \
+            (1 - alpha) * self.round_trip + alpha * sample
+        
+    def expected_round_trip(self, now=None):
+        """
+        Round trip a newly published image should expect
+        
+        The moving average only moves when results arrive, so a stalled
+        backend would leave it looking healthy; the age of the oldest
+        published fruit still waiting is a lower bound on the real round trip.
+        
+        Returns:
+            float: Seconds, or None if nothing has been measured or is pending
+        """
+        now = now if now is not None else time.monotonic()
+        with self._cond:
+            waiting = [now - fruit.publish_time for fruit in self._fruit.values()
+                       if fruit.publish_time is not None]
+            oldest = max(waiting, default=None)
+            if self.round_trip is None:
+                return oldest
+            return self.round_trip if oldest is None else max(self.round_trip, oldest)
+        
+    def time_remaining(self, fruit_id, now=None):
+        """
+        Seconds until a fruit's deadline
+        
+        Returns:
+            float: Seconds left (may be negative), or None if the fruit is not in flight
+        """
+        with self._cond:
+            fruit = self._fruit.get(fruit_id)
+            if fruit is None:
+                return None
+            return fruit.deadline - (now if now is not None else time.monotonic())
+        
+    def recent_outcome(self, fruit_id):
+        """
+        How a recently finished fruit ended
+        
+        Returns:
+            tuple: ('resolved' | 'expired' | 'dropped', InFlightFruit), or (None, None)
+        """
+        with self._cond:
+            return self._recent.get(fruit_id, (None, None))
+        
+    def _remember(self, fruit_id, outcome, fruit):
+        """Keep a bounded history of finished IDs, caller holds the lock"""
+        self._recent[fruit_id] = (outcome, fruit)
+        while len(self._recent) > self._recent_size:
+            self._recent.popitem(last=False)
+        
+    def _expire_loop(self):
+        """Route fruit to the default bin once their deadline passes"""
+        while self.is_running:
+            expired = []
+            with self._cond:
+                now = time.monotonic()
+                for fruit_id, fruit in list(self._fruit.items()):
+                    if fruit.deadline <= now:
+                        del self._fruit[fruit_id]
+                        self._remember(fruit_id, 'expired', fruit)
+                        self.expired_count += 1
+                        expired.append(fruit)
+                
+                if not expired:
+                    next_deadline = min((f.deadline for f in self._fruit.values()), default=None)
+                    wait = 0.5 if next_deadline is None else min(0.5, max(0.0, next_deadline - now))
+                    self._cond.wait(timeout=wait)
+                    continue
+            
+            for fruit in expired:
+                logger.warning(f"No result for fruit {fruit.fruit_id} before its deadline")
+                if self.on_timeout:
+                    try:
+                        self.on_timeout(fruit)
+                    except Exception as e:
+                        logger.error(f"Error handling fruit timeout: {e}")
+        
+    def in_flight_count(self):
+        """Number of fruit currently waiting for a result"""
+        with self._cond:
+            return len(self._fruit)
+        
+    def get_stats(self):
+        """Get registry statistics"""
+        with self._cond:
+            return {
+                'in_flight': len(self._fruit),
+                'registered': self.registered_count,
+                'resolved': self.resolved_count,
+                'expired': self.expired_count,
+                'late': self.late_count,
+                'duplicate': self.duplicate_count,
+                'unknown': self.unknown_count,
+                'dropped': self.dropped_count,
+                'round_trip': self.round_trip
+            }
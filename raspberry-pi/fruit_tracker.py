@@ -0,0 +1,236 @@
+"""
+Centroid Fruit Tracker
+Follows each fruit across the lores frames in continuous mode so it is
+captured and classified once instead of once per frame. Foreground
+pixels (same background model as the presence trigger) are pooled into a
+coarse cell grid, connected cells form blobs, and blobs are matched to
+tracks by nearest centroid. Each track remembers the moment its fruit
+was best placed in view (large and central) and is submitted once, right
+after that moment, so the frame buffer still holds the frame.
+"""
+import logging
+from collections import deque
+import numpy as np
+import config
+from presence_detector import BackgroundModel
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+
+class Blob:
+    """Connected foreground region in one lores frame"""
+    
+    __slots__ = ('centroid', 'area', 'bbox')
+        
+    def __init__(self, centroid, area, bbox):
+        self.centroid = centroid  # (x, y) in lores pixels
+        self.area = area  # Foreground pixels
+        self.bbox = bbox  # (x0, y0, x1, y1) in lores pixels
+
+
+class Track:
+    """One fruit followed across frames"""
+    
+    __slots__ = ('track_id', 'centroid', 'hits', 'missed', 'best_score', 'best_time',
+                 'since_best', 'submitted')
+        
+    def __init__(self, track_id, blob, score, timestamp):
+        self.track_id = track_id
+        self.centroid = blob.centroid
+        self.hits = 1
+        self.missed = 0
+        self.best_score = score
+        self.best_time = timestamp  # time.monotonic() of the best-placed frame
+        self.since_best = 0  # Frames seen since best_score last improved
+        self.submitted = False
+
+
+def find_blobs(mask, cell_size=None, min_cells=None, fill=0.3):
+    """
+    Blobs of a foreground mask, on a coarse cell grid
+    
+    Args:
+        mask (numpy.ndarray): Boolean foreground mask (H x W)
+        cell_size (int): Cell side in pixels
+        min_cells (int): Smallest blob kept, in cells
+        fill (float): Foreground fraction that marks a cell occupied
+    
+    Returns:
+        list: Blob objects
+    """
+    cell_size = cell_size or config.TRACKER_CELL_SIZE
+    min_cells = config.TRACKER_MIN_BLOB_CELLS if min_cells is None else min_cells
+    rows, cols = mask.shape[0] // cell_size, mask.shape[1] // cell_size
+    cells = mask[:rows * cell_size, :cols * cell_size] \
+        .reshape(rows, cell_size, cols, cell_size).mean(axis=(1, 3))
+    occupied = cells >= fill
+    
+    # 4-connected labelling; the grid is small (e.g. 40 x 30), plain BFS is enough
+    labels = np.zeros(occupied.shape, dtype=np.int32)
+    blobs = []
+    for start in zip(*np.nonzero(occupied)):
+        if labels[start]:
+            continue
+        label = len(blobs) + 1
+        labels[start] = label
+        queue = deque([start])
+        members = []
+        while queue:
+            r, c = queue.popleft()
+            members.append((r, c))
+            for nr, nc in ((r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1)):
+                if 0 <= nr < rows and 0 <= nc < cols and occupied[nr, nc] and not labels[nr, nc]:
+                    labels[nr, nc] = label
+                    queue.append((nr, nc))
+        
+        if len(members) < min_cells:
+            blobs.append(None)  # Keep label numbering aligned
+            continue
+        member_rows, member_cols = np.array(members).T
+        weights = cells[member_rows, member_cols]
+        centroid = ((float(np.average(member_cols, weights=weights)) + 0.5) * cell_size,
+                    (float(np.average(member_rows, weights=weights)) + 0.5) * cell_size)
+        bbox = (int(member_cols.min()) * cell_size, int(member_rows.min()) * cell_size,
+                (int(member_cols.max()) + 1) * cell_size, (int(member_rows.max()) + 1) * cell_size)
+        blobs.append(Blob(centroid, float(weights.sum()) * cell_size ** 2, bbox))
+    return [blob for blob in blobs if blob is not None]
+
+
+class CentroidTracker:
+    """Tracks fruit blobs across lores frames and decides when each is captured"""
+        
+    def __init__(self, max_distance=None, max_missed=None, min_hits=None, peak_frames=None):
+        """
+        Args:
+            max_distance (float): Max centroid movement between frames, in lores pixels
+            max_missed (int): Frames a track survives without a matching blob
+            min_hits (int): Frames a track must be seen before it is submitted (filters noise)
+            peak_frames (int): Frames without a better placement before the best one is used
+        """
+        self.max_distance = max_distance or config.TRACKER_MAX_DISTANCE
+        self.max_missed = config.TRACKER_MAX_MISSED if max_missed is None else max_missed
+        self.min_hits = config.TRACKER_MIN_HITS if min_hits is None else min_hits
+        self.peak_frames = config.TRACKER_PEAK_FRAMES if peak_frames is None else peak_frames
+        self.background = BackgroundModel()
+        self.tracks = {}  # track_id -> Track
+        self._next_id = 1
+        
+        # Statistics
+        self.frame_count = 0
+        self.track_count = 0
+        self.submitted_count = 0
+        
+    def _score(self, blob, shape):
+        """Placement score: blob area, reduced as the centroid moves off-centre"""
+        height, width = shape[:2]
+        x, y = blob.centroid
+        offset = max(abs(x / width - 0.5), abs(y / height - 0.5)) * 2  # 0 centre, 1 edge
+        return blob.area * (1.0 - offset)
+        
+    def _match(self, blobs):
+        """Greedy nearest-centroid matching; returns {track_id: blob index}"""
+        pairs = []
+        for track_id, track in self.tracks.items():
+            for index, blob in enumerate(blobs):
+                distance = np.hypot(blob.centroid[0] - track.centroid[0],
+                                    blob.centroid[1] - track.centroid[1])
+                if distance <= self.max_distance:
+                    pairs.append((distance, track_id, index))
+        pairs.sort()
+        
+        matches, used = {}, set()
+        for _, track_id, index in pairs:
+            if track_id in matches or index in used:
+                continue
+            matches[track_id] = index
+            used.add(index)
+        return matches
+        
+    def update(self, luma, timestamp):
+        """
+        Feed one lores frame
+        
+        Args:
+            luma (numpy.ndarray): Luma frame (H x W, uint8)
+            timestamp (float): time.monotonic() of the frame
+        
+        Returns:
+            list: Tracks to capture now, each with best_time set to its best-placed frame
+        """
+        self.frame_count += 1
+        foreground = self.background.apply(luma)
+        if foreground is None:
+            return []
+        
+        blobs = find_blobs(foreground)
+        matches = self._match(blobs)
+        ready = []
+        
+        for track_id, track in list(self.tracks.items()):
+            index = matches.get(track_id)
+            if index is None:
+                track.missed += 1
+                if track.missed > self.max_missed:
+                    # Left the view: use its best frame if that was not done yet
+                    del self.tracks[track_id]
+                    if not track.submitted and track.hits >= self.min_hits:
+                        ready.append(track)
+                continue
+            
+            blob = blobs[index]
+            track.centroid = blob.centroid
+            track.hits += 1
+            track.missed = 0
+            score = self._score(blob, luma.shape)
+            if score > track.best_score:
+                track.best_score = score
+                track.best_time = timestamp
+                track.since_best = 0
+            else:
+                track.since_best += 1
+                if (not track.submitted and track.hits >= self.min_hits
+                        and track.since_best >= self.peak_frames):
+                    ready.append(track)
+        
+        matched = set(matches.values())
+        for index, blob in enumerate(blobs):
+            if index not in matched:
+                track = Track(self._next_id, blob, self._score(blob, luma.shape), timestamp)
+                self.tracks[track.track_id] = track
+                self._next_id += 1
+                self.track_count += 1
+        
+        for track in ready:
+            track.submitted = True
+            self.submitted_count += 1
+            logger.debug(f"Track {track.track_id} ready after {track.hits} frames")
+        return ready
+        
+    def get_stats(self):
+        """Get tracker statistics"""
+        return {
+            'frames': self.frame_count,
+            'active_tracks': len(self.tracks),
+            'tracks': self.track_count,
+            'submitted': self.submitted_count
+        }
+
+
+# Test function
+if __name__ == "__main__":
+    tracker = CentroidTracker()
+    width, height = config.CAMERA_LORES_SIZE
+    rng = np.random.default_rng(0)
+    belt = rng.integers(90, 110, (height, width), dtype=np.uint8)
+    
+    print("Simulating two fruit crossing the belt...")
+    for i in range(80):
+        frame = belt.copy()
+        for start, row in ((5, height // 3), (30, 2 * height // 3)):
+            x = (i - start) * 10  # Dark objects moving right
+            if -30 < x < width + 30:
+                frame[row - 25:row + 25, max(0, x - 25):max(0, x + 25)] = 30
+        for track in tracker.update(frame, i * 0.05):
+            print(f"  frame {i}: capture track {track.track_id} at t={track.best_time:.2f}s")
+    print(f"Stats: {tracker.get_stats()}")
@@ -0,0 +1,240 @@
+"""
+Edge-Triggered GPIO Events
+Turns GPIO edge interrupts into timestamped events on a queue so the main
+loop can block until something happens instead of polling every 100 ms.
+Includes a FakeGPIO backend for testing without a Raspberry Pi.
+"""
+import time
+import queue
+import logging
+import threading
+from collections import namedtuple
+import config
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+# level is the pin level just after the edge, timestamp is time.monotonic()
+GPIOEvent = namedtuple('GPIOEvent', ['pin', 'level', 'timestamp'])
+
+
+def load_gpio(gpio=None):
+    """
+    GPIO backend to use: the one given, or RPi.GPIO
+    
+    Args:
+        gpio: GPIO backend with the RPi.GPIO interface (e.g. FakeGPIO), None for RPi.GPIO
+    
+    Returns:
+        The GPIO backend
+    """
+    if gpio is not None:
+        return gpio
+    try:
+        import RPi.GPIO as gpio
+    except ImportError:
+        print("⚠️  RPi.GPIO không được cài đặt. Chạy: pip install RPi.GPIO")
+        print("   Hoặc chạy: ./start.sh để cài đặt đầy đủ")
+        raise
+    return gpio
+
+
+class GPIOEventSource:
+    """Collects edge interrupts from watched pins into a single event queue"""
+        
+    def __init__(self, gpio=None, max_events=256):
+        """
+        Args:
+            gpio: GPIO backend with the RPi.GPIO interface (defaults to RPi.GPIO)
+            max_events (int): Event queue capacity; extra edges are dropped
+        """
+        self.gpio = load_gpio(gpio)
+        self.events = queue.Queue(maxsize=max_events)
+        self.pins = []
+        self.dropped_count = 0
+        
+    def watch(self, pin, pull_up_down, bouncetime=None, emit_initial=False):
+        """
+        Configure a pin as input and start delivering its edges
+        
+        Args:
+            pin (int): BCM pin number
+            pull_up_down: GPIO.PUD_UP or GPIO.PUD_DOWN
+            bouncetime (int): Hardware-side debounce in milliseconds (None to disable)
+            emit_initial (bool): Queue an event with the pin's current level
+        """
+        self.gpio.setmode(self.gpio.BCM)
+        self.gpio.setup(pin, self.gpio.IN, pull_up_down=pull_up_down)
+        
+        kwargs = {'callback': self._on_edge}
+        if bouncetime:
+            kwargs['bouncetime'] = bouncetime
+        self.gpio.add_event_detect(pin, self.gpio.BOTH, **kwargs)
+        self.pins.append(pin)
+        
+        if emit_initial:
+            self._on_edge(pin)
+        logger.info(f"Edge detection enabled on GPIO {pin}")
+        
+    def _on_edge(self, channel):
+        """GPIO callback: timestamp first, then read the level and queue the event"""
+        timestamp = time.monotonic()
+        level = self.gpio.input(channel)
+        try:
+            self.events.put_nowait(GPIOEvent(channel, level, timestamp))
+        except queue.Full:
+            self.dropped_count += 1
+        
+    def get(self, timeout=None):
+        """
+        Wait for the next edge event
+        
+        Args:
+            timeout (float): Seconds to wait (None to wait forever)
+        
+        Returns:
+            GPIOEvent: The event, or None on timeout
+        """
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        
+    def get_batch(self, timeout=None):
+        """
+        Wait for the next edge event, then take every event already queued
+        
+        Args:
+            timeout (float): Seconds to wait for the first event (None to wait forever)
+        
+        Returns:
+            list: GPIOEvents in arrival order (empty on timeout)
+        """
+        event = self.get(timeout=timeout)
+        if event is None:
+            return []
+        events = [event]
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+        
+    def close(self):
+        """Stop edge detection on all watched pins"""
+        for pin in self.pins:
+            try:
+                self.gpio.remove_event_detect(pin)
+            except Exception as e:
+                logger.debug(f"Could not remove edge detection on GPIO {pin}: {e}")
+        self.pins = []
+
+
+class FakePWM:
+    """In-memory stand-in for RPi.GPIO.PWM, recording the duty cycle"""
+        
+    def __init__(self, pin, frequency):
+        self.pin = pin
+        self.frequency = frequency
+        self.duty_cycle = None  # None while stopped
+        
+    def start(self, duty_cycle):
+        self.duty_cycle = duty_cycle
+        
+    def ChangeDutyCycle(self, duty_cycle):
+        self.duty_cycle = duty_cycle
+        
+    def ChangeFrequency(self, frequency):
+        self.frequency = frequency
+        
+    def stop(self):
+        self.duty_cycle = None
+
+
+class FakeGPIO:
+    """
+    In-memory stand-in for RPi.GPIO
+    
+    Drive inputs with set_input(); registered callbacks fire on matching
+    edges from the calling thread, as RPi.GPIO does from its own thread.
+    Outputs and PWM duty cycles are recorded for inspection.
+    """
+    
+    BCM = 11
+    IN = 1
+    OUT = 0
+    LOW = 0
+    HIGH = 1
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+        
+    def __init__(self):
+        self.levels = {}
+        self.callbacks = {}
+        self._lock = threading.Lock()
+        
+    def setmode(self, mode):
+        pass
+        
+    def setwarnings(self, flag):
+        pass
+        
+    def setup(self, pin, direction, pull_up_down=None, initial=None):
+        if pin not in self.levels:
+            self.levels[pin] = self.HIGH if pull_up_down == self.PUD_UP else self.LOW
+        
+    def input(self, pin):
+        return self.levels.get(pin, self.LOW)
+        
+    def output(self, pin, level):
+        self.levels[pin] = level
+        
+    def PWM(self, pin, frequency):
+        return FakePWM(pin, frequency)
+        
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self.callbacks[pin] = (edge, callback)
+        
+    def remove_event_detect(self, pin):
+        self.callbacks.pop(pin, None)
+        
+    def cleanup(self, *args):
+        self.callbacks.clear()
+        
+    def set_input(self, pin, level):
+        """Change an input level, firing the pin's callback on an edge"""
+        with self._lock:
+            previous = self.levels.get(pin, self.LOW)
+            self.levels[pin] = level
+        if previous == level or pin not in self.callbacks:
+            return
+        
+        edge, callback = self.callbacks[pin]
+        rising = level == self.HIGH
+        if edge == self.BOTH or (edge == self.RISING) == rising:
+            if callback:
+                callback(pin)
+
+
+# Test function
+if __name__ == "__main__":
+    print("Testing GPIO event source with FakeGPIO...")
+    fake = FakeGPIO()
+    source = GPIOEventSource(gpio=fake)
+    source.watch(config.IR_SENSOR_PIN, fake.PUD_DOWN)
+    
+    fake.set_input(config.IR_SENSOR_PIN, fake.HIGH)
+    time.sleep(0.05)
+    fake.set_input(config.IR_SENSOR_PIN, fake.LOW)
+    
+    while True:
+        event = source.get(timeout=0.1)
+        if event is None:
+            break
+        print(f"GPIO {event.pin} -> {event.level} at {event.timestamp:.3f}")
+    
+    source.close()
+    print("Test complete!")
@@ -0,0 +1,408 @@
+"""
+Disk-Backed Outbound Spool
+Keeps images that cannot be published (broker unreachable, backlog full)
+in append-only segment files, and replays them oldest-first at a
+controlled rate once the publisher is back.
+
+Record layout: magic (4s) | crc32 (I) | meta length (I) | body length (I)
+followed by the JSON metadata and the raw message body.
+"""
+import os
+import json
+import time
+import zlib
+import struct
+import logging
+import threading
+import pika
+import config
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+RECORD_MAGIC = b'FSP1'
+RECORD_HEADER = struct.Struct('>4sIII')
+SEGMENT_PREFIX = 'spool-'
+SEGMENT_SUFFIX = '.log'
+
+
+class SpoolRecord:
+    """One spooled message"""
+    
+    __slots__ = ('routing_key', 'body', 'fruit_id', 'content_type', 'headers',
+                 'correlation_id', 'reply_to')
+        
+    def __init__(self, routing_key, body, fruit_id=None, content_type=None, headers=None,
+                 correlation_id=None, reply_to=None):
+        self.routing_key = routing_key
+        self.body = body
+        self.fruit_id = fruit_id
+        self.content_type = content_type
+        self.headers = headers
+        self.correlation_id = correlation_id
+        self.reply_to = reply_to
+        
+    def encode(self):
+        """Serialize to the on-disk record format"""
+        meta = json.dumps({
+            'routing_key': self.routing_key,
+            'fruit_id': self.fruit_id,
+            'content_type': self.content_type,
+            'headers': self.headers,
+            'correlation_id': self.correlation_id,
+            'reply_to': self.reply_to
+        }).encode('utf-8')
+        body = self.body.encode('utf-8') if isinstance(self.body, str) else bytes(self.body)
+        crc = zlib.crc32(body, zlib.crc32(meta))
+        return RECORD_HEADER.pack(RECORD_MAGIC, crc, len(meta), len(body)) + meta + body
+        
+    def to_properties(self):
+        """Rebuild the AMQP properties for replay"""
+        return pika.BasicProperties(
+            delivery_mode=2,
+            content_type=self.content_type,
+            headers=self.headers,
+            correlation_id=self.correlation_id,
+            reply_to=self.reply_to
+        )
+        
+    @classmethod
+    def read_from(cls, f):
+        """
+        Read the next record from an open segment file
+        
+        Returns:
+            SpoolRecord: The record, or None at end of file or on a torn/corrupt record
+        """
+        header = f.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return None
+        magic, crc, meta_len, body_len = RECORD_HEADER.unpack(header)
+        if magic != RECORD_MAGIC:
+            return None
+        meta = f.read(meta_len)
+        body = f.read(body_len)
+        if len(meta) < meta_len or len(body) < body_len:
+            return None
+        if zlib.crc32(body, zlib.crc32(meta)) != crc:
+            return None
+        fields = json.loads(meta.decode('utf-8'))
+        return cls(body=body, **fields)
+
+
+class ImageSpool:
+    """Append-only on-disk spool with a size cap and oldest-first eviction"""
+        
+    def __init__(self, directory=None, max_bytes=None, segment_bytes=None,
+                 fsync_batch=None, fsync_interval=None):
+        """
+        Args:
+            directory (str): Spool directory
+            max_bytes (int): Total size cap; oldest segments are evicted beyond it
+            segment_bytes (int): Size at which the active segment is rolled
+            fsync_batch (int): fsync after this many appended records
+            fsync_interval (float): ...or when this many seconds passed since the last fsync
+        """
+        self.directory = directory or config.SPOOL_DIR
+        self.max_bytes = max_bytes or config.SPOOL_MAX_BYTES
+        self.segment_bytes = segment_bytes or config.SPOOL_SEGMENT_BYTES
+        self.fsync_batch = fsync_batch or config.SPOOL_FSYNC_BATCH
+        self.fsync_interval = fsync_interval or config.SPOOL_FSYNC_INTERVAL
+        
+        self._lock = threading.Lock()
+        self._active = None  # Open file object of the segment being written
+        self._active_seq = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._next_seq = 0
+        self._bytes = 0  # Running total of all segments, so appends never scan the directory
+        
+        # Statistics
+        self.appended_count = 0
+        self.replayed_count = 0
+        self.evicted_bytes = 0
+        
+        os.makedirs(self.directory, exist_ok=True)
+        segments = self._segments()
+        if segments:
+            self._next_seq = segments[-1][0] + 1
+            self._bytes = self._scan_bytes()
+            logger.info(f"Spool has {len(segments)} segment(s) from a previous run, "
+                        f"{self._bytes} bytes")
+        
+    def _segment_path(self, seq):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{seq:010d}{SEGMENT_SUFFIX}")
+        
+    def _segments(self):
+        """List (seq, path) of all segments, oldest first"""
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                try:
+                    seq = int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+                except ValueError:
+                    continue
+                segments.append((seq, os.path.join(self.directory, name)))
+        segments.sort()
+        return segments
+        
+    def size_bytes(self):
+        """Total size of all segments"""
+        return self._bytes
+        
+    def _scan_bytes(self):
+        """Total size of all segments on disk (lists and stats the directory)"""
+        total = 0
+        for _, path in self._segments():
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+        
+    def append(self, record):
+        """
+        Append a record to the active segment
+        
+        Args:
+            record (SpoolRecord): Message to spool
+        
+        Returns:
+            bool: True if the record was written
+        """
+        data = record.encode()
+        try:
+            with self._lock:
+                if self._active is None or self._active.tell() + len(data) > self.segment_bytes:
+                    self._roll_locked()
+                
+                self._active.write(data)
+                self._bytes += len(data)
+                self._unsynced += 1
+                self.appended_count += 1
+                
+                if (self._unsynced >= self.fsync_batch
+                        or time.monotonic() - self._last_sync >= self.fsync_interval):
+                    self._sync_locked()
+                
+                self._evict_locked()
+            return True
+        except OSError as e:
+            logger.error(f"Failed to spool image: {e}")
+            return False
+        
+    def flush(self):
+        """fsync any records written since the last sync"""
+        with self._lock:
+            if self._unsynced:
+                self._sync_locked()
+        
+    def flush_if_due(self):
+        """
+        fsync unsynced records once fsync_interval has passed
+        
+        append() only checks the interval when the next record arrives,
+        so the last records of a burst would otherwise stay unsynced.
+        """
+        with self._lock:
+            if self._unsynced and time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync_locked()
+        
+    def _sync_locked(self):
+        self._active.flush()
+        os.fsync(self._active.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        
+    def _roll_locked(self):
+        """Close the active segment and start a new one"""
+        if self._active is not None:
+            if self._unsynced:
+                self._sync_locked()
+            self._active.close()
+        self._active_seq = self._next_seq
+        self._next_seq += 1
+        self._active = open(self._segment_path(self._active_seq), 'ab')
+        
+    def _evict_locked(self):
+        """Delete the oldest closed segments while the spool is over its cap"""
+        if self._bytes <= self.max_bytes:
+            return
+        for seq, path in self._segments():
+            if self._bytes <= self.max_bytes or seq == self._active_seq:
+                break
+            size = os.path.getsize(path)
+            os.remove(path)
+            self._bytes -= size
+            self.evicted_bytes += size
+            logger.warning(f"Spool over {self.max_bytes} bytes, evicted oldest segment ({size} bytes)")
+        
+    def take_oldest_segment(self):
+        """
+        Detach the oldest segment for replay
+        
+        The active segment is rolled first if it is the only one, so
+        writers keep appending to a new file while it is replayed.
+        
+        Returns:
+            str: Path of a closed segment, or None if the spool is empty
+        """
+        with self._lock:
+            segments = self._segments()
+            if not segments:
+                return None
+            seq, path = segments[0]
+            if seq == self._active_seq:
+                if self._active.tell() == 0:
+                    return None
+                self._roll_locked()
+            return path
+        
+    def read_segment(self, path):
+        """Yield the records of a closed segment, stopping at the first torn record"""
+        with open(path, 'rb') as f:
+            while True:
+                record = SpoolRecord.read_from(f)
+                if record is None:
+                    return
+                yield record
+        
+    def remove_segment(self, path):
+        """Delete a fully replayed segment"""
+        with self._lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                return  # Already evicted
+            self._bytes -= size
+        
+    def is_empty(self):
+        """True if nothing is waiting to be replayed"""
+        with self._lock:
+            segments = self._segments()
+            if not segments:
+                return True
+            if len(segments) == 1 and segments[0][0] == self._active_seq:
+                return self._active.tell() == 0
+            return False
+        
+    def close(self):
+        """Flush and close the active segment"""
+        with self._lock:
+            if self._active is not None:
+                if self._unsynced:
+                    self._sync_locked()
+                self._active.close()
+                self._active = None
+                if os.path.getsize(self._segment_path(self._active_seq)) == 0:
+                    os.remove(self._segment_path(self._active_seq))
+                self._active_seq = None
+        
+    def get_stats(self):
+        """Get spool statistics"""
+        return {
+            'directory': self.directory,
+            'bytes': self.size_bytes(),
+            'max_bytes': self.max_bytes,
+            'segments': len(self._segments()),
+            'appended': self.appended_count,
+            'unsynced': self._unsynced,  # Written but not yet fsynced
+            'replayed': self.replayed_count,
+            'evicted_bytes': self.evicted_bytes
+        }
+
+
+class SpoolDrainer:
+    """
+    Replays spooled images through the publisher at a controlled rate
+    
+    Runs whether or not the broker is connected: every wait also fsyncs
+    records that have been in the spool longer than fsync_interval.
+    """
+        
+    def __init__(self, spool, publisher, rate=None, max_backlog=None):
+        """
+        Args:
+            spool (ImageSpool): Spool to drain
+            publisher (ConfirmingPublisher): Publisher to replay into
+            rate (float): Max replayed messages per second
+            max_backlog (int): Publish backlog at which replay pauses for live traffic
+        """
+        self.spool = spool
+        self.publisher = publisher
+        self.rate = rate or config.SPOOL_DRAIN_RATE
+        self.max_backlog = config.SPOOL_REPLAY_MAX_BACKLOG if max_backlog is None else max_backlog
+        self.is_running = False
+        self.thread = None
+        self._stop_event = threading.Event()
+        
+    def start(self):
+        """Start the drainer thread"""
+        if self.is_running:
+            return
+        self.is_running = True
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="spool-drainer", daemon=True)
+        self.thread.start()
+        
+    def stop(self):
+        """Stop the drainer thread"""
+        self.is_running = False
+        self._stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=2)
+            self.thread = None
+        
+    def _wait(self, timeout):
+        """Sync the spool if it is due, then sleep (returns early on stop)"""
+        self.spool.flush_if_due()
+        self._stop_event.wait(timeout)
+        
+    def _has_room(self):
+        """Only replay while live traffic leaves room in the publish backlog"""
+        stats = self.publisher.get_stats()
+        return stats['ready'] and stats['backlog'] < self.max_backlog
+        
+    def _run(self):
+        """Replay segments oldest-first, one record per interval"""
+        interval = 1.0 / self.rate
+        while self.is_running:
+            if not self._has_room():
+                self._wait(0.5)
+                continue
+            
+            path = self.spool.take_oldest_segment()
+            if path is None:
+                self._wait(1.0)
+                continue
+            
+            logger.info(f"Replaying spooled images from {os.path.basename(path)}")
+            if self._replay_segment(path, interval):
+                self.spool.remove_segment(path)
+            else:
+                # Keep the segment; records already replayed are sent again (at-least-once)
+                self._wait(1.0)
+        
+    def _replay_segment(self, path, interval):
+        """
+        Publish every record of a segment
+        
+        Returns:
+            bool: True if the whole segment was handed to the publisher
+        """
+        for record in self.spool.read_segment(path):
+            while not self._has_room():
+                if not self.is_running:
+                    return False
+                self._wait(0.5)
+            
+            if not self.is_running:
+                return False
+            if not self.publisher.publish(record.routing_key, record.body,
+                                          record.to_properties(), fruit_id=record.fruit_id):
+                return False
+            
+            self.spool.replayed_count += 1
+            self._wait(interval)
+        return True
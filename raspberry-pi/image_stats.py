@@ -0,0 +1,247 @@
+"""
+Shared Image Statistics
+Brightness, contrast, noise and focus of a frame, computed once on a
+strided subsample (1/step² of the pixels) and cached per frame object, so
+calibration, the enhancement noise gate and frame quality scoring all
+read the same numbers instead of each making its own full-frame pass.
+
+Per-channel histograms of the subsample are kept as well: statistics of
+the frame after a per-channel lookup table can be derived from them
+without touching the pixels again.
+"""
+import logging
+import weakref
+import threading
+from collections import OrderedDict
+import numpy as np
+import config
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+# ITU-R 601-2 luma, as used by PIL for 'L' conversion
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114])
+
+
+class FrameStats:
+    """Statistics of one frame"""
+    
+    __slots__ = ('brightness', 'contrast', 'noise', 'focus', 'histogram', 'count')
+        
+    def __init__(self, brightness, contrast, noise, focus, histogram, count):
+        self.brightness = brightness  # Mean luma, 0-255
+        self.contrast = contrast      # Luma standard deviation
+        self.noise = noise            # Pixel variance over all channels
+        self.focus = focus            # Laplacian variance of the luma sample
+        self.histogram = histogram    # (channels, 256) sample counts
+        self.count = count            # Sampled pixels per channel
+        
+    def channel_means(self, lut=None):
+        """
+        Per-channel mean, optionally after a lookup table
+        
+        Args:
+            lut (numpy.ndarray): (channels, 256) table, or None
+        
+        Returns:
+            numpy.ndarray: Mean of each channel
+        """
+        levels = np.arange(256, dtype=np.float64) if lut is None else lut.astype(np.float64)
+        return (self.histogram * levels).sum(axis=-1) / self.count
+        
+    def mapped_variance(self, lut):
+        """Pixel variance over all channels after a per-channel lookup table"""
+        levels = lut.astype(np.float64)
+        total = self.count * len(self.histogram)
+        mean = (self.histogram * levels).sum() / total
+        return float((self.histogram * levels ** 2).sum() / total - mean ** 2)
+        
+    def to_dict(self):
+        """Scalar statistics for logging and the control API"""
+        return {
+            'brightness': round(self.brightness, 1),
+            'contrast': round(self.contrast, 1),
+            'noise': round(self.noise, 1),
+            'focus': round(self.focus, 1)
+        }
+
+
+class ImageStatsEngine:
+    """Computes FrameStats on a strided subsample and caches them per frame"""
+        
+    def __init__(self, step=None, cache_size=16):
+        """
+        Args:
+            step (int): Subsample stride in both directions (defaults to config.IMAGE_STATS_STEP)
+            cache_size (int): Number of recent frames whose statistics are kept
+        """
+        self.step = max(1, step or config.IMAGE_STATS_STEP)
+        self.cache_size = cache_size
+        
+        # id(frame) -> (weakref to frame, FrameStats); the weakref guards against id reuse
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        
+        # Statistics
+        self.computed_count = 0
+        self.hit_count = 0
+        
+    def sample(self, frame):
+        """Strided view of a frame (no copy)"""
+        return frame[::self.step, ::self.step]
+        
+    def compute(self, frame):
+        """
+        Get the statistics of a frame, computing them on first use
+        
+        Args:
+            frame (numpy.ndarray): uint8 RGB (H x W x 3) or luma (H x W) frame
+        
+        Returns:
+            FrameStats: Statistics of the frame
+        """
+        key = id(frame)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0]() is frame:
+                self._cache.move_to_end(key)
+                self.hit_count += 1
+                return entry[1]
+        
+        stats = self._compute(self.sample(frame))
+        
+        with self._lock:
+            self.computed_count += 1
+            try:
+                self._cache[key] = (weakref.ref(frame), stats)
+            except TypeError:
+                return stats  # Not weak-referenceable (e.g. a memoryview); just don't cache
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return stats
+        
+    def _compute(self, sample):
+        """Statistics of a subsample"""
+        if sample.ndim == 2:
+            channels = sample[np.newaxis]
+            luma = sample.astype(np.float32)
+        else:
+            channels = np.moveaxis(sample, -1, 0)
+            luma = sample @ LUMA_WEIGHTS.astype(np.float32)
+        
+        histogram = np.stack([np.bincount(c.ravel(), minlength=256) for c in channels])
+        count = int(channels[0].size)
+        
+        # Moments from the histograms: no extra pass over the pixels
+        levels = np.arange(256, dtype=np.float64)
+        total = count * len(histogram)
+        mean = (histogram * levels).sum() / total
+        noise = float((histogram * levels ** 2).sum() / total - mean ** 2)
+        
+        return FrameStats(
+            brightness=float(luma.mean()),
+            contrast=float(luma.std()),
+            noise=noise,
+            focus=self._focus(luma),
+            histogram=histogram,
+            count=count
+        )
+        
+    def _focus(self, luma):
+        """Variance of the 4-neighbour Laplacian (higher is sharper)"""
+        if luma.shape[0] < 3 or luma.shape[1] < 3:
+            return 0.0
+        laplacian = (luma[:-2, 1:-1] + luma[2:, 1:-1] + luma[1:-1, :-2] + luma[1:-1, 2:]
+                     - 4 * luma[1:-1, 1:-1])
+        return float(laplacian.var())
+        
+    def get_stats(self):
+        """Get engine statistics"""
+        return {
+            'step': self.step,
+            'computed': self.computed_count,
+            'cache_hits': self.hit_count
+        }
+
+
+
+class BestShotSelector:
+    """Picks the sharpest of a few candidate frames, stopping once one is sharp enough"""
+        
+    def __init__(self, stats_engine, candidates=None, threshold=None):
+        """
+        Args:
+            stats_engine (ImageStatsEngine): Engine used to score focus
+            candidates (int): Max frames examined per shot (defaults to config.BEST_SHOT_CANDIDATES)
+            threshold (float): Focus score that ends the search early; 0 always
+                examines every candidate (defaults to config.BEST_SHOT_FOCUS_THRESHOLD)
+        """
+        self.stats_engine = stats_engine
+        self.candidates = max(1, candidates or config.BEST_SHOT_CANDIDATES)
+        self.threshold = config.BEST_SHOT_FOCUS_THRESHOLD if threshold is None else threshold
+        
+        # Statistics
+        self.shot_count = 0
+        self.examined_count = 0
+        self.early_stop_count = 0
+        
+    def select(self, candidates, view=None):
+        """
+        Score candidates in order and return the sharpest
+        
+        candidates is consumed lazily, so a generator that reads frames
+        on demand is only advanced until a frame reaches the threshold.
+        
+        Args:
+            candidates (iterable): Frames, or items holding one (see view); None entries are skipped
+            view (callable): Maps an item to the array that is scored (e.g. an ROI crop)
+        
+        Returns:
+            tuple: (best item, its FrameStats), or (None, None) if there was no candidate
+        """
+        best, best_stats = None, None
+        for item in candidates:
+            if item is None:
+                continue
+            self.examined_count += 1
+            stats = self.stats_engine.compute(view(item) if view else item)
+            if best_stats is None or stats.focus > best_stats.focus:
+                best, best_stats = item, stats
+            if self.threshold and stats.focus >= self.threshold:
+                self.early_stop_count += 1
+                break
+        
+        if best is not None:
+            self.shot_count += 1
+        return best, best_stats
+        
+    def get_stats(self):
+        """Get selector statistics"""
+        return {
+            'candidates': self.candidates,
+            'threshold': self.threshold,
+            'shots': self.shot_count,
+            'examined': self.examined_count,
+            'early_stops': self.early_stop_count
+        }
+
+
+# Test function
+if __name__ == "__main__":
+    import time
+    
+    engine = ImageStatsEngine()
+    width, height = config.CAMERA_RESOLUTION
+    test_frame = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    
+    start = time.perf_counter()
+    result = engine.compute(test_frame)
+    strided = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    full = (np.mean(test_frame), np.std(test_frame), np.var(test_frame))
+    full_time = time.perf_counter() - start
+    
+    print(f"Strided (step {engine.step}): {result.to_dict()} in {strided * 1000:.2f} ms")
+    print(f"Full frame mean/std/var: {[round(float(v), 1) for v in full]} in {full_time * 1000:.2f} ms")
+    print(f"Cached: {engine.compute(test_frame) is result}")
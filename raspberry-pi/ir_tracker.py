@@ -0,0 +1,150 @@
+"""
+IR Object Tracker
+Rising/falling-edge state machine for the IR sensor. Each object produces
+exactly one detection when it enters the beam and records its dwell time
+when it leaves, so detection rate is limited by fruit spacing rather than
+a fixed debounce timer.
+"""
+import logging
+from collections import deque
+import config
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+STATE_CLEAR = 'clear'
+STATE_OCCUPIED = 'occupied'
+
+
+class IRObject:
+    """One object passing the IR beam"""
+    
+    __slots__ = ('rise_time', 'fall_time')
+        
+    def __init__(self, rise_time):
+        self.rise_time = rise_time  # time.monotonic() of the rising edge
+        self.fall_time = None
+        
+    @property
+    def dwell_time(self):
+        """Seconds the object blocked the beam, or None while still in it"""
+        if self.fall_time is None:
+            return None
+        return self.fall_time - self.rise_time
+
+
+class IRObjectTracker:
+    """
+    Glitch-filtered edge tracker for the IR sensor
+    
+    feed() records raw level changes with their timestamps. A change only
+    becomes a state transition once the new level has held for
+    glitch_filter seconds; poll() reports confirmed transitions. Pulses
+    shorter than the filter are discarded.
+    
+    Edges are judged by their own timestamps: feed every queued edge
+    before calling poll(), so a glitch whose second edge is still queued
+    is never confirmed just because the caller woke up late.
+    """
+        
+    def __init__(self, glitch_filter=None, history=64):
+        """
+        Args:
+            glitch_filter (float): Seconds a level must hold to count (defaults to config)
+            history (int): Number of dwell times kept for statistics
+        """
+        self.glitch_filter = config.IR_GLITCH_FILTER if glitch_filter is None else glitch_filter
+        self.state = STATE_CLEAR
+        self.current = None  # IRObject in the beam
+        self._raw_present = False
+        self._pending_since = None  # Timestamp of an unconfirmed level change
+        self._confirmed = deque()  # Transitions confirmed by a later edge, not yet polled
+        self.dwell_times = deque(maxlen=history)
+        
+        # Statistics
+        self.object_count = 0
+        self.glitch_count = 0
+        
+    def feed(self, present, timestamp):
+        """
+        Record the sensor level at a moment in time
+        
+        Args:
+            present (bool): True if the beam is blocked (sensor HIGH)
+            timestamp (float): time.monotonic() of the edge or sample
+        """
+        if present == self._raw_present:
+            return
+        self._raw_present = present
+        
+        if self._pending_since is not None and timestamp - self._pending_since >= self.glitch_filter:
+            # The pending level held until this edge, however late it is fed
+            self._confirmed.append(self._confirm())
+        
+        stable_present = self.state == STATE_OCCUPIED
+        if present == stable_present:
+            # Returned to the stable level before the filter elapsed
+            self._pending_since = None
+            self.glitch_count += 1
+        else:
+            self._pending_since = timestamp
+        
+    def time_until_pending(self, now):
+        """
+        Seconds until a pending transition can be confirmed
+        
+        Returns:
+            float: Seconds to wait, or None if nothing is pending
+        """
+        if self._confirmed:
+            return 0.0
+        if self._pending_since is None:
+            return None
+        return max(0.0, self._pending_since + self.glitch_filter - now)
+        
+    def poll(self, now):
+        """
+        Confirm a pending transition whose level has held long enough
+        
+        Call repeatedly until it returns None; several transitions can be
+        confirmed by one batch of edges.
+        
+        Args:
+            now (float): Current time.monotonic(), after all edges up to now were fed
+        
+        Returns:
+            tuple: ('enter', IRObject) or ('exit', IRObject), or None
+        """
+        if self._confirmed:
+            return self._confirmed.popleft()
+        if self._pending_since is None or now - self._pending_since < self.glitch_filter:
+            return None
+        return self._confirm()
+        
+    def _confirm(self):
+        """Apply the pending transition at its edge time"""
+        edge_time = self._pending_since
+        self._pending_since = None
+        
+        if self.state == STATE_CLEAR:
+            self.state = STATE_OCCUPIED
+            self.current = IRObject(edge_time)
+            self.object_count += 1
+            return ('enter', self.current)
+        
+        self.state = STATE_CLEAR
+        obj = self.current
+        self.current = None
+        obj.fall_time = edge_time
+        self.dwell_times.append(obj.dwell_time)
+        return ('exit', obj)
+        
+    def get_stats(self):
+        """Get tracker statistics"""
+        dwell = list(self.dwell_times)
+        return {
+            'state': self.state,
+            'objects': self.object_count,
+            'glitches': self.glitch_count,
+            'avg_dwell_time': sum(dwell) / len(dwell) if dwell else None
+        }
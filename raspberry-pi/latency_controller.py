@@ -0,0 +1,184 @@
+"""
+Latency Budget Controller
+Measures capture -> result latency per fruit against a budget derived
+from belt speed and gate distance, and walks a degradation ladder when
+results come back too late: lower JPEG quality, smaller images,
+enhancement off, and finally classifying every fruit locally. Once the
+latency is comfortably under budget again it steps back up, one rung at
+a time. Separate thresholds and cooldowns keep it from oscillating.
+"""
+import time
+import logging
+import threading
+from collections import deque
+import numpy as np
+import config
+from fruit_registry import camera_triggered, default_result_timeout
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+
+def default_latency_budget():
+    """
+    Seconds allowed from capture to result
+    
+    The fruit must get its result before it reaches the gate. After an IR
+    trigger, capture happens CAPTURE_DELAY after the detection, so that
+    part of the travel time is already spent; camera triggers capture the
+    frame they detected the fruit in, CAMERA_TO_GATE_DISTANCE from the gate.
+    """
+    if config.LATENCY_BUDGET is not None:
+        return config.LATENCY_BUDGET
+    if camera_triggered():
+        return max(0.05, default_result_timeout(config.CAMERA_TO_GATE_DISTANCE))
+    return max(0.05, default_result_timeout() - config.CAPTURE_DELAY)
+
+
+class LatencyController:
+    """Feedback controller stepping the capture quality up and down a ladder"""
+        
+    def __init__(self, camera, pipeline, budget=None, ladder=None):
+        """
+        Args:
+            camera (CameraModule): Camera whose quality settings are adjusted
+            pipeline (ProcessingPipeline): Pipeline whose local fallback is forced on the last rung
+            budget (float): Capture -> result seconds (defaults to default_latency_budget())
+            ladder (list): Rungs from best quality to most degraded (defaults to config.LATENCY_LADDER)
+        """
+        self.camera = camera
+        self.pipeline = pipeline
+        self.budget = budget or default_latency_budget()
+        ladder = ladder or config.LATENCY_LADDER
+        if pipeline.local_classifier is None:
+            # Forcing the local path is meaningless without a local model
+            ladder = [rung for rung in ladder if not rung.get('local_fallback')]
+        self.ladder = ladder
+        
+        # Rungs only ever lower the operator's settings, level 0 restores them
+        self.base_quality = camera.jpeg_quality
+        self.base_enhancement = camera.image_enhancement
+        self.base_output_size = camera.output_size
+        
+        self.level = 0
+        self.samples = deque(maxlen=config.LATENCY_WINDOW)
+        self.transitions = deque(maxlen=32)  # (time.time(), from level, to level, reason)
+        self._last_change = time.monotonic()
+        self._lock = threading.Lock()
+        
+        # Statistics
+        self.observed_count = 0
+        self.over_budget_count = 0
+        self.timeout_count = 0
+        
+    def observe(self, latency):
+        """
+        Record the capture -> result latency of one fruit
+        
+        Args:
+            latency (float): Seconds from capture to the result arriving
+        """
+        with self._lock:
+            self.samples.append(latency)
+            self.observed_count += 1
+            if latency > self.budget:
+                self.over_budget_count += 1
+            self._evaluate()
+        
+    def observe_fruit(self, fruit):
+        """Record a resolved InFlightFruit (ignored if it has no capture time)"""
+        if fruit.capture_time is not None:
+            self.observe(time.monotonic() - fruit.capture_time)
+        
+    def observe_timeout(self):
+        """Record a fruit whose result never arrived (counts as twice the budget)"""
+        self.timeout_count += 1
+        self.observe(2 * self.budget)
+        
+    def set_base_output_size(self, output_size):
+        """Make an operator's new output size the level 0 size and reapply the current rung"""
+        with self._lock:
+            self.base_output_size = output_size
+            self._apply(self.ladder[self.level])
+        
+    def _percentile(self):
+        return float(np.percentile(self.samples, config.LATENCY_PERCENTILE))
+        
+    def _evaluate(self):
+        """Step down or up the ladder if the recent latency calls for it, caller holds the lock"""
+        if len(self.samples) < config.LATENCY_MIN_SAMPLES:
+            return
+        latency = self._percentile()
+        since_change = time.monotonic() - self._last_change
+        
+        if latency > self.budget and self.level < len(self.ladder) - 1 \
+                and since_change >= config.LATENCY_DEGRADE_COOLDOWN:
+            self._set_level(self.level + 1, f"p{config.LATENCY_PERCENTILE} latency "
+                                            f"{latency * 1000:.0f}ms > budget {self.budget * 1000:.0f}ms")
+        elif latency < self.budget * config.LATENCY_RECOVER_RATIO and self.level > 0 \
+                and since_change >= config.LATENCY_RECOVER_COOLDOWN:
+            self._set_level(self.level - 1, f"p{config.LATENCY_PERCENTILE} latency "
+                                            f"{latency * 1000:.0f}ms, headroom regained")
+        
+    def _set_level(self, level, reason):
+        """Move to a ladder rung, caller holds the lock"""
+        previous = self.level
+        self.level = level
+        self._last_change = time.monotonic()
+        self.samples.clear()  # Judge the new rung on its own latencies
+        self.transitions.append((time.time(), previous, level, reason))
+        
+        rung = self.ladder[level]
+        log = logger.warning if level > previous else logger.info
+        log(f"Latency controller: {self.ladder[previous]['name']} -> {rung['name']} ({reason})")
+        self._apply(rung)
+        
+    def _apply(self, rung):
+        """Push a rung's settings to the camera and pipeline"""
+        self.camera.jpeg_quality = min(self.base_quality, rung.get('jpeg_quality', 100))
+        self.camera.image_enhancement = self.base_enhancement and rung.get('enhancement', True)
+        
+        scale = rung.get('output_scale', 1.0)
+        if self.base_output_size is not None:
+            width, height = self.base_output_size
+            output_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+            if output_size != self.camera.output_size:
+                self.camera.set_roi(self.camera.roi, output_size)
+        
+        self.pipeline.force_local = bool(rung.get('local_fallback', False))
+        
+    def get_stats(self):
+        """Get controller statistics, including recent transitions"""
+        with self._lock:
+            return {
+                'level': self.level,
+                'rung': self.ladder[self.level]['name'],
+                'budget': self.budget,
+                'recent_latency': self._percentile() if self.samples else None,
+                'observed': self.observed_count,
+                'over_budget': self.over_budget_count,
+                'timeouts': self.timeout_count,
+                'transitions': [
+                    {'time': t, 'from': self.ladder[a]['name'], 'to': self.ladder[b]['name'], 'reason': reason}
+                    for t, a, b, reason in self.transitions
+                ]
+            }
+
+
+# Test function
+if __name__ == "__main__":
+    from types import SimpleNamespace
+    
+    camera = SimpleNamespace(jpeg_quality=95, image_enhancement=True, roi=None, output_size=(224, 224))
+    camera.set_roi = lambda roi, output_size: setattr(camera, 'output_size', output_size)
+    pipeline = SimpleNamespace(local_classifier=object(), force_local=False)
+    controller = LatencyController(camera, pipeline, budget=0.5)
+    config.LATENCY_DEGRADE_COOLDOWN = config.LATENCY_RECOVER_COOLDOWN = 0
+    
+    print(f"Budget: {controller.budget * 1000:.0f}ms, ladder: {[rung['name'] for rung in controller.ladder]}")
+    for phase, latency in (("overload", 0.8), ("recovery", 0.1)):
+        for _ in range(6 * config.LATENCY_MIN_SAMPLES):
+            controller.observe(latency)
+        print(f"After {phase}: rung {controller.get_stats()['rung']}, quality {camera.jpeg_quality}, "
+              f"size {camera.output_size}, enhancement {camera.image_enhancement}, local {pipeline.force_local}")
+    print(f"Transitions: {len(controller.get_stats()['transitions'])}")
@@ -0,0 +1,247 @@
+"""
+Local Classifier Fallback
+Runs a small quantized model (TFLite or ONNX) on the Pi's CPU for fruit
+whose remote result would miss the gate, or while the broker is down.
+The runtime and model are loaded lazily on the first local
+classification, so deployments that never fall back pay nothing.
+
+Results use the backend's result format plus 'source': 'local', and go
+through the same handle_classification_result path as remote results;
+the registry lets only the first result for a fruit move the gate.
+"""
+import os
+import time
+import logging
+import threading
+import numpy as np
+from PIL import Image
+import config
+
+try:
+    from tflite_runtime.interpreter import Interpreter as TFLiteInterpreter
+    HAS_TFLITE = True
+except ImportError:
+    try:
+        from tensorflow.lite import Interpreter as TFLiteInterpreter
+        HAS_TFLITE = True
+    except ImportError:
+        TFLiteInterpreter = None
+        HAS_TFLITE = False
+
+try:
+    import onnxruntime
+    HAS_ONNXRUNTIME = True
+except ImportError:
+    onnxruntime = None
+    HAS_ONNXRUNTIME = False
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+SOURCE_LOCAL = 'local'
+SOURCE_REMOTE = 'remote'
+
+
+def _softmax(scores):
+    exp = np.exp(scores - scores.max())
+    return exp / exp.sum()
+
+
+class LocalClassifier:
+    """Lazily loaded on-device classifier"""
+        
+    def __init__(self, model_path=None, labels=None, min_confidence=None, threads=None):
+        """
+        Args:
+            model_path (str): .tflite or .onnx model (defaults to config.LOCAL_MODEL_PATH)
+            labels (list): Classification for each model output, in order
+            min_confidence (float): Results below this are discarded (the fruit
+                keeps waiting for the remote result or its timeout)
+            threads (int): CPU threads for the runtime
+        """
+        self.model_path = model_path or config.LOCAL_MODEL_PATH
+        self.labels = labels or config.LOCAL_MODEL_LABELS
+        self.min_confidence = config.LOCAL_MIN_CONFIDENCE if min_confidence is None else min_confidence
+        self.threads = threads or config.LOCAL_MODEL_THREADS
+        
+        self._run = None  # Callable(batch) -> scores, set by load()
+        self.input_size = None  # (width, height)
+        self._input_dtype = None
+        self._input_quant = None  # (scale, zero_point) for quantized inputs
+        self._channels_first = False
+        self._load_failed = False
+        self._lock = threading.Lock()
+        
+        # Statistics
+        self.classified_count = 0
+        self.rejected_count = 0
+        self.total_inference_time = 0.0
+        
+    def is_available(self):
+        """True if the model exists and a runtime for it is installed"""
+        if self._load_failed or not self.model_path or not os.path.exists(self.model_path):
+            return False
+        if self.model_path.endswith('.onnx'):
+            return HAS_ONNXRUNTIME
+        return HAS_TFLITE
+        
+    def load(self):
+        """
+        Load the model (done automatically on first classify)
+        
+        Returns:
+            bool: True if the model is ready
+        """
+        with self._lock:
+            if self._run is not None:
+                return True
+            if not self.is_available():
+                logger.error(f"Local model not available: {self.model_path}")
+                return False
+            try:
+                if self.model_path.endswith('.onnx'):
+                    self._load_onnx()
+                else:
+                    self._load_tflite()
+                logger.info(f"Local model loaded: {os.path.basename(self.model_path)}, "
+                            f"input {self.input_size}, {len(self.labels)} labels")
+                return True
+            except Exception as e:
+                self._load_failed = True
+                logger.error(f"Failed to load local model: {e}")
+                return False
+        
+    def _load_tflite(self):
+        interpreter = TFLiteInterpreter(model_path=self.model_path, num_threads=self.threads)
+        interpreter.allocate_tensors()
+        input_detail = interpreter.get_input_details()[0]
+        output_detail = interpreter.get_output_details()[0]
+        
+        _, height, width, _ = input_detail['shape']
+        self.input_size = (int(width), int(height))
+        self._input_dtype = input_detail['dtype']
+        scale, zero_point = input_detail.get('quantization', (0.0, 0))
+        self._input_quant = (scale, zero_point) if scale else None
+        out_scale, out_zero_point = output_detail.get('quantization', (0.0, 0))
+            
+        def run(batch):
+            interpreter.set_tensor(input_detail['index'], batch)
+            interpreter.invoke()
+            scores = interpreter.get_tensor(output_detail['index'])[0].astype(np.float32)
+            if out_scale:
+                scores = (scores - out_zero_point) * out_scale
+            return scores
+        
+        self._run = run
+        
+    def _load_onnx(self):
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = self.threads
+        session = onnxruntime.InferenceSession(self.model_path, options,
+                                               providers=['CPUExecutionProvider'])
+        model_input = session.get_inputs()[0]
+        shape = model_input.shape
+        
+        # Accept NCHW (PyTorch exports) and NHWC models
+        self._channels_first = shape[1] == 3
+        height, width = (shape[2], shape[3]) if self._channels_first else (shape[1], shape[2])
+        self.input_size = (int(width), int(height))
+        self._input_dtype = np.uint8 if model_input.type == 'tensor(uint8)' else np.float32
+            
+        def run(batch):
+            return np.asarray(session.run(None, {model_input.name: batch})[0][0], dtype=np.float32)
+        
+        self._run = run
+        
+    def _preprocess(self, frame):
+        """RGB frame -> model input batch"""
+        if (frame.shape[1], frame.shape[0]) != self.input_size:
+            frame = np.asarray(Image.fromarray(frame).resize(self.input_size, Image.BILINEAR))
+        
+        if self._input_dtype == np.uint8:
+            batch = frame
+        elif self._input_quant:
+            scale, zero_point = self._input_quant
+            batch = np.clip(np.rint(frame / 255.0 / scale + zero_point), -128, 127).astype(self._input_dtype)
+        else:
+            batch = frame.astype(np.float32) / 255.0
+        
+        if self._channels_first:
+            batch = np.transpose(batch, (2, 0, 1))
+        return np.ascontiguousarray(batch[np.newaxis])
+        
+    def classify(self, frame, fruit_id=None):
+        """
+        Classify an enhanced RGB frame on the CPU
+        
+        Args:
+            frame (numpy.ndarray): uint8 RGB frame
+            fruit_id (str): In-flight registry ID, returned as correlation_id
+        
+        Returns:
+            dict: Result in the backend's format with 'source': 'local', or
+                None if the model is unavailable or not confident enough
+        """
+        if self._run is None and not self.load():
+            return None
+        
+        start = time.perf_counter()
+        try:
+            scores = self._run(self._preprocess(frame))
+        except Exception as e:
+            logger.error(f"Local classification failed: {e}")
+            return None
+        inference_time = time.perf_counter() - start
+        self.total_inference_time += inference_time
+        
+        # Models without a softmax head return logits
+        if scores.min() < 0 or scores.max() > 1 or not np.isclose(scores.sum(), 1.0, atol=0.05):
+            scores = _softmax(scores)
+        
+        best = int(np.argmax(scores))
+        confidence = float(scores[best])
+        classification = self.labels[best] if best < len(self.labels) else config.CLASSIFICATION_OTHER
+        
+        if confidence < self.min_confidence:
+            self.rejected_count += 1
+            logger.info(f"Local result {classification} ({confidence:.2%}) below "
+                        f"{self.min_confidence:.0%}, not used")
+            return None
+        
+        self.classified_count += 1
+        logger.info(f"Local classification: {classification} ({confidence:.2%}) "
+                    f"in {inference_time * 1000:.0f}ms")
+        result = {
+            'classification': classification,
+            'confidence': confidence,
+            'source': SOURCE_LOCAL,
+            'inference_time': inference_time
+        }
+        if fruit_id:
+            result['correlation_id'] = fruit_id
+        return result
+        
+    def get_stats(self):
+        """Get classifier statistics"""
+        count = self.classified_count + self.rejected_count
+        return {
+            'model': self.model_path,
+            'loaded': self._run is not None,
+            'classified': self.classified_count,
+            'rejected': self.rejected_count,
+            'avg_inference_time': self.total_inference_time / count if count else None
+        }
+
+
+# Test function
+if __name__ == "__main__":
+    classifier = LocalClassifier()
+    print(f"Model: {classifier.model_path}")
+    print(f"TFLite runtime: {HAS_TFLITE}, ONNX Runtime: {HAS_ONNXRUNTIME}")
+    if classifier.is_available():
+        width, height = config.CAMERA_OUTPUT_SIZE or (224, 224)
+        test_frame = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+        print(f"Result: {classifier.classify(test_frame)}")
+        print(f"Stats: {classifier.get_stats()}")
+    else:
+        print("Model or runtime not available")
@@ -6,10 +6,23 @@ import time
 import logging
 import signal
 import sys
-import RPi.GPIO as GPIO
+import functools
 from camera_module import CameraModule
 from motor_controller import MotorController
 from rabbitmq_client import RabbitMQClient
+from pipeline import ProcessingPipeline, PipelineStage, POLICY_BLOCK
+from fruit_registry import FruitRegistry, camera_triggered
+from gpio_events import GPIOEventSource, load_gpio
+from ir_tracker import IRObjectTracker
+from presence_detector import PresenceDetector
+from fruit_tracker import CentroidTracker
+from local_classifier import LocalClassifier
+from result_cache import ResultCache, SOURCE_CACHE
+from latency_controller import LatencyController
+from metrics import MetricsFileExporter
+from camera_settings import CameraSettingsWatcher
+from tracing import Tracer
+import metrics
 import config
 
 logging.basicConfig(
@@ -20,13 +33,48 @@ logger = logging.getLogger(__name__)
 
 
 class FruitSortingSystem:
-    def __init__(self):
-        """Initialize the fruit sorting system"""
+    def __init__(self, gpio_backend=None):
+        """
+        Initialize the fruit sorting system
+        
+        Args:
+            gpio_backend: GPIO module for the sensors and motors (defaults to RPi.GPIO, FakeGPIO for tests)
+        """
+        self.gpio = load_gpio(gpio_backend)
         self.camera = CameraModule()
-        self.motor = MotorController()
+        self.motor = MotorController(gpio=self.gpio)
         self.rabbitmq = RabbitMQClient(result_callback=self.handle_classification_result)
+        self.registry = FruitRegistry(on_timeout=self.handle_result_timeout)
+        self.tracer = Tracer(config.TRACE_DIR) if config.TRACING_ENABLED else None
+        self.pipeline = ProcessingPipeline(
+            self.camera, self.rabbitmq,
+            device_id='rpi_conveyor_01',
+            registry=self.registry,
+            local_classifier=LocalClassifier() if config.LOCAL_CLASSIFIER_ENABLED else None,
+            on_local_result=self.handle_classification_result,
+            result_cache=ResultCache() if config.RESULT_CACHE_ENABLED else None,
+            tracer=self.tracer
+        )
+        # Steps capture quality down when results risk missing the gate
+        self.latency = LatencyController(self.camera, self.pipeline) if config.LATENCY_CONTROL_ENABLED else None
+        # Single worker: gate actions run one at a time, in the order results arrive
+        self.actuator = PipelineStage('actuate', self._actuate, config.ACTUATOR_QUEUE_SIZE, POLICY_BLOCK)
         self.is_running = False
-        self.last_ir_detection = 0  # Track last IR sensor trigger time
+        self.ir_tracker = IRObjectTracker()  # One detection per object passing the beam
+        self.presence = PresenceDetector()  # Same, for objects entering the camera's trigger zone
+        self.fruit_tracker = CentroidTracker()  # One capture per fruit in continuous mode
+        self.gpio_events = None  # GPIOEventSource in interrupt mode
+        self.estop_active = False
+        
+        # ROI/output size changes posted to the control server (a separate process)
+        self.camera_settings = CameraSettingsWatcher(self.apply_camera_settings)
+        
+        # Metrics snapshot served by the control server at /metrics
+        self.metrics_exporter = MetricsFileExporter(metrics.REGISTRY) if config.METRICS_ENABLED else None
+        metrics.QUEUE_DEPTH.set_function(self._queue_depths)
+        if self.latency:
+            metrics.REGISTRY.gauge('degradation_level', 'Latency controller ladder rung (0 = full quality)') \
+                .set_function(lambda: self.latency.level)
         
     def initialize(self):
         """Initialize all components"""
@@ -42,32 +90,107 @@ class FruitSortingSystem:
             logger.error("Failed to initialize motor controller")
             return False
         
-        # Initialize RabbitMQ connection
-        if not self.rabbitmq.connect():
-            logger.error("Failed to connect to RabbitMQ")
-            logger.info("Attempting to reconnect...")
-            if not self.rabbitmq.reconnect(max_attempts=3):
-                logger.error("Could not establish RabbitMQ connection")
-                return False
+        # Connect to RabbitMQ in the background; sorting keeps running while it
+        # is down (images are spooled, unanswered fruit take the default route)
+        if not self.rabbitmq.start():
+            logger.warning("RabbitMQ not reachable yet, continuing while reconnecting in background")
         
         # Start consuming classification results
         self.rabbitmq.start_consuming_results()
         
-        # Setup IR sensor if in IR mode
-        if config.TRIGGER_MODE == 'ir_sensor':
-            GPIO.setmode(GPIO.BCM)
-            GPIO.setup(config.IR_SENSOR_PIN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-            logger.info(f"IR sensor configured on GPIO {config.IR_SENSOR_PIN}")
+        # Start capture/enhance/encode/publish workers
+        self.registry.start()
+        self.pipeline.start()
+        self.actuator.start()
         
-        # Setup emergency stop if enabled
-        if config.USE_EMERGENCY_STOP:
-            GPIO.setmode(GPIO.BCM)
-            GPIO.setup(config.EMERGENCY_STOP_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-            logger.info("Emergency stop button configured")
+        # Keep the camera streaming so captures pick an already-taken frame
+        if config.FRAME_BUFFER_SIZE:
+            self.camera.start_frame_buffer()
+        
+        if self.metrics_exporter:
+            self.metrics_exporter.start()
+        if self.tracer:
+            self.tracer.start()
+        self.camera_settings.start()
+        
+        if config.IR_DETECTION_MODE == 'interrupt':
+            self._setup_gpio_events()
+        else:
+            # Setup IR sensor if in IR mode
+            if config.TRIGGER_MODE == 'ir_sensor':
+                self.gpio.setmode(self.gpio.BCM)
+                self.gpio.setup(config.IR_SENSOR_PIN, self.gpio.IN, pull_up_down=self.gpio.PUD_DOWN)
+                logger.info(f"IR sensor configured on GPIO {config.IR_SENSOR_PIN}")
+            
+            # Setup emergency stop if enabled
+            if config.USE_EMERGENCY_STOP:
+                self.gpio.setmode(self.gpio.BCM)
+                self.gpio.setup(config.EMERGENCY_STOP_PIN, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+                logger.info("Emergency stop button configured")
         
         logger.info("=== System Initialized Successfully ===")
         return True
     
+    def _setup_gpio_events(self):
+        """Enable edge-triggered IR and emergency-stop detection"""
+        self.gpio_events = GPIOEventSource(gpio=self.gpio)
+        gpio = self.gpio
+        
+        if config.TRIGGER_MODE == 'ir_sensor':
+            self.gpio_events.watch(config.IR_SENSOR_PIN, gpio.PUD_DOWN,
+                                   bouncetime=config.GPIO_BOUNCE_TIME_MS)
+            logger.info(f"IR sensor configured on GPIO {config.IR_SENSOR_PIN} (interrupt)")
+        
+        if config.USE_EMERGENCY_STOP:
+            # Emit the current level so a button held at startup is honoured
+            self.gpio_events.watch(config.EMERGENCY_STOP_PIN, gpio.PUD_UP,
+                                   bouncetime=config.GPIO_BOUNCE_TIME_MS, emit_initial=True)
+            logger.info("Emergency stop button configured (interrupt)")
+    
+    def handle_gpio_event(self, event):
+        """
+        Handle a timestamped edge from the IR sensor or emergency stop
+        
+        Args:
+            event (GPIOEvent): Edge event from GPIOEventSource
+        """
+        gpio = self.gpio
+        
+        if config.USE_EMERGENCY_STOP and event.pin == config.EMERGENCY_STOP_PIN:
+            # Button pressed = LOW (pull-up resistor)
+            pressed = event.level == gpio.LOW
+            if pressed and not self.estop_active:
+                logger.warning("EMERGENCY STOP ACTIVATED!")
+                self.estop_active = True
+                self.motor.stop_conveyor()
+            elif not pressed and self.estop_active:
+                logger.info("Emergency stop released, resuming...")
+                self.estop_active = False
+                self.motor.start_conveyor()
+            return
+        
+        if event.pin == config.IR_SENSOR_PIN:
+            self.ir_tracker.feed(event.level == gpio.HIGH, event.timestamp)
+    
+    def _poll_ir_tracker(self, now):
+        """
+        Confirm pending IR transitions
+        
+        Returns:
+            list: IRObjects that just entered the beam, oldest first
+        """
+        entered = []
+        while True:
+            transition = self.ir_tracker.poll(now)
+            if transition is None:
+                return entered
+            
+            kind, obj = transition
+            if kind == 'exit':
+                logger.debug(f"Object left IR beam, dwell time {obj.dwell_time * 1000:.0f}ms")
+            else:
+                entered.append(obj)
+    
     def handle_classification_result(self, result):
         """
         Handle classification result from backend
@@ -75,18 +198,163 @@ class FruitSortingSystem:
         Args:
             result (dict): Classification result with category and confidence
         """
+        received = time.monotonic()
         try:
             classification = result.get('classification', config.CLASSIFICATION_OTHER)
             confidence = result.get('confidence', 0.0)
             
             logger.info(f"Classification: {classification} (confidence: {confidence:.2%})")
             
-            # Perform sorting action
-            self.motor.sort_fruit(classification)
+            # Match the result to its fruit; late or duplicate results never move the gate
+            fruit_id = result.get('correlation_id') or result.get('fruit_id') \
+                or result.get('metadata', {}).get('fruit_id')
+            if fruit_id:
+                fruit = self.registry.resolve(fruit_id, remote=result.get('source', 'remote') == 'remote')
+            else:
+                # Backend did not echo an ID: assume results arrive in publish order
+                fruit = self.registry.resolve_oldest()
+            
+            if fruit is None:
+                logger.warning("Result does not match any fruit in flight, ignoring")
+                self._observe_duplicate_latency(fruit_id, result)
+                return
+            metrics.RESULTS_RECEIVED.inc()
+            
+            if result.get('source') != SOURCE_CACHE:
+                self.pipeline.record_result(fruit.fruit_id, classification, confidence)
+            source = result.get('source', 'remote')
+            if self.latency and source == 'remote':
+                self.latency.observe_fruit(fruit)
+            
+            trace = self.tracer.get(fruit.fruit_id) if self.tracer else None
+            if trace:
+                if source == 'remote' and fruit.publish_time is not None:
+                    publish = trace.find('publish')
+                    round_trip = trace.add_span('broker_round_trip', fruit.publish_time, received,
+                                                parent_id=publish.span_id if publish else False)
+                    trace.add_remote_spans(result.get('spans'), round_trip)
+                trace.add_span('result_handling', received, source=source, classification=classification,
+                               confidence=confidence)
+            
+            # Queue the sorting action; the consumer thread goes back to the network
+            self.actuator.put((classification, fruit, trace, source))
             
         except Exception as e:
             logger.error(f"Error handling classification result: {e}")
     
+    def _observe_duplicate_latency(self, fruit_id, result):
+        """
+        Feed the latency controller with a remote result that lost to a local one
+        
+        On the local_fallback rung every fruit is resolved locally first;
+        the remote results are the only measure of whether the backend has
+        recovered, so they must still reach the controller.
+        """
+        if not self.latency or not fruit_id or result.get('source', 'remote') != 'remote':
+            return
+        outcome, fruit = self.registry.recent_outcome(fruit_id)
+        if outcome == 'resolved':
+            self.latency.observe_fruit(fruit)
+    
+    def handle_result_timeout(self, fruit):
+        """
+        Route a fruit whose result did not arrive before its deadline
+        
+        Args:
+            fruit (InFlightFruit): The expired fruit
+        """
+        metrics.RESULT_TIMEOUTS.inc()
+        if self.latency:
+            self.latency.observe_timeout()
+        
+        trace = self.tracer.get(fruit.fruit_id) if self.tracer else None
+        if trace:
+            trace.add_span('result_timeout', fruit.deadline)
+        
+        route = config.RESULT_TIMEOUT_ROUTE
+        if route is None:
+            if self.tracer:
+                self.tracer.finish(trace, 'timeout')
+            return
+        
+        logger.warning(f"Routing fruit {fruit.fruit_id} to default: {route}")
+        self.actuator.put((route, fruit, trace, 'timeout'))
+    
+    def _actuate(self, action):
+        """
+        Actuator worker: perform one queued sorting action
+        
+        Args:
+            action (tuple): (classification, fruit, trace, outcome), where fruit is the
+                InFlightFruit and outcome is the result source or 'timeout' (the trace status)
+        
+        Returns:
+            tuple: The action if the gate accepted it, None otherwise
+        """
+        classification, fruit, trace, outcome = action
+        start = time.monotonic()
+        accepted = self.motor.sort_fruit(classification, detection_time=fruit.detection_time,
+                                         gate_distance=fruit.gate_distance,
+                                         on_done=functools.partial(self._gate_moved, classification,
+                                                                   trace, outcome))
+        end = time.monotonic()
+        if not accepted:
+            if trace:
+                trace.add_span('servo', start, end, classification=classification, accepted=False,
+                               mode=config.SORTING_MODE)
+                self.tracer.finish(trace, 'gate_rejected')
+            return None
+        
+        if config.SORTING_MODE == 'scheduled':
+            metrics.SCHEDULING_TIME.observe(end - start)
+            if trace:
+                trace.add_span('schedule', start, end, classification=classification)
+        metrics.GATE_ACTIONS.inc()
+        return action
+        
+    def _gate_moved(self, classification, trace, outcome, fired, start, end):
+        """
+        Gate move callback: runs when the servo has actually moved, which in
+        scheduled mode is on the scheduler thread, long after _actuate returned,
+        so this is where the servo span is recorded and the trace closed
+        
+        Args:
+            classification (str): Classification the gate was set for
+            trace (Trace): The fruit's trace, or None
+            outcome (str): Trace status if the move was made
+            fired (bool): True if the servo moved, False if the fruit was missed
+            start (float): time.monotonic() the move started
+            end (float): time.monotonic() the move ended
+        """
+        if fired:
+            metrics.ACTUATION_TIME.observe(end - start)
+        if trace:
+            trace.add_span('servo', start, end, classification=classification, accepted=True,
+                           fired=fired, mode=config.SORTING_MODE)
+            self.tracer.finish(trace, outcome if fired else 'gate_missed')
+        
+    def apply_camera_settings(self, settings):
+        """
+        Apply camera settings requested through the control server
+        
+        Args:
+            settings (dict): 'roi' and 'output_size' as written by camera_settings.write_settings()
+        """
+        roi = settings.get('roi', self.camera.roi)
+        output_size = settings.get('output_size', self.camera.output_size)
+        if not self.camera.set_roi(roi, output_size):
+            return
+        if self.latency:
+            # The requested size is the new full-quality size; the current rung scales it down
+            self.latency.set_base_output_size(self.camera.output_size)
+        logger.info(f"Camera settings applied: ROI {self.camera.roi}, output size {self.camera.output_size}")
+    
+    def _queue_depths(self):
+        """Items waiting in each pipeline queue, plus fruit awaiting a result"""
+        depths = {stage.name: stage.queue.qsize() for stage in self.pipeline.stages + [self.actuator]}
+        depths['in_flight'] = self.registry.in_flight_count()
+        return depths
+    
     def check_emergency_stop(self):
         """
         Check if emergency stop button is pressed
@@ -96,53 +364,84 @@ class FruitSortingSystem:
         """
         if config.USE_EMERGENCY_STOP:
             # Button pressed = LOW (pull-up resistor)
-            return GPIO.input(config.EMERGENCY_STOP_PIN) == GPIO.LOW
+            return self.gpio.input(config.EMERGENCY_STOP_PIN) == self.gpio.LOW
         return False
     
     def detect_fruit_ir(self):
         """
-        Check if fruit is detected by IR sensor with debouncing
+        Sample the IR sensor and check for newly entered objects
         
         Returns:
-            bool: True if fruit detected and debounce time passed
+            list: IRObjects that just entered the beam
         """
         # Read sensor (HIGH when object detected)
-        if GPIO.input(config.IR_SENSOR_PIN) == GPIO.HIGH:
-            current_time = time.time()
-            # Check debounce time
-            if current_time - self.last_ir_detection >= config.IR_DEBOUNCE_TIME:
-                self.last_ir_detection = current_time
-                return True
-        return False
+        now = time.monotonic()
+        self.ir_tracker.feed(self.gpio.input(config.IR_SENSOR_PIN) == self.gpio.HIGH, now)
+        return self._poll_ir_tracker(now)
+    
+    def detect_fruit_presence(self):
+        """
+        Sample a lores frame and check for an object entering the trigger zone
+        
+        Returns:
+            IRObject: The object that just entered the zone, or None
+        """
+        luma = self.camera.capture_lores()
+        if luma is None:
+            return None
+        
+        transition = self.presence.update(luma, time.monotonic())
+        if transition is None:
+            return None
+        
+        kind, obj = transition
+        if kind == 'exit':
+            logger.debug(f"Object left trigger zone, dwell time {obj.dwell_time * 1000:.0f}ms")
+            return None
+        return obj
+    
+    def track_fruit(self):
+        """
+        Sample a lores frame, update the fruit tracks and capture each
+        fruit once, at the frame where it was best placed in view
+        """
+        luma = self.camera.capture_lores()
+        if luma is None:
+            return
+        
+        for track in self.fruit_tracker.update(luma, time.monotonic()):
+            logger.info(f"Fruit track {track.track_id} ready for capture")
+            self.process_fruit(trigger_time=track.best_time, capture_at=track.best_time,
+                               track_id=track.track_id, gate_distance=config.CAMERA_TO_GATE_DISTANCE)
     
-    def process_fruit(self):
-        """Process detected fruit: capture image and send for classification"""
+    def process_fruit(self, trigger_time=None, capture_at=None, track_id=None, gate_distance=None):
+        """
+        Queue detected fruit for capture and classification
+        
+        Capture, enhancement, encoding and publishing run on the pipeline
+        workers, so this returns immediately and the main loop keeps
+        watching the sensors.
+        
+        Args:
+            trigger_time (float): time.monotonic() of the detection (defaults to now)
+            capture_at (float): time.monotonic() the frame should show
+                (defaults to trigger_time + CAPTURE_DELAY)
+            track_id (int): Fruit tracker ID in continuous mode
+            gate_distance (float): Belt mm from the detection point to the gate
+                (None = detected at the IR sensor)
+        """
         try:
             logger.info("Fruit detected! Processing...")
             
-            # Small delay for positioning
-            time.sleep(config.CAPTURE_DELAY)
-            
-            # Capture image
-            image_bytes = self.camera.capture_image()
-            if not image_bytes:
-                logger.error("Failed to capture image")
-                return
-            
-            # Send image to backend for classification
-            metadata = {
-                'timestamp': time.time(),
-                'device_id': 'rpi_conveyor_01'
-            }
+            if trigger_time is None:
+                trigger_time = time.monotonic()
             
-            if self.rabbitmq.send_image(image_bytes, metadata):
-                logger.info("Image sent for classification")
-            else:
-                logger.error("Failed to send image to backend")
-                # Try to reconnect
-                if not self.rabbitmq.is_connected:
-                    logger.info("Attempting to reconnect to RabbitMQ...")
-                    self.rabbitmq.reconnect(max_attempts=3)
+            fruit_id = self.registry.register(trigger_time, gate_distance=gate_distance)
+            metrics.FRUIT_DETECTED.inc()
+            if not self.pipeline.submit(trigger_time, fruit_id=fruit_id, capture_at=capture_at,
+                                        track_id=track_id):
+                metrics.FRUIT_DROPPED.inc()
+                logger.warning("Pipeline busy, fruit dropped")
             
         except Exception as e:
             logger.error(f"Error processing fruit: {e}")
@@ -160,10 +459,38 @@ class FruitSortingSystem:
         # Time-based triggering variables
         last_capture_time = 0
         
+        # Event-driven modes only need to wake up for edges
+        event_timeout = 0.5 if config.TRIGGER_MODE in ('ir_sensor', 'manual') else 0.1
+        lores_sampling = camera_triggered()
+        if lores_sampling:
+            event_timeout = config.PRESENCE_SAMPLE_INTERVAL
+        
         try:
             while self.is_running:
+                if self.gpio_events:
+                    # Interrupt mode - sleep until an edge arrives (IR and e-stop),
+                    # or until a pending IR edge has passed the glitch filter
+                    timeout = event_timeout
+                    pending = self.ir_tracker.time_until_pending(time.monotonic())
+                    if pending is not None:
+                        timeout = min(timeout, pending)
+                    
+                    # Feed every queued edge before polling: a late wake-up must not
+                    # confirm a glitch whose closing edge is still in the queue
+                    for event in self.gpio_events.get_batch(timeout=timeout):
+                        self.handle_gpio_event(event)
+                    
+                    entered = self._poll_ir_tracker(time.monotonic())
+                    if self.estop_active:
+                        continue
+                    if config.TRIGGER_MODE == 'ir_sensor':
+                        for obj in entered:
+                            logger.info("Fruit detected by IR sensor!")
+                            # Capture delay is measured from the edge, not from when we got here
+                            self.process_fruit(trigger_time=obj.rise_time)
+                
                 # Check emergency stop
-                if self.check_emergency_stop():
+                elif self.check_emergency_stop():
                     logger.warning("EMERGENCY STOP ACTIVATED!")
                     self.motor.stop_conveyor()
                     while self.check_emergency_stop():
@@ -171,11 +498,20 @@ class FruitSortingSystem:
                     logger.info("Emergency stop released, resuming...")
                     self.motor.start_conveyor()
                 
-                # IR Sensor mode - detect fruit presence
+                # IR Sensor mode - detect fruit presence (edges are handled above in interrupt mode)
                 if config.TRIGGER_MODE == 'ir_sensor':
-                    if self.detect_fruit_ir():
+                    for obj in ([] if self.gpio_events else self.detect_fruit_ir()):
                         logger.info("Fruit detected by IR sensor!")
-                        self.process_fruit()
+                        self.process_fruit(trigger_time=obj.rise_time)
+                
+                # Presence mode - an object entered the camera's trigger zone
+                elif config.TRIGGER_MODE == 'presence':
+                    entered = self.detect_fruit_presence()
+                    if entered is not None:
+                        logger.info("Fruit detected in camera trigger zone!")
+                        # The fruit is in view now: capture this moment, not CAPTURE_DELAY later
+                        self.process_fruit(trigger_time=entered.rise_time, capture_at=entered.rise_time,
+                                           gate_distance=config.CAMERA_TO_GATE_DISTANCE)
                 
                 # Time-based triggering
                 elif config.TRIGGER_MODE == 'time_based':
@@ -184,16 +520,20 @@ class FruitSortingSystem:
                         last_capture_time = current_time
                         self.process_fruit()
                 
-                # Continuous mode - process as fast as possible
+                # Continuous mode - one capture per tracked fruit, or every interval
                 elif config.TRIGGER_MODE == 'continuous':
-                    self.process_fruit()
-                    time.sleep(config.CAPTURE_INTERVAL)
+                    if config.CONTINUOUS_TRACKING:
+                        self.track_fruit()
+                    else:
+                        self.process_fruit()
+                        time.sleep(config.CAPTURE_INTERVAL)
                 
                 # Manual mode - wait for external trigger (future: API endpoint)
                 # In manual mode, just keep conveyor running
                 
                 # Small delay to prevent CPU overload
-                time.sleep(0.1)
+                if not self.gpio_events:
+                    time.sleep(config.PRESENCE_SAMPLE_INTERVAL if lores_sampling else 0.1)
                 
         except KeyboardInterrupt:
             logger.info("System interrupted by user")
@@ -207,9 +547,23 @@ class FruitSortingSystem:
         logger.info("=== Cleaning up system ===")
         self.is_running = False
         
+        # Stop edge detection
+        if self.gpio_events:
+            self.gpio_events.close()
+        
+        # Stop pipeline workers
+        self.pipeline.stop()
+        self.registry.stop()
+        self.actuator.stop()
+        self.camera_settings.stop()
+        if self.metrics_exporter:
+            self.metrics_exporter.stop()
+        if self.tracer:
+            self.tracer.stop()
+        
         # Stop motors
         self.motor.stop_conveyor()
-        self.motor.cleanup()  # This handles GPIO.cleanup()
+        self.motor.cleanup()  # This handles GPIO cleanup
         
         # Stop camera
         self.camera.cleanup()
@@ -0,0 +1,149 @@
+"""
+Message Formats for Image and Result Messages
+The AMQP content_type identifies the format so old and new consumers can
+share the queues during rollout:
+
+- 'image/jpeg' (version 2): body is the raw JPEG, metadata in the AMQP headers
+- 'application/x-fruit-envelope' (version 2): 4-byte big-endian length,
+  msgpack metadata, then the raw JPEG (needs msgpack)
+- 'application/json' (version 1, default): {"image": <hex>, "metadata": {...}}
+
+JSON stays the default so a backend that has not been updated keeps
+working; deployments opt in to 'binary' or 'envelope' via MESSAGE_FORMAT.
+"""
+import json
+import struct
+import logging
+import config
+
+try:
+    import msgpack
+    HAS_MSGPACK = True
+except ImportError:
+    msgpack = None
+    HAS_MSGPACK = False
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 2
+FORMAT_VERSION_HEADER = 'x-format-version'
+
+CONTENT_TYPE_JPEG = 'image/jpeg'
+CONTENT_TYPE_ENVELOPE = 'application/x-fruit-envelope'
+CONTENT_TYPE_JSON = 'application/json'
+CONTENT_TYPE_MSGPACK = 'application/x-msgpack'
+
+FORMAT_CONTENT_TYPES = {
+    'binary': CONTENT_TYPE_JPEG,
+    'envelope': CONTENT_TYPE_ENVELOPE,
+    'json': CONTENT_TYPE_JSON
+}
+
+_LENGTH_PREFIX = struct.Struct('>I')
+
+
+def resolve_format(fmt=None):
+    """
+    Pick the image message format, falling back when msgpack is missing
+    
+    Args:
+        fmt (str): 'binary', 'envelope' or 'json' (defaults to config.MESSAGE_FORMAT)
+    
+    Returns:
+        str: The format that will actually be used
+    """
+    fmt = fmt or config.MESSAGE_FORMAT
+    if fmt not in FORMAT_CONTENT_TYPES:
+        logger.warning(f"Unknown message format '{fmt}', using 'json'")
+        return 'json'
+    if fmt == 'envelope' and not HAS_MSGPACK:
+        logger.warning("msgpack not installed - using 'binary' message format")
+        return 'binary'
+    return fmt
+
+
+def encode_image_message(image_bytes, metadata, fmt='json'):
+    """
+    Build the body and AMQP properties for an image message
+    
+    Args:
+        image_bytes (bytes): JPEG data
+        metadata (dict): Flat metadata (timestamp, device_id, fruit_id, ...)
+        fmt (str): Resolved format from resolve_format()
+    
+    Returns:
+        tuple: (body, content_type, headers)
+    """
+    if fmt == 'json':
+        body = json.dumps({'image': image_bytes.hex(), 'metadata': metadata})
+        return body, CONTENT_TYPE_JSON, None
+    
+    headers = {FORMAT_VERSION_HEADER: FORMAT_VERSION}
+    
+    if fmt == 'envelope':
+        packed = msgpack.packb(metadata, use_bin_type=True)
+        body = _LENGTH_PREFIX.pack(len(packed)) + packed + image_bytes
+        return body, CONTENT_TYPE_ENVELOPE, headers
+    
+    # 'binary': raw JPEG body, metadata travels as AMQP headers
+    headers.update(metadata)
+    return image_bytes, CONTENT_TYPE_JPEG, headers
+
+
+def decode_image_message(body, content_type, headers=None):
+    """
+    Parse an image message in any supported format (consumer side)
+    
+    Args:
+        body (bytes): Message body
+        content_type (str): AMQP content_type
+        headers (dict): AMQP headers
+    
+    Returns:
+        tuple: (image_bytes, metadata)
+    """
+    if content_type == CONTENT_TYPE_JPEG:
+        metadata = {k: v for k, v in (headers or {}).items() if k != FORMAT_VERSION_HEADER}
+        return bytes(body), metadata
+    
+    if content_type == CONTENT_TYPE_ENVELOPE:
+        if not HAS_MSGPACK:
+            raise ValueError("msgpack is required to decode envelope messages")
+        (length,) = _LENGTH_PREFIX.unpack_from(body, 0)
+        start = _LENGTH_PREFIX.size
+        metadata = msgpack.unpackb(body[start:start + length], raw=False)
+        return bytes(body[start + length:]), metadata
+    
+    # Legacy JSON (also used when content_type is missing)
+    message = json.loads(body)
+    return bytes.fromhex(message['image']), message.get('metadata', {})
+
+
+def decode_result(body, content_type=None):
+    """
+    Parse a classification result
+    
+    JSON stays the default so results from existing backends keep working;
+    msgpack results are accepted when the backend sends them.
+    
+    Args:
+        body (bytes): Message body
+        content_type (str): AMQP content_type
+    
+    Returns:
+        dict: Classification result
+    """
+    if content_type == CONTENT_TYPE_MSGPACK:
+        if not HAS_MSGPACK:
+            raise ValueError("msgpack is required to decode msgpack results")
+        return msgpack.unpackb(body, raw=False)
+    return json.loads(body)
+
+
+def accepted_result_types():
+    """Result content types this client can read, for the backend to negotiate"""
+    types = [CONTENT_TYPE_JSON]
+    if HAS_MSGPACK:
+        types.append(CONTENT_TYPE_MSGPACK)
+    return ','.join(types)
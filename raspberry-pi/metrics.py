@@ -0,0 +1,295 @@
+"""
+Pipeline Metrics
+Counters, gauges and fixed-bucket histograms for the sorting loop,
+rendered in the Prometheus text exposition format. Recording is a
+bisect and two increments under a lock, cheap enough for every fruit.
+
+main.py and control_server.py run as separate processes, so main.py
+periodically writes the rendered metrics to METRICS_FILE and the control
+server's /metrics endpoint serves that file.
+"""
+import os
+import time
+import bisect
+import logging
+import threading
+import config
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonically increasing count"""
+    
+    kind = 'counter'
+        
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.value = 0
+        self._lock = threading.Lock()
+        
+    def inc(self, amount=1):
+        """Add to the counter"""
+        with self._lock:
+            self.value += amount
+        
+    def samples(self):
+        """(name, labels, value) tuples for rendering"""
+        return [(self.name, None, self.value)]
+
+
+class Gauge:
+    """Value that goes up and down, set directly or read from a function at render time"""
+    
+    kind = 'gauge'
+        
+    def __init__(self, name, help_text, label=None):
+        """
+        Args:
+            name (str): Metric name
+            help_text (str): HELP line
+            label (str): Label name when the gauge has one value per label value
+        """
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._values = {}  # label value (None without label) -> value
+        self._function = None
+        
+    def set(self, value, label_value=None):
+        """Set the value (for one label value if the gauge has a label)"""
+        self._values[label_value] = value
+        
+    def set_function(self, function):
+        """
+        Read the value when rendering instead
+        
+        Args:
+            function (callable): Returns a number, or {label value: number} for a labelled gauge
+        """
+        self._function = function
+        
+    def samples(self):
+        values = self._values
+        if self._function is not None:
+            try:
+                result = self._function()
+            except Exception as e:
+                logger.debug(f"Gauge {self.name} not available: {e}")
+                return []
+            values = result if isinstance(result, dict) else {None: result}
+        return [(self.name, {self.label: key} if self.label else None, value)
+                for key, value in values.items() if value is not None]
+
+
+class Histogram:
+    """Distribution of observed values over fixed cumulative buckets"""
+    
+    kind = 'histogram'
+        
+    def __init__(self, name, help_text, buckets=None):
+        """
+        Args:
+            name (str): Metric name
+            help_text (str): HELP line
+            buckets (tuple): Increasing upper bounds (defaults to config.METRICS_LATENCY_BUCKETS)
+        """
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets or config.METRICS_LATENCY_BUCKETS))
+        self._counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+        
+    def observe(self, value):
+        """Record one value"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self.sum += value
+            self.count += 1
+        
+    def observe_since(self, start):
+        """Record the seconds elapsed since a time.perf_counter() value"""
+        self.observe(time.perf_counter() - start)
+        
+    def samples(self):
+        with self._lock:
+            counts, total, count = list(self._counts), self.sum, self.count
+        samples, cumulative = [], 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            samples.append((f"{self.name}_bucket", {'le': _format_value(bound)}, cumulative))
+        samples.append((f"{self.name}_sum", None, total))
+        samples.append((f"{self.name}_count", None, count))
+        return samples
+
+
+class MetricsRegistry:
+    """Named metrics, rendered together"""
+        
+    def __init__(self, prefix='fruit_sorting_'):
+        """
+        Args:
+            prefix (str): Prepended to every metric name
+        """
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+        
+    def _get_or_create(self, cls, name, *args):
+        name = self.prefix + name
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as a {metric.kind}")
+            return metric
+        
+    def counter(self, name, help_text):
+        """Get or create a counter"""
+        return self._get_or_create(Counter, name, help_text)
+        
+    def gauge(self, name, help_text, label=None):
+        """Get or create a gauge"""
+        return self._get_or_create(Gauge, name, help_text, label)
+        
+    def histogram(self, name, help_text, buckets=None):
+        """Get or create a histogram"""
+        return self._get_or_create(Histogram, name, help_text, buckets)
+        
+    def render(self):
+        """
+        All metrics in the Prometheus text exposition format
+        
+        Returns:
+            str: Exposition text
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                if labels:
+                    label_text = ','.join(f'{key}="{value_}"' for key, value_ in labels.items())
+                    name = f"{name}{{{label_text}}}"
+                lines.append(f"{name} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsFileExporter:
+    """Background thread writing the rendered registry to a file"""
+        
+    def __init__(self, registry, path=None, interval=None):
+        """
+        Args:
+            registry (MetricsRegistry): Metrics to export
+            path (str): Output file (defaults to config.METRICS_FILE)
+            interval (float): Seconds between writes
+        """
+        self.registry = registry
+        self.path = path or config.METRICS_FILE
+        self.interval = interval or config.METRICS_EXPORT_INTERVAL
+        self._stop = threading.Event()
+        self._thread = None
+        
+    def start(self):
+        """Start exporting"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics-exporter", daemon=True)
+        self._thread.start()
+        logger.info(f"Exporting metrics to {self.path} every {self.interval}s")
+        
+    def stop(self):
+        """Write a final snapshot and stop"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        
+    def export(self):
+        """Write one snapshot atomically, so readers never see a partial file"""
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, 'w') as f:
+                f.write(self.registry.render())
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.error(f"Failed to export metrics: {e}")
+        
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.export()
+        self.export()
+
+
+def read_exported(path=None, max_age=None):
+    """
+    Read the snapshot written by MetricsFileExporter
+    
+    Args:
+        path (str): Snapshot file (defaults to config.METRICS_FILE)
+        max_age (float): Snapshots older than this many seconds are ignored
+    
+    Returns:
+        tuple: (text, age in seconds), text is None if missing or stale
+    """
+    path = path or config.METRICS_FILE
+    max_age = max_age or config.METRICS_MAX_AGE
+    try:
+        age = time.time() - os.path.getmtime(path)
+        if age > max_age:
+            return None, age
+        with open(path) as f:
+            return f.read(), age
+    except OSError:
+        return None, None
+
+
+# Process-wide registry and the sorting pipeline's metrics
+REGISTRY = MetricsRegistry()
+
+FRUIT_DETECTED = REGISTRY.counter('fruit_detected_total', 'Fruit detected and submitted to the pipeline')
+FRUIT_DROPPED = REGISTRY.counter('fruit_dropped_total', 'Fruit dropped because the pipeline was busy')
+IMAGES_PUBLISHED = REGISTRY.counter('images_published_total', 'Images accepted for publishing or spooled')
+PUBLISH_FAILURES = REGISTRY.counter('publish_failures_total', 'Images that could not be published or spooled')
+RESULTS_RECEIVED = REGISTRY.counter('results_total', 'Classification results matched to a fruit')
+RESULT_TIMEOUTS = REGISTRY.counter('result_timeouts_total', 'Fruit whose result missed its deadline')
+GATE_ACTIONS = REGISTRY.counter('gate_actions_total', 'Sorting actions accepted by the gate')
+
+IR_TO_CAPTURE = REGISTRY.histogram('ir_to_capture_seconds', 'Detection to frame available')
+CAPTURE_TIME = REGISTRY.histogram('capture_seconds', 'Frame capture or frame buffer lookup')
+ENHANCE_TIME = REGISTRY.histogram('enhance_seconds', 'Image enhancement')
+ENCODE_TIME = REGISTRY.histogram('encode_seconds', 'JPEG encoding')
+PUBLISH_TIME = REGISTRY.histogram('publish_seconds', 'Handing the image to the publisher')
+RESULT_ROUND_TRIP = REGISTRY.histogram('result_round_trip_seconds', 'Publish to remote result')
+ACTUATION_TIME = REGISTRY.histogram('actuation_seconds', 'Servo move, timed where the gate is driven')
+SCHEDULING_TIME = REGISTRY.histogram('gate_scheduling_seconds', 'Queueing a gate move on the scheduler')
+
+QUEUE_DEPTH = REGISTRY.gauge('queue_depth', 'Items waiting in each queue', label='queue')
+
+
+# Test function
+if __name__ == "__main__":
+    import random
+    
+    for _ in range(100):
+        CAPTURE_TIME.observe(random.uniform(0.001, 0.05))
+        ENCODE_TIME.observe(random.uniform(0.002, 0.02))
+        FRUIT_DETECTED.inc()
+    QUEUE_DEPTH.set_function(lambda: {'capture': 1, 'publish': 0})
+    print(REGISTRY.render())
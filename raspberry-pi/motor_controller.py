@@ -6,13 +6,6 @@ Motor Controller for Servo and Conveyor Motors
 import time
 import logging
 
-try:
-    import RPi.GPIO as GPIO
-except ImportError:
-    print("⚠️  RPi.GPIO không được cài đặt. Chạy: pip install RPi.GPIO")
-    print("   Hoặc chạy: ./start.sh để cài đặt đầy đủ")
-    raise
-
 try:
     import config
 except ImportError:
@@ -20,13 +13,22 @@ except ImportError:
     print("   Đảm bảo bạn đang chạy từ thư mục dự án")
     raise
 
+from belt_scheduler import BeltModel, GateScheduler
+from gpio_events import load_gpio
+
 logging.basicConfig(level=config.LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
 
 class MotorController:
-    def __init__(self):
-        """Initialize motor controller"""
+    def __init__(self, gpio=None):
+        """
+        Initialize motor controller
+        
+        Args:
+            gpio: GPIO backend with the RPi.GPIO interface (defaults to RPi.GPIO, FakeGPIO for tests)
+        """
+        self.gpio = load_gpio(gpio)
         self.servo_pwm = None
         self.conveyor_pwm = None
         self.is_initialized = False
@@ -34,27 +36,31 @@ class MotorController:
         self.current_conveyor_speed = 0
         self.motor_start_time = None
         
+        # Belt position model and non-stop gate scheduling
+        self.belt = BeltModel()
+        self.scheduler = GateScheduler(self)
+        
     def initialize(self):
         """Initialize GPIO pins and PWM for motors"""
         try:
             logger.info("Initializing motor controller...")
             
             # Set GPIO mode to BCM
-            GPIO.setmode(GPIO.BCM)
-            GPIO.setwarnings(False)
+            self.gpio.setmode(self.gpio.BCM)
+            self.gpio.setwarnings(False)
             
             # Setup Servo Motor (PWM)
-            GPIO.setup(config.SERVO_PIN, GPIO.OUT)
-            self.servo_pwm = GPIO.PWM(config.SERVO_PIN, config.SERVO_FREQUENCY)
+            self.gpio.setup(config.SERVO_PIN, self.gpio.OUT)
+            self.servo_pwm = self.gpio.PWM(config.SERVO_PIN, config.SERVO_FREQUENCY)
             self.servo_pwm.start(0)
             
             # Setup Conveyor Motor (L298N)
-            GPIO.setup(config.CONVEYOR_ENABLE_PIN, GPIO.OUT)
-            GPIO.setup(config.CONVEYOR_IN1_PIN, GPIO.OUT)
-            GPIO.setup(config.CONVEYOR_IN2_PIN, GPIO.OUT)
+            self.gpio.setup(config.CONVEYOR_ENABLE_PIN, self.gpio.OUT)
+            self.gpio.setup(config.CONVEYOR_IN1_PIN, self.gpio.OUT)
+            self.gpio.setup(config.CONVEYOR_IN2_PIN, self.gpio.OUT)
             
             # Setup PWM for speed control
-            self.conveyor_pwm = GPIO.PWM(config.CONVEYOR_ENABLE_PIN, 1000)  # 1kHz
+            self.conveyor_pwm = self.gpio.PWM(config.CONVEYOR_ENABLE_PIN, 1000)  # 1kHz
             self.conveyor_pwm.start(0)
             
             # Initialize to neutral positions
@@ -62,7 +68,11 @@ class MotorController:
             self.stop_conveyor()
             
             self.is_initialized = True
-            logger.info("Motor controller initialized successfully")
+            
+            if config.SORTING_MODE == 'scheduled':
+                self.scheduler.start()
+            
+            logger.info(f"Motor controller initialized successfully (sorting mode: {config.SORTING_MODE})")
             return True
             
         except Exception as e:
@@ -108,7 +118,7 @@ class MotorController:
             
             # Send PWM signal
             self.servo_pwm.ChangeDutyCycle(duty)
-            time.sleep(0.5)  # Increased wait time for servo to reach position
+            time.sleep(config.SERVO_MOVE_TIME)  # Wait for servo to reach position
             self.servo_pwm.ChangeDutyCycle(0)  # Stop sending pulses to prevent jitter
             
             # Update current position
@@ -155,18 +165,18 @@ class MotorController:
             speed = max(0, min(config.CONVEYOR_MAX_SPEED, speed))
             
             # Set direction (forward)
-            GPIO.output(config.CONVEYOR_IN1_PIN, GPIO.HIGH)
-            GPIO.output(config.CONVEYOR_IN2_PIN, GPIO.LOW)
+            self.gpio.output(config.CONVEYOR_IN1_PIN, self.gpio.HIGH)
+            self.gpio.output(config.CONVEYOR_IN2_PIN, self.gpio.LOW)
             
             # Soft start if starting from stopped
             if self.current_conveyor_speed == 0:
                 logger.debug("Soft starting conveyor...")
                 for ramp_speed in range(0, speed, 10):
-                    self.conveyor_pwm.ChangeDutyCycle(ramp_speed)
+                    self._set_conveyor_duty(ramp_speed)
                     time.sleep(0.05)
             
             # Set final speed
-            self.conveyor_pwm.ChangeDutyCycle(speed)
+            self._set_conveyor_duty(speed)
             self.current_conveyor_speed = speed
             
             # Track motor start time for timeout
@@ -186,9 +196,9 @@ class MotorController:
             return False
         
         try:
-            GPIO.output(config.CONVEYOR_IN1_PIN, GPIO.LOW)
-            GPIO.output(config.CONVEYOR_IN2_PIN, GPIO.LOW)
-            self.conveyor_pwm.ChangeDutyCycle(0)
+            self.gpio.output(config.CONVEYOR_IN1_PIN, self.gpio.LOW)
+            self.gpio.output(config.CONVEYOR_IN2_PIN, self.gpio.LOW)
+            self._set_conveyor_duty(0)
             
             # Reset tracking
             self.current_conveyor_speed = 0
@@ -201,39 +211,99 @@ class MotorController:
             logger.error(f"Failed to stop conveyor: {e}")
             return False
     
-    def sort_fruit(self, classification):
+    def _set_conveyor_duty(self, speed):
+        """Apply conveyor duty cycle and record it in the belt model"""
+        self.conveyor_pwm.ChangeDutyCycle(speed)
+        self.belt.set_speed(speed)
+        self.scheduler.notify()
+    
+    def angle_for(self, classification):
+        """
+        Get the servo angle for a classification
+        
+        Args:
+            classification (str): Classification result
+            
+        Returns:
+            float: Servo angle in degrees
+        """
+        if classification == config.CLASSIFICATION_FRESH:
+            return config.SERVO_ANGLE_CENTER  # Straight
+        elif classification == config.CLASSIFICATION_SPOILED:
+            return config.SERVO_ANGLE_RIGHT   # Right
+        elif classification == config.CLASSIFICATION_OTHER:
+            return config.SERVO_ANGLE_LEFT    # Left
+        return config.SERVO_ANGLE_CENTER      # Default to center
+    
+    def set_servo_for(self, classification):
+        """
+        Move servo to the position for a classification
+        
+        Args:
+            classification (str): Classification result
+        """
+        if classification not in (config.CLASSIFICATION_FRESH, config.CLASSIFICATION_SPOILED,
+                                  config.CLASSIFICATION_OTHER):
+            logger.warning(f"Unknown classification: {classification}")
+        return self.set_servo_angle(self.angle_for(classification))
+    
+    def sort_fruit(self, classification, detection_time=None, gate_distance=None, on_done=None):
         """
         Perform sorting action based on classification
         
+        In 'scheduled' mode the gate move is queued against the belt
+        position model and the conveyor keeps running. A fruit that cannot
+        be scheduled (no detection time, scheduler not running) is
+        rejected: stopping the belt would throw off every other scheduled
+        fruit still travelling to the gate. In 'stop_and_wait' mode the
+        conveyor is stopped while the servo moves.
+        
         Args:
             classification (str): Classification result
+            detection_time (float): time.monotonic() when the fruit was detected
+            gate_distance (float): Belt mm from the detection point to the gate
+                (defaults to IR_TO_GATE_DISTANCE)
+            on_done (callable): Called with (fired, start, end) when the servo has
+                moved or the fruit was missed; see GateScheduler.schedule()
+        
+        Returns:
+            bool: True if the gate move was performed or scheduled
         """
         logger.info(f"Sorting fruit: {classification}")
         
+        if config.SORTING_MODE == 'scheduled':
+            if detection_time is None or not self.scheduler.is_running:
+                reason = 'no detection time' if detection_time is None else 'scheduler not running'
+                logger.warning(f"Cannot schedule {classification} gate move ({reason}), fruit not sorted")
+                return False
+            return self.scheduler.schedule(classification, detection_time, gate_distance, on_done)
+        
+        start = time.monotonic()
+        sorted_ok = self._sort_stop_and_wait(classification)
+        if on_done:
+            on_done(sorted_ok, start, time.monotonic())
+        return sorted_ok
+    
+    def _sort_stop_and_wait(self, classification):
+        """Stop the conveyor, set the gate, then resume (fallback mode)"""
         # Stop conveyor for sorting
         self.stop_conveyor()
         time.sleep(config.CONVEYOR_STOP_TIME)
         
         # Set servo based on classification
-        if classification == config.CLASSIFICATION_FRESH:
-            self.set_servo_center()  # Straight
-        elif classification == config.CLASSIFICATION_SPOILED:
-            self.set_servo_right()   # Right
-        elif classification == config.CLASSIFICATION_OTHER:
-            self.set_servo_left()    # Left
-        else:
-            logger.warning(f"Unknown classification: {classification}")
-            self.set_servo_center()  # Default to center
+        self.set_servo_for(classification)
         
         # Wait for sorting, then resume conveyor
         time.sleep(config.CONVEYOR_RESUME_DELAY)
-        self.start_conveyor()
+        return self.start_conveyor()
     
     def cleanup(self):
         """Clean up GPIO resources"""
         if self.is_initialized:
             logger.info("Cleaning up motor controller...")
             
+            self.scheduler.stop()
+            
             # Stop all motors
             if self.servo_pwm:
                 self.servo_pwm.stop()
@@ -241,7 +311,7 @@ class MotorController:
                 self.conveyor_pwm.stop()
             
             # Clean up GPIO
-            GPIO.cleanup()
+            self.gpio.cleanup()
             
             self.is_initialized = False
             logger.info("Motor controller cleaned up")
@@ -287,7 +357,8 @@ if __name__ == "__main__":
         print("\nTesting sorting action...")
         controller.start_conveyor()
         time.sleep(2)
-        controller.sort_fruit(config.CLASSIFICATION_SPOILED)
+        # As if the fruit had just passed the IR sensor
+        controller.sort_fruit(config.CLASSIFICATION_SPOILED, detection_time=time.monotonic())
         time.sleep(3)
         
         controller.stop_conveyor()
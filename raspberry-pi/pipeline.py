@@ -0,0 +1,473 @@
+"""
+Processing Pipeline for the Fruit Sorting System
+Runs capture -> enhance -> encode -> publish in worker threads connected
+by bounded queues, so the main loop only has to detect fruit and enqueue
+"""
+import time
+import queue
+import logging
+import threading
+import config
+import metrics
+from result_cache import dhash, SOURCE_CACHE
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+POLICY_BLOCK = 'block'
+POLICY_DROP_OLDEST = 'drop_oldest'
+POLICY_DROP_NEWEST = 'drop_newest'
+VALID_POLICIES = (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_DROP_NEWEST)
+
+# Returned by a handler that completed a job without forwarding it (e.g. a cache hit)
+JOB_DONE = object()
+
+
+class FruitJob:
+    """A single detected fruit travelling through the pipeline"""
+    
+    def __init__(self, trigger_time=None, device_id='rpi_conveyor_01', fruit_id=None,
+                 capture_at=None, track_id=None):
+        """
+        Args:
+            trigger_time (float): time.monotonic() of the detection, defaults to now
+            device_id (str): Device identifier sent with the image
+            fruit_id (str): In-flight registry ID, sent as the AMQP correlation_id
+            capture_at (float): time.monotonic() the frame should show, defaults to
+                trigger_time + CAPTURE_DELAY
+            track_id (int): Fruit tracker ID in continuous mode
+        """
+        self.fruit_id = fruit_id
+        self.trigger_time = trigger_time if trigger_time is not None else time.monotonic()
+        self.capture_at = capture_at if capture_at is not None else self.trigger_time + config.CAPTURE_DELAY
+        self.track_id = track_id
+        self.timestamp = time.time()
+        self.device_id = device_id
+        self.frame = None
+        self.image = None
+        self.image_bytes = None
+        self.trace = None  # Trace of the fruit when tracing is enabled
+        
+    def build_metadata(self):
+        """Metadata dict sent alongside the image"""
+        metadata = {
+            'timestamp': self.timestamp,
+            'device_id': self.device_id
+        }
+        if self.fruit_id:
+            metadata['fruit_id'] = self.fruit_id
+        if self.track_id is not None:
+            metadata['track_id'] = self.track_id
+        return metadata
+
+
+class PipelineStage:
+    """One pipeline stage: a bounded input queue served by worker threads"""
+    
+    def __init__(self, name, handler, maxsize, policy=POLICY_BLOCK, workers=1,
+                 block_timeout=None):
+        """
+        Args:
+            name (str): Stage name used in logs and stats
+            handler (callable): handler(job) -> job to forward, JOB_DONE if the job is
+                complete without forwarding, or None if it failed
+            maxsize (int): Input queue capacity
+            policy (str): What put() does when the queue is full
+                'block'       - wait up to block_timeout (backpressure), then drop the new job
+                'drop_oldest' - discard the oldest queued job to make room
+                'drop_newest' - discard the job being submitted
+            workers (int): Number of worker threads
+            block_timeout (float): Max seconds to wait under the 'block' policy
+        """
+        if policy not in VALID_POLICIES:
+            raise ValueError(f"Unknown queue policy '{policy}' for stage {name}")
+            
+        self.name = name
+        self.handler = handler
+        self.policy = policy
+        self.workers = max(1, workers)
+        self.block_timeout = block_timeout if block_timeout is not None else config.PIPELINE_BLOCK_TIMEOUT
+        self.queue = queue.Queue(maxsize=max(1, maxsize))
+        self.next_stage = None
+        
+        self.is_running = False
+        self._threads = []
+        self._lock = threading.RLock()
+        
+        # Stage statistics
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.skipped = 0  # Completed early, e.g. answered from the result cache
+        
+    def put(self, job):
+        """
+        Submit a job to this stage according to its queue policy
+        
+        Returns:
+            bool: True if the job was queued
+        """
+        if self.policy == POLICY_BLOCK:
+            try:
+                self.queue.put(job, timeout=self.block_timeout)
+                return True
+            except queue.Full:
+                self._count_drop("queue full after backpressure timeout")
+                return False
+                
+        if self.policy == POLICY_DROP_NEWEST:
+            try:
+                self.queue.put_nowait(job)
+                return True
+            except queue.Full:
+                self._count_drop("queue full, dropping newest job")
+                return False
+                
+        # drop_oldest: evict from the head until the new job fits
+        with self._lock:
+            while True:
+                try:
+                    self.queue.put_nowait(job)
+                    return True
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.queue.task_done()
+                        self._count_drop("queue full, dropping oldest job")
+                    except queue.Empty:
+                        pass
+                        
+    def _count_drop(self, reason):
+        """Record a dropped job"""
+        with self._lock:
+            self.dropped += 1
+        logger.warning(f"Pipeline stage '{self.name}': {reason}")
+        
+    def start(self):
+        """Start the worker threads"""
+        self.is_running = True
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker_loop,
+                name=f"pipeline-{self.name}-{i}",
+                daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+            
+    def stop(self, timeout=2.0):
+        """Stop the worker threads"""
+        self.is_running = False
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+        
+    def _worker_loop(self):
+        """Worker loop: take a job, run the handler, forward the result"""
+        while self.is_running:
+            try:
+                job = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+                
+            try:
+                result = self.handler(job)
+            except Exception as e:
+                logger.error(f"Pipeline stage '{self.name}' failed: {e}")
+                result = None
+            finally:
+                self.queue.task_done()
+                
+            if result is None:
+                with self._lock:
+                    self.failed += 1
+                continue
+            if result is JOB_DONE:
+                with self._lock:
+                    self.skipped += 1
+                continue
+                
+            with self._lock:
+                self.processed += 1
+                
+            if self.next_stage is not None:
+                self.next_stage.put(result)
+                
+    def get_stats(self):
+        """Get stage statistics"""
+        with self._lock:
+            return {
+                'queue_depth': self.queue.qsize(),
+                'queue_size': self.queue.maxsize,
+                'policy': self.policy,
+                'processed': self.processed,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'skipped': self.skipped
+            }
+
+
+class ProcessingPipeline:
+    """Capture -> enhance -> encode -> publish pipeline for detected fruit"""
+    
+    def __init__(self, camera, rabbitmq, device_id='rpi_conveyor_01', registry=None,
+                 local_classifier=None, on_local_result=None, result_cache=None, tracer=None):
+        """
+        Args:
+            camera (CameraModule): Initialized camera
+            rabbitmq (RabbitMQClient): Connected RabbitMQ client
+            device_id (str): Device identifier sent with every image
+            registry (FruitRegistry): In-flight registry updated with capture/publish times
+            local_classifier (LocalClassifier): On-device fallback, or None to always wait for the backend
+            on_local_result (callable): Called with each local and cached result dict
+            result_cache (ResultCache): Recent capture hashes and results, or None
+            tracer (Tracer): Starts a trace per submitted fruit, or None
+        """
+        self.camera = camera
+        self.rabbitmq = rabbitmq
+        self.device_id = device_id
+        self.registry = registry
+        self.local_classifier = local_classifier
+        self.on_local_result = on_local_result
+        self.result_cache = result_cache
+        self.tracer = tracer
+        self.force_local = False  # Set by the latency controller on its last rung
+        
+        # The camera is a single device, so capture always has exactly one worker
+        self.capture_stage = PipelineStage(
+            'capture', self._capture,
+            config.PIPELINE_CAPTURE_QUEUE_SIZE, config.PIPELINE_CAPTURE_POLICY
+        )
+        self.enhance_stage = PipelineStage(
+            'enhance', self._enhance,
+            config.PIPELINE_ENHANCE_QUEUE_SIZE, config.PIPELINE_ENHANCE_POLICY
+        )
+        self.encode_stage = PipelineStage(
+            'encode', self._encode,
+            config.PIPELINE_ENCODE_QUEUE_SIZE, config.PIPELINE_ENCODE_POLICY
+        )
+        self.publish_stage = PipelineStage(
+            'publish', self._publish,
+            config.PIPELINE_PUBLISH_QUEUE_SIZE, config.PIPELINE_PUBLISH_POLICY
+        )
+        
+        self.stages = [self.capture_stage, self.enhance_stage, self.encode_stage, self.publish_stage]
+        for stage, next_stage in zip(self.stages, self.stages[1:]):
+            stage.next_stage = next_stage
+        
+        # Side branch fed by enhance: the image is still published, whichever
+        # result reaches the registry first moves the gate
+        self.local_stage = None
+        if local_classifier is not None:
+            self.local_stage = PipelineStage(
+                'local', self._classify_local,
+                config.LOCAL_QUEUE_SIZE, POLICY_DROP_OLDEST
+            )
+            self.stages.append(self.local_stage)
+            
+        self.is_running = False
+        
+    def start(self):
+        """Start all stage workers"""
+        for stage in self.stages:
+            stage.start()
+        self.is_running = True
+        logger.info("Processing pipeline started")
+        
+    def stop(self):
+        """Stop all stage workers"""
+        self.is_running = False
+        for stage in self.stages:
+            stage.stop()
+        logger.info("Processing pipeline stopped")
+        
+    def submit(self, trigger_time=None, fruit_id=None, capture_at=None, track_id=None):
+        """
+        Queue a detected fruit for capture. Never blocks the caller
+        beyond the capture queue policy.
+        
+        Args:
+            trigger_time (float): time.monotonic() of the detection
+            fruit_id (str): In-flight registry ID for the fruit
+            capture_at (float): time.monotonic() the frame should show (see FruitJob)
+            track_id (int): Fruit tracker ID in continuous mode
+            
+        Returns:
+            bool: True if the fruit was queued
+        """
+        job = FruitJob(trigger_time=trigger_time, device_id=self.device_id, fruit_id=fruit_id,
+                       capture_at=capture_at, track_id=track_id)
+        if self.tracer and fruit_id:
+            job.trace = self.tracer.start_trace(fruit_id, job.trigger_time)
+        return self.capture_stage.put(job)
+        
+    def _capture(self, job):
+        """Get the frame showing the fruit at the capture point"""
+        # Picked from the frame buffer when it runs, otherwise waits and captures
+        start = time.monotonic()
+        job.frame = self.camera.capture_frame_at(job.capture_at)
+        if job.frame is None:
+            logger.error("Failed to capture image")
+            return None
+        end = time.monotonic()
+        metrics.CAPTURE_TIME.observe(end - start)
+        metrics.IR_TO_CAPTURE.observe(end - job.trigger_time)
+        if job.trace:
+            job.trace.add_span('capture', start, end)
+        
+        if self.registry and job.fruit_id:
+            self.registry.mark_captured(job.fruit_id)
+            if self._answer_from_cache(job):
+                return JOB_DONE
+        return job
+        
+    def _answer_from_cache(self, job):
+        """
+        Match the capture against recent ones in the result cache
+        
+        Tracked captures are never matched: each track is a different
+        fruit framed at the same best-placed spot, so two similar fruit
+        would hash alike and share one classification.
+        
+        Returns:
+            bool: True if the job was answered or dropped and should stop here
+        """
+        if self.result_cache is None or config.TRIGGER_MODE not in config.RESULT_CACHE_TRIGGER_MODES:
+            return False
+        if job.track_id is not None:
+            return False
+        
+        frame_hash = dhash(job.frame, self.result_cache.hash_size)
+        entry = self.result_cache.lookup(frame_hash)
+        if entry is None:
+            self.result_cache.add(job.fruit_id, frame_hash)
+            return False
+        
+        if entry.result is None:
+            # Same scene as a capture still waiting for its result
+            logger.info(f"Capture for fruit {job.fruit_id} matches a pending one, dropped")
+            self.registry.discard(job.fruit_id)
+            if self.tracer:
+                self.tracer.finish(job.trace, 'duplicate')
+            return True
+        
+        classification, confidence = entry.result
+        logger.info(f"Capture for fruit {job.fruit_id} matches a cached result: {classification}")
+        if self.on_local_result:
+            self.on_local_result({
+                'classification': classification,
+                'confidence': confidence,
+                'correlation_id': job.fruit_id,
+                'source': SOURCE_CACHE
+            })
+        return True
+        
+    def record_result(self, fruit_id, classification, confidence):
+        """Remember a classified capture's result for near-identical later captures"""
+        if self.result_cache is not None:
+            self.result_cache.store_result(fruit_id, classification, confidence)
+        
+    def _enhance(self, job):
+        """Apply image enhancement to the raw frame"""
+        start = time.monotonic()
+        job.image = self.camera.enhance_frame(job.frame)
+        end = time.monotonic()
+        metrics.ENHANCE_TIME.observe(end - start)
+        if job.trace:
+            job.trace.add_span('enhance', start, end)
+        job.frame = None  # Release the raw frame early
+        
+        if self.local_stage and self._needs_local_result(job):
+            self.local_stage.put((job.fruit_id, job.image, job.trace))
+        return job
+        
+    def _needs_local_result(self, job):
+        """
+        Decide whether a fruit should also be classified on the Pi
+        
+        True when the latency controller forces it, when the broker is
+        not connected, or when the remaining time to the fruit's gate
+        deadline is shorter than the expected remote round trip times
+        LOCAL_DEADLINE_MARGIN (see FruitRegistry.expected_round_trip).
+        """
+        if not self.registry or not job.fruit_id:
+            return False
+        if self.force_local:
+            return True
+        if not self.rabbitmq.publisher.is_ready:
+            logger.info(f"Broker unavailable, classifying fruit {job.fruit_id} locally")
+            return True
+        
+        remaining = self.registry.time_remaining(job.fruit_id)
+        expected = self.registry.expected_round_trip()
+        if remaining is None or expected is None:
+            return False
+        if remaining < expected * config.LOCAL_DEADLINE_MARGIN:
+            logger.info(f"Remote result would miss the gate ({remaining * 1000:.0f}ms left, "
+                        f"round trip {expected * 1000:.0f}ms), classifying locally")
+            return True
+        return False
+        
+    def _classify_local(self, item):
+        """
+        Local branch worker: classify on the Pi and deliver the result
+        
+        Returns:
+            dict: The delivered result, JOB_DONE if no longer needed, None if not confident enough
+        """
+        fruit_id, image, trace = item
+        if self.registry and self.registry.time_remaining(fruit_id) is None:
+            return JOB_DONE  # Already resolved by the backend or expired
+        
+        start = time.monotonic()
+        result = self.local_classifier.classify(image, fruit_id=fruit_id)
+        if trace:
+            trace.add_span('local_classify', start, accepted=result is not None)
+        if result is not None and self.on_local_result:
+            self.on_local_result(result)
+        return result
+        
+    def _encode(self, job):
+        """Encode the enhanced frame as JPEG"""
+        start = time.monotonic()
+        job.image_bytes = self.camera.encode_image(job.image)
+        job.image = None
+        if not job.image_bytes:
+            return None
+        end = time.monotonic()
+        metrics.ENCODE_TIME.observe(end - start)
+        if job.trace:
+            job.trace.add_span('encode', start, end, bytes=len(job.image_bytes))
+        return job
+        
+    def _publish(self, job):
+        """Send the encoded image to the backend"""
+        start = time.monotonic()
+        # The publish span's ID travels with the image so backend spans can be stitched under it
+        headers = None
+        if job.trace:
+            span = job.trace.add_span('publish', start)
+            headers = {'traceparent': job.trace.traceparent(span)}
+        if self.rabbitmq.send_image(job.image_bytes, job.build_metadata(), correlation_id=job.fruit_id,
+                                    headers=headers):
+            end = time.monotonic()
+            metrics.PUBLISH_TIME.observe(end - start)
+            metrics.IMAGES_PUBLISHED.inc()
+            if job.trace:
+                job.trace.end_span(span, end)
+            logger.info("Image sent for classification")
+            if self.registry and job.fruit_id:
+                self.registry.mark_published(job.fruit_id)
+            return job
+            
+        # Reconnection happens in the background; the image could not even be spooled
+        metrics.PUBLISH_FAILURES.inc()
+        logger.error("Failed to send image to backend")
+        return None
+        
+    def get_stats(self):
+        """Get per-stage statistics"""
+        stats = {stage.name: stage.get_stats() for stage in self.stages}
+        if self.result_cache is not None:
+            stats['result_cache'] = self.result_cache.get_stats()
+        return stats
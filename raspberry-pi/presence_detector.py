@@ -0,0 +1,159 @@
+"""
+Vision Presence Detector
+Trigger source for IR-free deployments. Keeps a running-average background
+model of a trigger zone on the lores luma frames; an object is present
+while enough zone pixels differ from the background. The presence level
+goes through the same glitch-filtered edge tracker as the IR sensor, so
+each object entering the zone produces exactly one detection.
+"""
+import logging
+import numpy as np
+import config
+from ir_tracker import IRObjectTracker
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+FOREGROUND_RATE_FACTOR = 0.1  # Foreground pixels adapt this much slower (absorbs objects that stop)
+STALE_AFTER = 2.0  # Seconds without frames after which the background is relearned
+
+
+class BackgroundModel:
+    """Selective running-average background of a luma image"""
+        
+    def __init__(self, threshold=None, learning_rate=None):
+        """
+        Args:
+            threshold (int): Luma difference from the background that counts as foreground
+            learning_rate (float): Background running-average rate per frame
+        """
+        self.threshold = config.PRESENCE_THRESHOLD if threshold is None else threshold
+        self.learning_rate = learning_rate or config.PRESENCE_LEARNING_RATE
+        self.background = None  # float32 model, learned from the first frame
+        
+    def reset(self):
+        """Forget the background; the next frame becomes the new model"""
+        self.background = None
+        
+    def apply(self, luma):
+        """
+        Classify pixels as foreground and update the model
+        
+        Args:
+            luma (numpy.ndarray): Luma image (H x W)
+        
+        Returns:
+            numpy.ndarray: Boolean foreground mask, or None while the model is (re)learned
+        """
+        image = luma.astype(np.float32)
+        if self.background is None or self.background.shape != image.shape:
+            self.background = image
+            return None
+        
+        diff = image - self.background
+        foreground = np.abs(diff) > self.threshold
+        
+        # Background pixels follow the belt quickly, foreground pixels slowly,
+        # so a fruit is not learned while it passes
+        rate = np.where(foreground, self.learning_rate * FOREGROUND_RATE_FACTOR, self.learning_rate)
+        self.background += rate * diff
+        return foreground
+
+
+class PresenceDetector:
+    """Background-subtraction trigger on a zone of the lores frames"""
+        
+    def __init__(self, zone=None, threshold=None, min_area=None, learning_rate=None,
+                 glitch_filter=None):
+        """
+        Args:
+            zone (tuple): (x, y, width, height) as fractions of the frame
+                (defaults to config.PRESENCE_ZONE)
+            threshold (int): Luma difference from the background that counts as foreground
+            min_area (float): Fraction of the zone that must be foreground for presence
+            learning_rate (float): Background running-average rate per frame
+            glitch_filter (float): Seconds presence must hold to count as an edge
+        """
+        self.zone = zone or config.PRESENCE_ZONE
+        self.min_area = config.PRESENCE_MIN_AREA if min_area is None else min_area
+        self.background = BackgroundModel(threshold, learning_rate)
+        glitch_filter = config.PRESENCE_GLITCH_FILTER if glitch_filter is None else glitch_filter
+        self.tracker = IRObjectTracker(glitch_filter=glitch_filter)
+        
+        self.last_time = None
+        self.coverage = 0.0  # Foreground fraction of the last frame
+        
+        # Statistics
+        self.frame_count = 0
+        
+    def _zone_slice(self, shape):
+        """Pixel slices of the trigger zone for a frame shape"""
+        height, width = shape[:2]
+        x, y, w, h = self.zone
+        x0, y0 = int(x * width), int(y * height)
+        x1, y1 = max(x0 + 1, int((x + w) * width)), max(y0 + 1, int((y + h) * height))
+        return slice(y0, y1), slice(x0, x1)
+        
+    def reset(self):
+        """Forget the background; the next frame becomes the new model"""
+        self.background.reset()
+        
+    def update(self, luma, timestamp):
+        """
+        Feed one lores frame
+        
+        Args:
+            luma (numpy.ndarray): Luma frame (H x W, uint8)
+            timestamp (float): time.monotonic() of the frame
+        
+        Returns:
+            tuple: ('enter', IRObject) or ('exit', IRObject) from the edge tracker, or None
+        """
+        rows, cols = self._zone_slice(luma.shape)
+        
+        if self.last_time is not None and timestamp - self.last_time > STALE_AFTER:
+            logger.info("Presence detector idle, relearning background")
+            self.background.reset()
+        self.last_time = timestamp
+        self.frame_count += 1
+        
+        foreground = self.background.apply(luma[rows, cols])
+        if foreground is None:
+            return None
+        self.coverage = float(foreground.mean())
+        
+        self.tracker.feed(self.coverage >= self.min_area, timestamp)
+        return self.tracker.poll(timestamp)
+        
+    def get_stats(self):
+        """Get detector statistics"""
+        stats = self.tracker.get_stats()
+        stats.update({
+            'frames': self.frame_count,
+            'coverage': round(self.coverage, 3),
+            'zone': self.zone
+        })
+        return stats
+
+
+# Test function
+if __name__ == "__main__":
+    import time
+    
+    detector = PresenceDetector()
+    width, height = config.CAMERA_LORES_SIZE
+    rng = np.random.default_rng(0)
+    belt = rng.integers(90, 110, (height, width), dtype=np.uint8)
+    
+    print("Simulating a fruit crossing the belt...")
+    start = time.monotonic()
+    for i in range(60):
+        frame = belt.copy()
+        x = (i - 10) * 12  # Dark object moving right
+        if 0 <= x < width:
+            frame[height // 3:2 * height // 3, max(0, x - 40):x + 40] = 30
+        transition = detector.update(frame, start + i * 0.05)
+        if transition:
+            kind, obj = transition
+            print(f"  frame {i}: {kind} at t={obj.rise_time - start if kind == 'enter' else obj.fall_time - start:.2f}s")
+    print(f"Stats: {detector.get_stats()}")
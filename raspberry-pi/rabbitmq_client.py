@@ -2,60 +2,181 @@
 RabbitMQ Client for Raspberry Pi
 Handles communication with backend server
 """
-import json
 import logging
 import time
 import threading
 import pika
 from pika.exceptions import AMQPConnectionError, AMQPChannelError
 import config
+import message_format
+from amqp_publisher import ConfirmingPublisher
+from amqp_consumer import ResultConsumer
+from image_spool import ImageSpool, SpoolDrainer, SpoolRecord
+from backoff import Backoff
 
 logging.basicConfig(level=config.LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
+STATE_DISCONNECTED = 'disconnected'
+STATE_CONNECTING = 'connecting'
+STATE_DEGRADED = 'degraded'  # Only one of publisher/consumer is up
+STATE_CONNECTED = 'connected'
+
 
 class RabbitMQClient:
-    def __init__(self, result_callback=None):
+    def __init__(self, result_callback=None, on_state_change=None):
         """
         Initialize RabbitMQ client
         
         Args:
             result_callback (callable): Function to call when receiving classification results
+            on_state_change (callable): Called with (old_state, new_state) on connection changes
         """
-        self.connection = None
-        self.channel = None
         self.result_callback = result_callback
+        self.on_state_change = on_state_change
         self.is_connected = False
-        self.consumer_thread = None
+        self.state = STATE_DISCONNECTED
         self.should_consume = False
+        self.message_format = message_format.resolve_format()
+        
+        # Publishing and consuming each use their own connection, owned by
+        # their own I/O thread (pika connections are not thread-safe)
+        self.publisher = ConfirmingPublisher(
+            self._connection_parameters(),
+            on_failed=self._on_publish_failed
+        )
+        self.consumer = ResultConsumer(
+            self._connection_parameters(),
+            config.RESULT_QUEUE,
+            self._on_result_received
+        )
+        
+        # Images that cannot be published right now are kept on disk and replayed later
+        self.spool = None
+        self.spool_drainer = None
+        if config.SPOOL_ENABLED:
+            try:
+                self.spool = ImageSpool()
+                self.spool_drainer = SpoolDrainer(self.spool, self.publisher)
+            except OSError as e:
+                logger.error(f"Outbound spool disabled: {e}")
+        
+        # Background supervisor: reconnects and tracks connection state
+        self.supervisor_thread = None
+        self._supervise = False
+        self._setup_done = False
+        self._connected_event = threading.Event()
+        self._stop_event = threading.Event()
+        
+    def _connection_parameters(self):
+        """Build connection parameters from config"""
+        credentials = pika.PlainCredentials(
+            config.RABBITMQ_USER,
+            config.RABBITMQ_PASSWORD
+        )
+        
+        return pika.ConnectionParameters(
+            host=config.RABBITMQ_HOST,
+            port=config.RABBITMQ_PORT,
+            virtual_host=config.RABBITMQ_VHOST,
+            credentials=credentials,
+            heartbeat=config.RABBITMQ_HEARTBEAT,
+            blocked_connection_timeout=300
+        )
+        
+    def start(self, wait=None):
+        """
+        Connect in the background and keep reconnecting until disconnect()
+        
+        Never blocks longer than `wait`; while the broker is unreachable
+        images are spooled and results fall back to the default route.
+        
+        Args:
+            wait (float): Seconds to wait for the first connection (defaults to config)
+        
+        Returns:
+            bool: True if connected within the wait
+        """
+        if self.spool_drainer:
+            # Also keeps the spool fsynced while the broker is unreachable
+            self.spool_drainer.start()
+        if self.supervisor_thread is None:
+            self._supervise = True
+            self._stop_event.clear()
+            self.supervisor_thread = threading.Thread(
+                target=self._supervisor_loop, name="amqp-supervisor", daemon=True
+            )
+            self.supervisor_thread.start()
+        
+        wait = config.RABBITMQ_STARTUP_WAIT if wait is None else wait
+        return self._connected_event.wait(wait)
+        
+    def _supervisor_loop(self):
+        """Set up the broker with backoff, then watch the publisher and consumer"""
+        backoff = Backoff()
+        while self._supervise:
+            if not self._setup_done:
+                self._set_state(STATE_CONNECTING)
+                if not self.connect():
+                    self._set_state(STATE_DISCONNECTED)
+                    delay = backoff.next_delay()
+                    logger.info(f"Retrying RabbitMQ connection in {delay:.1f}s")
+                    self._stop_event.wait(delay)
+                    continue
+                self._setup_done = True
+            
+            # Publisher and consumer reconnect (and re-declare their queues)
+            # on their own threads; this only reports the combined state
+            self._set_state(self._current_state())
+            self._stop_event.wait(config.CONNECTION_MONITOR_INTERVAL)
+        
+    def _current_state(self):
+        """Combined state of the publishing and consuming connections"""
+        publishing = self.publisher.is_ready
+        consuming = self.consumer.is_ready or not self.should_consume
+        if publishing and consuming:
+            return STATE_CONNECTED
+        if publishing or self.consumer.is_ready:
+            return STATE_DEGRADED
+        return STATE_DISCONNECTED
+        
+    def _set_state(self, state):
+        """Record a connection state change and notify the listener"""
+        if state == self.state:
+            return
+        old_state, self.state = self.state, state
+        self.is_connected = state == STATE_CONNECTED
+        if self.is_connected:
+            self._connected_event.set()
+        else:
+            self._connected_event.clear()
+        
+        log = logger.info if self.is_connected else logger.warning
+        log(f"RabbitMQ connection {old_state} -> {state}")
+        if self.on_state_change:
+            try:
+                self.on_state_change(old_state, state)
+            except Exception as e:
+                logger.error(f"Error in connection state callback: {e}")
         
     def connect(self):
-        """Establish connection to RabbitMQ server"""
+        """Establish connection to RabbitMQ server (one attempt)"""
         try:
             logger.info(f"Connecting to RabbitMQ at {config.RABBITMQ_HOST}:{config.RABBITMQ_PORT}...")
             
-            credentials = pika.PlainCredentials(
-                config.RABBITMQ_USER,
-                config.RABBITMQ_PASSWORD
-            )
-            
-            parameters = pika.ConnectionParameters(
-                host=config.RABBITMQ_HOST,
-                port=config.RABBITMQ_PORT,
-                virtual_host=config.RABBITMQ_VHOST,
-                credentials=credentials,
-                heartbeat=600,
-                blocked_connection_timeout=300
-            )
-            
-            self.connection = pika.BlockingConnection(parameters)
-            self.channel = self.connection.channel()
-            
-            # Declare queues
-            self.channel.queue_declare(queue=config.IMAGE_QUEUE, durable=True)
-            self.channel.queue_declare(queue=config.RESULT_QUEUE, durable=True)
+            # Check the broker and declare queues on a short-lived connection;
+            # the long-lived ones are opened by the publisher and consumer threads
+            connection = pika.BlockingConnection(self._connection_parameters())
+            try:
+                channel = connection.channel()
+                channel.queue_declare(queue=config.IMAGE_QUEUE, durable=True)
+                channel.queue_declare(queue=config.RESULT_QUEUE, durable=True)
+            finally:
+                connection.close()
             
-            self.is_connected = True
+            self.publisher.start()
+            if self.spool_drainer:
+                self.spool_drainer.start()
             logger.info("Connected to RabbitMQ successfully")
             return True
             
@@ -66,147 +187,144 @@ class RabbitMQClient:
             logger.error(f"Unexpected error during connection: {e}")
             return False
     
-    def send_image(self, image_bytes, metadata=None):
+    def send_image(self, image_bytes, metadata=None, correlation_id=None, headers=None):
         """
         Send image to backend for classification
         
         Args:
             image_bytes (bytes): Image data in bytes
             metadata (dict): Additional metadata (timestamp, etc.)
+            correlation_id (str): Fruit ID echoed back on the classification result
+            headers (dict): Extra AMQP headers (e.g. the trace context)
             
         Returns:
-            bool: True if sent successfully
+            bool: True if accepted for publishing or spooled to disk
         """
-        if not self.is_connected:
-            logger.error("Not connected to RabbitMQ")
-            return False
-        
         try:
-            # Prepare message
-            message = {
-                'image': image_bytes.hex(),  # Convert bytes to hex string
-                'metadata': metadata or {}
-            }
+            metadata = dict(metadata or {})
             
             # Add timestamp if not present
-            if 'timestamp' not in message['metadata']:
-                message['metadata']['timestamp'] = time.time()
+            if 'timestamp' not in metadata:
+                metadata['timestamp'] = time.time()
             
-            # Serialize message
-            message_json = json.dumps(message)
-            
-            # Publish to queue
-            self.channel.basic_publish(
-                exchange='',
-                routing_key=config.IMAGE_QUEUE,
-                body=message_json,
-                properties=pika.BasicProperties(
-                    delivery_mode=2,  # Make message persistent
-                    content_type='application/json'
-                )
+            # Serialize message in the configured format
+            body, content_type, format_headers = message_format.encode_image_message(
+                image_bytes, metadata, self.message_format
             )
             
-            logger.info(f"Image sent to queue ({len(image_bytes)} bytes)")
-            return True
+            # Let the backend know which result formats we can read
+            headers = dict(format_headers or {}, **(headers or {}))
+            headers['x-accept'] = message_format.accepted_result_types()
             
-        except Exception as e:
-            logger.error(f"Failed to send image: {e}")
-            return False
-    
-    def _on_result_received(self, ch, method, properties, body):
-        """Callback when classification result is received"""
-        try:
-            # Parse result
-            result = json.loads(body)
-            logger.info(f"Received classification result: {result}")
+            properties = pika.BasicProperties(
+                delivery_mode=2,  # Make message persistent
+                content_type=content_type,
+                headers=headers,
+                correlation_id=correlation_id,
+                reply_to=config.RESULT_QUEUE
+            )
             
-            # Call user callback
-            if self.result_callback:
-                self.result_callback(result)
+            # Hand off to the confirming publisher (never waits on the broker);
+            # while it is disconnected or full, the image goes to the disk spool
+            if self.publisher.is_ready and self.publisher.publish(
+                    config.IMAGE_QUEUE, body, properties, fruit_id=correlation_id):
+                logger.info(f"Image queued for publishing ({len(image_bytes)} bytes, {content_type})")
+                return True
             
-            # Acknowledge message
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+            return self._spool_message(config.IMAGE_QUEUE, body, properties, correlation_id)
             
         except Exception as e:
-            logger.error(f"Error processing result: {e}")
-            # Reject message
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            logger.error(f"Failed to send image: {e}")
+            return False
     
-    def start_consuming_results(self):
-        """Start consuming classification results in a separate thread"""
-        if not self.is_connected:
-            logger.error("Not connected to RabbitMQ")
+    def _spool_message(self, routing_key, body, properties, fruit_id):
+        """Write a message to the disk spool for later replay"""
+        if self.spool is None:
+            logger.error("RabbitMQ unavailable and spool disabled, image dropped")
             return False
         
-        try:
-            # Set up consumer
-            self.channel.basic_qos(prefetch_count=1)
-            self.channel.basic_consume(
-                queue=config.RESULT_QUEUE,
-                on_message_callback=self._on_result_received
-            )
+        record = SpoolRecord(
+            routing_key, body,
+            fruit_id=fruit_id,
+            content_type=properties.content_type,
+            headers=properties.headers,
+            correlation_id=properties.correlation_id,
+            reply_to=properties.reply_to
+        )
+        if self.spool.append(record):
+            logger.warning(f"RabbitMQ unavailable, image spooled to disk ({len(body)} bytes)")
+            return True
+        return False
+        
+    def _on_publish_failed(self, message):
+        """Called from the publisher thread when an image could not be delivered"""
+        logger.error(f"Image for fruit {message.fruit_id} was not confirmed by the broker, spooling")
+        self._spool_message(message.routing_key, message.body, message.properties, message.fruit_id)
+    
+    def _on_result_received(self, body, properties):
+        """
+        Callback when classification result is received
             
-            # Start consuming in thread
-            self.should_consume = True
-            self.consumer_thread = threading.Thread(target=self._consume_loop, daemon=True)
-            self.consumer_thread.start()
+        Runs on the consumer thread, which acks the message afterwards
+        (or rejects it if this raises).
+        """
+        # Parse result (JSON unless the backend negotiated msgpack)
+        result = message_format.decode_result(body, properties.content_type)
+        logger.info(f"Received classification result: {result}")
             
-            logger.info("Started consuming classification results")
-            return True
+        # Carry the fruit ID from the message properties into the result
+        if properties.correlation_id and 'correlation_id' not in result:
+            result['correlation_id'] = properties.correlation_id
+        result.setdefault('source', 'remote')
             
-        except Exception as e:
-            logger.error(f"Failed to start consuming: {e}")
-            return False
+        # Call user callback
+        if self.result_callback:
+            self.result_callback(result)
     
-    def _consume_loop(self):
-        """Consumption loop running in separate thread"""
-        try:
-            while self.should_consume:
-                self.connection.process_data_events(time_limit=1)
-        except Exception as e:
-            logger.error(f"Error in consume loop: {e}")
-            self.is_connected = False
+    def start_consuming_results(self):
+        """Start consuming classification results in a separate thread"""
+        # The consumer thread opens, consumes from and acks on its own connection,
+        # and keeps reconnecting until stop_consuming()
+        self.should_consume = True
+        self.consumer.start()
+        logger.info("Started consuming classification results")
+        return True
     
     def stop_consuming(self):
         """Stop consuming messages"""
         self.should_consume = False
-        if self.consumer_thread:
-            self.consumer_thread.join(timeout=2)
+        self.consumer.stop()
         logger.info("Stopped consuming results")
     
     def disconnect(self):
         """Close connection to RabbitMQ"""
-        if self.connection:
-            try:
-                self.stop_consuming()
-                self.connection.close()
-                self.is_connected = False
-                logger.info("Disconnected from RabbitMQ")
-            except Exception as e:
-                logger.error(f"Error during disconnect: {e}")
+        self._supervise = False
+        self._stop_event.set()
+        if self.supervisor_thread:
+            self.supervisor_thread.join(timeout=2)
+            self.supervisor_thread = None
     
-    def reconnect(self, max_attempts=None):
-        """
-        Attempt to reconnect to RabbitMQ
-        
-        Args:
-            max_attempts (int): Maximum reconnection attempts (None for infinite)
-        """
-        attempts = 0
-        while max_attempts is None or attempts < max_attempts:
-            attempts += 1
-            logger.info(f"Reconnection attempt {attempts}...")
-            
-            if self.connect():
-                if self.result_callback:
-                    self.start_consuming_results()
-                return True
-            
-            logger.warning(f"Reconnection failed, waiting {config.RETRY_DELAY} seconds...")
-            time.sleep(config.RETRY_DELAY)
+        try:
+            if self.spool_drainer:
+                self.spool_drainer.stop()
+            self.stop_consuming()
+            self.publisher.stop()
+            if self.spool:
+                self.spool.close()
+            self._setup_done = False
+            self._set_state(STATE_DISCONNECTED)
+            logger.info("Disconnected from RabbitMQ")
+        except Exception as e:
+            logger.error(f"Error during disconnect: {e}")
         
-        logger.error("Max reconnection attempts reached")
-        return False
+    def get_stats(self):
+        """Get connection statistics"""
+        return {
+            'state': self.state,
+            'publisher': self.publisher.get_stats(),
+            'consumer': self.consumer.get_stats(),
+            'spool': self.spool.get_stats() if self.spool else None
+        }
 
 
 # Test function
@@ -217,7 +335,7 @@ if __name__ == "__main__":
     print("Testing RabbitMQ Client...")
     client = RabbitMQClient(result_callback=test_callback)
     
-    if client.connect():
+    if client.start(wait=10):
         print("Connected successfully")
         
         # Start consuming results
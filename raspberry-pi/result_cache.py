@@ -0,0 +1,181 @@
+"""
+Perceptual-Hash Result Cache
+In continuous and time_based modes consecutive captures are often the
+same fruit still in view, or the same empty belt. Each capture gets a
+256-bit difference hash (dHash) of a 9x9 grayscale thumbnail; a capture
+within a small Hamming distance of a recent one reuses that capture's
+classification instead of sending another image to the backend, or is
+dropped while the earlier result is still pending.
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+import config
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+SOURCE_CACHE = 'cache'
+DHASH_MARGIN = 2.0  # Grey levels a neighbour must be brighter by to set a bit
+
+
+def dhash(frame, hash_size=8):
+    """
+    Difference hash of a frame
+    
+    A (hash_size+1)² grayscale thumbnail is compared with its right and
+    lower neighbours; each pair sets one bit if it gets clearly brighter
+    and another if it gets clearly darker. Both directions and signs
+    keep a small fruit on a plain belt from hashing like the empty belt,
+    while the margin keeps flat areas from flipping bits on noise.
+    
+    Args:
+        frame (numpy.ndarray): uint8 RGB or luma frame
+        hash_size (int): Thumbnail cells per side; the hash has 4 x hash_size² bits
+    
+    Returns:
+        int: The hash
+    """
+    image = Image.fromarray(frame)
+    if image.mode != 'L':
+        image = image.convert('L')
+    # Float thumbnail: no rounding ties between equal neighbours
+    thumbnail = np.asarray(image.convert('F').resize((hash_size + 1, hash_size + 1), Image.BILINEAR,
+                                                     reducing_gap=2.0))
+    horizontal = (thumbnail[:-1, 1:] - thumbnail[:-1, :-1]).ravel()
+    vertical = (thumbnail[1:, :-1] - thumbnail[:-1, :-1]).ravel()
+    gradients = np.concatenate([horizontal, vertical])
+    bits = np.concatenate([gradients > DHASH_MARGIN, gradients < -DHASH_MARGIN])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming_distance(a, b):
+    """Number of differing bits between two hashes"""
+    return bin(a ^ b).count('1')
+
+
+class CacheEntry:
+    """A recent capture and, once known, its classification"""
+    
+    __slots__ = ('frame_hash', 'result', 'created')
+        
+    def __init__(self, frame_hash, created):
+        self.frame_hash = frame_hash
+        self.result = None  # (classification, confidence) once the result arrives
+        self.created = created
+
+
+class ResultCache:
+    """Bounded LRU of recent capture hashes and their results, keyed by fruit ID"""
+        
+    def __init__(self, capacity=None, max_distance=None, ttl=None, hash_size=None):
+        """
+        Args:
+            capacity (int): Entries kept (least recently matched are evicted)
+            max_distance (int): Max Hamming distance for a capture to match an entry
+            ttl (float): Seconds an entry stays usable
+            hash_size (int): dHash thumbnail cells per side
+        """
+        self.capacity = capacity or config.RESULT_CACHE_SIZE
+        self.max_distance = config.RESULT_CACHE_MAX_DISTANCE if max_distance is None else max_distance
+        self.ttl = ttl or config.RESULT_CACHE_TTL
+        self.hash_size = hash_size or config.RESULT_CACHE_HASH_SIZE
+        self._entries = OrderedDict()  # fruit_id -> CacheEntry
+        self._lock = threading.Lock()
+        
+        # Statistics
+        self.hit_count = 0
+        self.pending_hit_count = 0
+        self.miss_count = 0
+        
+    def lookup(self, frame_hash, now=None):
+        """
+        Find the closest recent capture within max_distance
+        
+        Args:
+            frame_hash (int): dHash of the new capture
+            now (float): Current time.monotonic()
+        
+        Returns:
+            CacheEntry: The matching entry (its result may still be None), or None
+        """
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            best_id, best, best_distance = None, None, self.max_distance + 1
+            for fruit_id, entry in list(self._entries.items()):
+                if now - entry.created > self.ttl:
+                    del self._entries[fruit_id]
+                    continue
+                distance = hamming_distance(frame_hash, entry.frame_hash)
+                if distance < best_distance:
+                    best_id, best, best_distance = fruit_id, entry, distance
+            
+            if best is None:
+                self.miss_count += 1
+                return None
+            
+            self._entries.move_to_end(best_id)
+            if best.result is None:
+                self.pending_hit_count += 1
+            else:
+                self.hit_count += 1
+            return best
+        
+    def add(self, fruit_id, frame_hash, now=None):
+        """Remember a capture that is being sent for classification"""
+        with self._lock:
+            self._entries[fruit_id] = CacheEntry(frame_hash, now if now is not None else time.monotonic())
+            self._entries.move_to_end(fruit_id)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        
+    def store_result(self, fruit_id, classification, confidence):
+        """Attach the classification of a cached capture once it arrives"""
+        with self._lock:
+            entry = self._entries.get(fruit_id)
+            if entry is not None:
+                entry.result = (classification, confidence)
+        
+    def get_stats(self):
+        """Get cache statistics"""
+        with self._lock:
+            lookups = self.hit_count + self.pending_hit_count + self.miss_count
+            return {
+                'size': len(self._entries),
+                'capacity': self.capacity,
+                'hits': self.hit_count,
+                'pending_hits': self.pending_hit_count,
+                'misses': self.miss_count,
+                'hit_rate': (self.hit_count + self.pending_hit_count) / lookups if lookups else None
+            }
+
+
+# Test function
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:224, 0:224]
+    
+    def fruit_scene(cx, cy):
+        """Grey belt with a red disc"""
+        scene = np.full((224, 224, 3), 110, dtype=np.uint8)
+        scene[(x - cx) ** 2 + (y - cy) ** 2 < 50 ** 2] = (200, 40, 30)
+        return scene
+    
+    scene = fruit_scene(80, 112)
+    noisy = np.clip(scene + rng.integers(-8, 8, scene.shape), 0, 255).astype(np.uint8)
+    other = fruit_scene(150, 90)
+    
+    h1, h2, h3 = dhash(scene), dhash(noisy), dhash(other)
+    print(f"Same scene + noise: distance {hamming_distance(h1, h2)}")
+    print(f"Different scene: distance {hamming_distance(h1, h3)}")
+    
+    cache = ResultCache()
+    cache.add('fruit-1', h1)
+    cache.store_result('fruit-1', config.CLASSIFICATION_FRESH, 0.93)
+    match = cache.lookup(h2)
+    print(f"Lookup noisy: {match.result if match else None}")
+    print(f"Lookup different: {cache.lookup(h3)}")
+    print(f"Stats: {cache.get_stats()}")
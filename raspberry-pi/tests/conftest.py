@@ -0,0 +1,24 @@
+"""
+Pytest configuration: make the flat raspberry-pi modules importable and
+provide a FruitSortingSystem that runs without a Raspberry Pi
+"""
+import os
+import sys
+from types import SimpleNamespace
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def system():
+    """FruitSortingSystem on FakeGPIO, with gate actions recorded instead of performed"""
+    from gpio_events import FakeGPIO
+    from main import FruitSortingSystem
+    
+    system = FruitSortingSystem(gpio_backend=FakeGPIO())
+    system.actions = []
+    system.actuator = SimpleNamespace(put=system.actions.append)
+    yield system
+    if system.gpio_events:
+        system.gpio_events.close()
@@ -0,0 +1,145 @@
+"""
+Tests for the result consumer, driven through a fake blocking connection
+"""
+import time
+import threading
+from types import SimpleNamespace
+import amqp_consumer
+from amqp_consumer import ResultConsumer
+
+
+class _Channel:
+    def __init__(self, calls):
+        self.calls = calls  # (call, thread name)
+        self.is_open = True
+        self.acks = []
+        self.nacks = []
+        self.on_delivery = None
+        
+    def queue_declare(self, queue, durable):
+        pass
+        
+    def basic_qos(self, prefetch_count):
+        pass
+        
+    def basic_consume(self, queue, on_message_callback):
+        self.on_delivery = on_message_callback
+        
+    def basic_ack(self, delivery_tag, multiple):
+        self.calls.append(('ack', threading.current_thread().name))
+        self.acks.append((delivery_tag, multiple))
+        
+    def basic_nack(self, delivery_tag, requeue):
+        self.nacks.append(delivery_tag)
+        
+    def deliver(self, tag, body=b'{}'):
+        self.on_delivery(self, SimpleNamespace(delivery_tag=tag), None, body)
+
+
+class _Connection:
+    def __init__(self, bodies):
+        self.calls = []
+        self.bodies = list(bodies)
+        self.is_closed = False
+        self._channel = _Channel(self.calls)
+        self._tag = 0
+        
+    def channel(self):
+        self.calls.append(('channel', threading.current_thread().name))
+        return self._channel
+        
+    def process_data_events(self, time_limit):
+        if self.bodies:
+            self._tag += 1
+            self._channel.deliver(self._tag, self.bodies.pop(0))
+        else:
+            time.sleep(time_limit)
+        
+    def close(self):
+        self.calls.append(('close', threading.current_thread().name))
+        self.is_closed = True
+
+
+def test_connection_is_used_only_on_the_consumer_thread(monkeypatch):
+    connection = _Connection([b'a', b'b', b'c'])
+    monkeypatch.setattr(amqp_consumer.pika, 'BlockingConnection', lambda parameters: connection)
+    received = []
+    consumer = ResultConsumer(None, 'results',
+                              lambda body, properties: received.append(
+                                  (body, threading.current_thread().name)),
+                              ack_batch=10, ack_interval=0.05)
+    
+    consumer.start()
+    deadline = time.monotonic() + 2.0
+    while len(received) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    consumer.stop()
+    
+    assert [body for body, _ in received] == [b'a', b'b', b'c']
+    assert {name for _, name in received} == {'amqp-consumer'}
+    assert {name for _, name in connection.calls} == {'amqp-consumer'}
+    calls = [call for call, _ in connection.calls]
+    assert calls[0] == 'channel' and calls[-1] == 'close'
+    # Every processed delivery is acked before the connection closes, by multiple acks
+    assert connection._channel.acks[-1] == (3, True)
+    assert all(multiple for _, multiple in connection._channel.acks)
+    assert consumer.acked_count == 3
+    assert not consumer.is_ready
+
+
+def _consumer(on_message=None, ack_batch=3, ack_interval=60.0):
+    consumer = ResultConsumer(None, 'results', on_message or (lambda body, properties: None),
+                              prefetch_count=10, ack_batch=ack_batch, ack_interval=ack_interval)
+    channel = _Channel([])
+    channel.on_delivery = consumer._on_delivery
+    return consumer, channel
+
+
+def test_acks_are_batched_with_the_last_delivery_tag():
+    consumer, channel = _consumer(ack_batch=3)
+    for tag in range(1, 8):
+        channel.deliver(tag)
+    
+    assert channel.acks == [(3, True), (6, True)]
+    assert (consumer.received_count, consumer.acked_count, consumer.ack_batches) == (7, 6, 2)
+    
+    consumer._flush_acks(channel)
+    assert channel.acks[-1] == (7, True)
+    assert consumer.acked_count == 7
+    consumer._flush_acks(channel)  # Nothing left to ack
+    assert len(channel.acks) == 3
+
+
+def test_rejected_delivery_is_never_covered_by_a_multiple_ack():
+    def on_message(body, properties):
+        if body == b'bad':
+            raise ValueError('malformed result')
+    
+    consumer, channel = _consumer(on_message, ack_batch=5)
+    channel.deliver(1)
+    channel.deliver(2)
+    channel.deliver(3, b'bad')
+    channel.deliver(4)
+    consumer._flush_acks(channel)
+    
+    # 1-2 are acked before the nack of 3, so the later multiple ack of 4 skips nothing unprocessed
+    assert channel.acks == [(2, True), (4, True)]
+    assert channel.nacks == [3]
+    assert (consumer.acked_count, consumer.rejected_count) == (3, 1)
+
+
+def test_acks_flush_on_the_timer(monkeypatch):
+    consumer, _ = _consumer(ack_batch=10, ack_interval=0.05)
+    connection = _Connection([b'a', b'b'])
+    channel = connection._channel
+    monkeypatch.setattr(amqp_consumer.pika, 'BlockingConnection', lambda parameters: connection)
+    
+    consumer.start()
+    deadline = time.monotonic() + 2.0
+    while not channel.acks and time.monotonic() < deadline:
+        time.sleep(0.01)
+    acks = list(channel.acks)
+    consumer.stop()
+    
+    # Far below the batch size, yet acked while still consuming
+    assert acks == [(2, True)]
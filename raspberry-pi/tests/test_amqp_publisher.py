@@ -0,0 +1,144 @@
+"""
+Tests for the confirming publisher's window, confirms and resends, driven
+through a fake connection and channel instead of a broker
+"""
+from pika import spec
+from pika.frame import Method
+from amqp_publisher import ConfirmingPublisher
+
+
+class _IOLoop:
+    def __init__(self):
+        self.stopped = False
+        self.later = []
+        
+    def add_callback_threadsafe(self, callback):
+        pass  # Tests call _drain themselves
+        
+    def call_later(self, delay, callback):
+        self.later.append(callback)
+        
+    def stop(self):
+        self.stopped = True
+
+
+class _Connection:
+    def __init__(self):
+        self.ioloop = _IOLoop()
+        self.is_open = True
+        self.is_closed = False
+        
+    def close(self):
+        self.is_open = False
+
+
+class _Channel:
+    def __init__(self):
+        self.published = []
+        
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.published.append(body)
+
+
+def _publisher(window=2, max_attempts=3):
+    """Publisher whose channel is open and confirm mode is on"""
+    confirmed, failed = [], []
+    publisher = ConfirmingPublisher(None, window=window, backlog=10, confirm_timeout=5.0,
+                                    max_attempts=max_attempts, on_confirmed=confirmed.append,
+                                    on_failed=failed.append)
+    publisher.is_running = True
+    publisher._connection = _Connection()
+    publisher._channel = _Channel()
+    return publisher, confirmed, failed
+
+
+def _publish(publisher, *bodies):
+    for body in bodies:
+        assert publisher.publish('images', body, None, fruit_id=body.decode())
+
+
+def _confirm(publisher, method):
+    publisher._on_delivery_confirmation(Method(1, method))
+
+
+def test_window_limits_unconfirmed_messages():
+    publisher, _, _ = _publisher(window=2)
+    _publish(publisher, b'a', b'b', b'c', b'd', b'e')
+    publisher._on_queue_declared(None)
+    
+    assert publisher._channel.published == [b'a', b'b']
+    assert sorted(publisher._unconfirmed) == [1, 2]
+    assert publisher.get_stats()['backlog'] == 3
+
+
+def test_multiple_ack_confirms_every_tag_up_to_it():
+    publisher, confirmed, _ = _publisher(window=2)
+    _publish(publisher, b'a', b'b', b'c', b'd', b'e')
+    publisher._on_queue_declared(None)
+    
+    _confirm(publisher, spec.Basic.Ack(delivery_tag=2, multiple=True))
+    assert [message.body for message in confirmed] == [b'a', b'b']
+    # The freed window is refilled straight away
+    assert publisher._channel.published == [b'a', b'b', b'c', b'd']
+    assert sorted(publisher._unconfirmed) == [3, 4]
+    
+    _confirm(publisher, spec.Basic.Ack(delivery_tag=4))
+    assert [message.body for message in confirmed] == [b'a', b'b', b'd']
+    assert sorted(publisher._unconfirmed) == [3, 5]
+    assert publisher.confirmed_count == 3
+
+
+def test_nacked_message_is_resent_until_max_attempts():
+    publisher, confirmed, failed = _publisher(window=1, max_attempts=2)
+    _publish(publisher, b'a', b'b')
+    publisher._on_queue_declared(None)
+    
+    _confirm(publisher, spec.Basic.Nack(delivery_tag=1))
+    # Resent ahead of the rest of the backlog, on a new delivery tag
+    assert publisher._channel.published == [b'a', b'a']
+    assert publisher._unconfirmed[2].attempts == 2
+    
+    _confirm(publisher, spec.Basic.Nack(delivery_tag=2))
+    assert [message.body for message in failed] == [b'a']
+    assert publisher._channel.published == [b'a', b'a', b'b']
+    assert not confirmed
+    assert (publisher.nacked_count, publisher.resent_count, publisher.failed_count) == (2, 1, 1)
+
+
+def test_unconfirmed_message_is_resent_after_confirm_timeout():
+    publisher, confirmed, _ = _publisher(window=2)
+    _publish(publisher, b'a', b'b')
+    publisher._on_queue_declared(None)
+    publisher._unconfirmed[1].sent_at -= publisher.confirm_timeout
+    
+    publisher._check_timeouts()
+    assert publisher._channel.published == [b'a', b'b', b'a']
+    assert sorted(publisher._unconfirmed) == [2, 3]
+    assert publisher.resent_count == 1
+    
+    # A late ack for the abandoned tag is ignored
+    _confirm(publisher, spec.Basic.Ack(delivery_tag=1))
+    assert not confirmed
+    _confirm(publisher, spec.Basic.Ack(delivery_tag=3))
+    assert [message.body for message in confirmed] == [b'a']
+
+
+def test_connection_loss_requeues_unconfirmed_in_order():
+    publisher, _, _ = _publisher(window=2)
+    _publish(publisher, b'a', b'b', b'c')
+    publisher._on_queue_declared(None)
+    connection = publisher._connection
+    
+    publisher._on_connection_closed(connection, 'broker restarted')
+    assert not publisher.is_ready
+    assert connection.ioloop.stopped
+    assert not publisher._unconfirmed
+    assert [message.body for message in publisher._pending] == [b'a', b'b', b'c']
+    assert all(message.delivery_tag is None for message in publisher._pending)
+    
+    # Delivery tags restart on the next channel
+    publisher._connection = _Connection()
+    publisher._channel = _Channel()
+    publisher._on_queue_declared(None)
+    assert publisher._channel.published == [b'a', b'b']
+    assert sorted(publisher._unconfirmed) == [1, 2]
@@ -0,0 +1,37 @@
+"""
+Tests for the capped, jittered reconnect backoff
+"""
+from backoff import Backoff
+
+
+def test_delays_double_up_to_the_cap():
+    backoff = Backoff(initial=1.0, maximum=60.0, jitter=0)
+    delays = [backoff.next_delay() for _ in range(8)]
+    assert delays == [1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 60.0, 60.0]
+
+
+def test_long_outage_does_not_overflow():
+    backoff = Backoff(initial=1.0, maximum=60.0, jitter=0)
+    for _ in range(5000):
+        delay = backoff.next_delay()
+    assert delay == 60.0
+    assert backoff.attempts < 10
+
+
+def test_jitter_stays_within_bounds():
+    for _ in range(100):
+        backoff = Backoff(initial=1.0, maximum=8.0, jitter=0.25)
+        for nominal in (1.0, 2.0, 4.0, 8.0, 8.0):
+            assert nominal * 0.75 <= backoff.next_delay() <= nominal
+    
+    backoff = Backoff(initial=8.0, maximum=8.0, jitter=0.25)
+    delays = [backoff.next_delay() for _ in range(500)]
+    assert max(delays) - min(delays) > 1.0  # Actually randomized
+
+
+def test_reset_starts_over():
+    backoff = Backoff(initial=1.0, maximum=60.0, jitter=0)
+    for _ in range(5):
+        backoff.next_delay()
+    backoff.reset()
+    assert backoff.next_delay() == 1.0
@@ -0,0 +1,68 @@
+"""
+Tests for gate scheduling against the belt position model
+"""
+import threading
+import config
+from belt_scheduler import BeltModel, GateScheduler
+from fruit_registry import FruitRegistry
+
+
+class _Motor:
+    """The parts of MotorController the scheduler uses"""
+    
+    def __init__(self):
+        self.belt = BeltModel()
+        
+    def angle_for(self, classification):
+        return config.SERVO_ANGLE_CENTER
+
+
+def _scheduler(speed=50):
+    scheduler = GateScheduler(_Motor())
+    scheduler.belt.set_speed(speed)
+    return scheduler
+
+
+def test_gate_target_uses_detection_point_distance():
+    scheduler = _scheduler()
+    detected = 0.0
+    start = scheduler.belt.position_at(detected)
+    
+    assert scheduler.schedule(config.CLASSIFICATION_FRESH, detected)
+    assert scheduler.schedule(config.CLASSIFICATION_SPOILED, detected,
+                              gate_distance=config.CAMERA_TO_GATE_DISTANCE)
+    targets = sorted(fruit.target - start for fruit in scheduler.pending)
+    assert targets == [config.CAMERA_TO_GATE_DISTANCE, config.IR_TO_GATE_DISTANCE]
+
+
+def test_camera_detected_fruit_get_shorter_deadline(monkeypatch):
+    monkeypatch.setattr(config, 'RESULT_TIMEOUT', None)
+    registry = FruitRegistry()
+    ir_fruit = registry.register(0.0)
+    camera_fruit = registry.register(0.0, gate_distance=config.CAMERA_TO_GATE_DISTANCE)
+    
+    assert registry.resolve(camera_fruit).deadline < registry.resolve(ir_fruit).deadline
+
+
+def test_missed_fruit_are_reported_to_on_done():
+    scheduler = _scheduler()
+    done = []
+    reported = threading.Event()
+    
+    def on_done(fired, start, end):
+        done.append(fired)
+        reported.set()
+    
+    assert scheduler.schedule(config.CLASSIFICATION_FRESH, 0.0, on_done=on_done)
+    
+    # The belt carried the fruit past the gate without a move
+    target = scheduler.pending[0].target
+    assert scheduler._next_action(target + config.GATE_CLEAR_DISTANCE, 0.0) is None
+    assert scheduler.missed_count == 1 and not done  # Callbacks run on the scheduler thread
+    
+    scheduler.start()
+    try:
+        assert reported.wait(timeout=2.0)
+    finally:
+        scheduler.stop()
+    assert done == [False]
@@ -0,0 +1,46 @@
+"""
+Tests that lores frames show the same region whatever their source
+"""
+from types import SimpleNamespace
+import numpy as np
+import config
+from camera_module import CameraModule
+from frame_buffer import FrameRingBuffer
+
+
+def _centroid(luma):
+    ys, xs = np.nonzero(luma > 128)
+    return xs.mean(), ys.mean()
+
+
+def test_lores_stream_and_frame_buffer_share_the_roi(monkeypatch):
+    monkeypatch.setattr(config, 'CAMERA_RESOLUTION', (640, 480))
+    monkeypatch.setattr(config, 'CAMERA_LORES_SIZE', (160, 120))
+    
+    # Full frame with a bright fruit inside the right-hand ROI
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    frame[200:280, 440:520] = 255
+    roi = (320, 0, 320, 480)
+    
+    # picamera2 lores stream: full field of view, YUV420 (luma rows, then chroma)
+    luma = frame[::4, ::4, 0]
+    yuv = np.vstack([luma, np.zeros((60, 160), dtype=np.uint8)])
+    stream_camera = CameraModule()
+    stream_camera.set_roi(roi)
+    stream_camera.has_lores = True
+    stream_camera.camera = SimpleNamespace(capture_array=lambda stream: yuv)
+    from_stream = stream_camera.capture_lores()
+    
+    # Frame buffer: frames are stored already cropped to the ROI
+    buffered_camera = CameraModule()
+    buffered_camera.set_roi(roi)
+    buffered_camera.camera = object()
+    buffered_camera.frame_buffer = FrameRingBuffer(2)
+    buffered_camera.frame_buffer.write(np.ascontiguousarray(buffered_camera.crop_roi(frame)), 0.0)
+    buffered_camera.frame_grabber = SimpleNamespace(is_running=True)
+    from_buffer = buffered_camera.capture_lores()
+    
+    assert from_stream.shape == from_buffer.shape == (120, 160)
+    stream_x, stream_y = _centroid(from_stream)
+    buffer_x, buffer_y = _centroid(from_buffer)
+    assert abs(stream_x - buffer_x) < 2 and abs(stream_y - buffer_y) < 2
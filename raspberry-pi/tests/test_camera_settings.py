@@ -0,0 +1,31 @@
+"""
+Tests for the camera settings handoff between the control server and main.py
+"""
+import os
+from camera_settings import CameraSettingsWatcher, write_settings
+
+
+def test_watcher_applies_each_change_once(tmp_path):
+    path = str(tmp_path / 'camera.json')
+    applied = []
+    watcher = CameraSettingsWatcher(applied.append, path, interval=60)
+    assert not watcher.check()  # No file yet
+    
+    write_settings({'roi': [10, 20, 300, 200], 'output_size': [224, 224]}, path)
+    assert watcher.check()
+    assert not watcher.check()  # Unchanged file is not applied again
+    assert applied[0]['roi'] == [10, 20, 300, 200]
+    
+    write_settings({'roi': None, 'output_size': [112, 112]}, path)
+    os.utime(path, (0, os.path.getmtime(path) + 1))  # Coarse filesystem timestamps
+    assert watcher.check()
+    assert applied[-1]['roi'] is None and applied[-1]['output_size'] == [112, 112]
+    assert watcher.applied_count == 2
+
+
+def test_unreadable_settings_are_ignored(tmp_path):
+    path = tmp_path / 'camera.json'
+    path.write_text('{not json')
+    applied = []
+    assert not CameraSettingsWatcher(applied.append, str(path)).check()
+    assert applied == []
@@ -0,0 +1,67 @@
+"""
+Tests for the fused enhancement kernel against the ImageEnhance chain it replaced
+"""
+import numpy as np
+import pytest
+from PIL import Image, ImageEnhance, ImageFilter
+from enhance_kernel import FusedEnhancer, NOISE_VARIANCE_THRESHOLD
+
+# Rounding happens at different steps (PIL rounds after every stage), so
+# outputs differ by a level or two; the 5x5 blur kernel differs most at borders
+MEAN_TOLERANCE = 2.5
+P99_TOLERANCE = 6  # Away from the 2-pixel border
+MAX_TOLERANCE = 20
+
+
+def _image_enhance_chain(frame, brightness, contrast, saturation):
+    """The pre-fusion CameraModule._enhance_image, noise reduction on"""
+    image = Image.fromarray(frame)
+    if brightness != 0:
+        image = ImageEnhance.Brightness(image).enhance(1.0 + brightness / 100.0)
+    if contrast != 1.0:
+        image = ImageEnhance.Contrast(image).enhance(contrast)
+    if saturation != 1.0:
+        image = ImageEnhance.Color(image).enhance(saturation)
+    image = ImageEnhance.Sharpness(image).enhance(1.2)
+    if np.var(np.array(image)) > NOISE_VARIANCE_THRESHOLD:
+        image = image.filter(ImageFilter.GaussianBlur(radius=0.5))
+    
+    img_array = np.array(image)
+    img_array[:, :, 0] = np.clip(img_array[:, :, 0] * 1.1, 0, 255)
+    img_array[:, :, 1] = np.clip(img_array[:, :, 1] * 1.05, 0, 255)
+    img_array[:, :, 2] = np.clip(img_array[:, :, 2] * 0.95, 0, 255)
+    return img_array
+
+
+def _frame(busy):
+    """Belt-like gradient with sensor noise; busy adds a fruit and pushes the variance over the noise gate"""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:240, 0:320]
+    if busy:
+        frame = np.stack([60 + 120 * x / 320, 80 + 60 * y / 240, 150 - 80 * x / 320], axis=-1)
+        frame[(y - 120) ** 2 + (x - 160) ** 2 < 70 ** 2] = (200, 90, 40)
+    else:
+        frame = np.stack([120 + 20 * x / 320, 110 + 20 * x / 320, 100 + 20 * x / 320], axis=-1)
+    frame = frame + rng.normal(0, 8, frame.shape)
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize('busy', [False, True])
+@pytest.mark.parametrize('brightness, contrast, saturation', [
+    (0, 1.0, 1.0),
+    (10, 1.2, 1.0),
+    (-10, 1.2, 1.3),
+    (0, 1.0, 0.8),
+])
+def test_matches_image_enhance_chain(busy, brightness, contrast, saturation):
+    frame = _frame(busy)
+    assert (np.var(frame) > NOISE_VARIANCE_THRESHOLD) == busy
+    
+    expected = _image_enhance_chain(frame, brightness, contrast, saturation).astype(np.int16)
+    fused = FusedEnhancer().enhance(frame, brightness, contrast, saturation).astype(np.int16)
+    
+    assert fused.shape == frame.shape
+    diff = np.abs(fused - expected)
+    assert diff.mean() <= MEAN_TOLERANCE
+    assert np.percentile(diff[2:-2, 2:-2], 99) <= P99_TOLERANCE
+    assert diff.max() <= MAX_TOLERANCE
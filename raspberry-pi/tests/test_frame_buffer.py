@@ -0,0 +1,29 @@
+"""
+Tests for the timestamped frame ring buffer
+"""
+import numpy as np
+from frame_buffer import FrameRingBuffer
+
+
+def _filled(capacity, count, interval=1 / 30):
+    """Buffer that has seen `count` frames at `interval` seconds from t=0"""
+    buffer = FrameRingBuffer(capacity)
+    for i in range(count):
+        buffer.write(np.full((4, 4), i, dtype=np.uint8), i * interval)
+    return buffer
+
+
+def test_target_older_than_buffer_is_not_covered():
+    buffer = _filled(8, 20)  # Holds frames 12..19
+    assert buffer.covers(19 / 30)
+    assert buffer.covers(12 / 30)
+    assert buffer.covers(11.5 / 30)  # Within one frame interval of the oldest
+    assert not buffer.covers(5 / 30)
+    
+    # nearest() alone would have served the oldest remaining frame instead
+    frame, timestamp = next(buffer.nearest(5 / 30, 1))
+    assert timestamp == 12 / 30
+
+
+def test_empty_buffer_covers_nothing():
+    assert not FrameRingBuffer(4).covers(0.0)
@@ -0,0 +1,40 @@
+"""
+Tests for the in-flight fruit registry round trip estimate
+"""
+import time
+from fruit_registry import FruitRegistry
+
+
+def _published(registry, age):
+    """Register a fruit whose image was published `age` seconds ago"""
+    fruit_id = registry.register(timeout=10)
+    registry.mark_published(fruit_id, time.monotonic() - age)
+    return fruit_id
+
+
+def test_oldest_pending_fruit_bounds_round_trip():
+    registry = FruitRegistry()
+    _published(registry, 2.0)
+    assert registry.round_trip is None
+    assert registry.expected_round_trip() >= 2.0
+
+
+def test_duplicate_remote_result_updates_round_trip():
+    registry = FruitRegistry()
+    fruit_id = _published(registry, 1.0)
+    assert registry.resolve(fruit_id, remote=False) is not None  # Local result wins
+    assert registry.round_trip is None
+    
+    assert registry.resolve(fruit_id, remote=True) is None  # Remote duplicate never moves the gate
+    assert registry.duplicate_count == 1
+    assert registry.round_trip >= 1.0
+
+
+def test_round_trip_recovers_after_local_results():
+    registry = FruitRegistry()
+    registry.round_trip = 5.0
+    for _ in range(20):
+        fruit_id = _published(registry, 0.1)
+        registry.resolve(fruit_id, remote=False)
+        registry.resolve(fruit_id, remote=True)
+    assert registry.expected_round_trip() < 0.5
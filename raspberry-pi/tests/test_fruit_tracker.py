@@ -0,0 +1,103 @@
+"""
+Tests for blob labelling and centroid tracking in continuous mode
+"""
+import numpy as np
+import config
+from fruit_tracker import CentroidTracker, find_blobs
+
+WIDTH, HEIGHT = config.CAMERA_LORES_SIZE
+INTERVAL = 0.05
+
+
+def _belt():
+    return np.random.default_rng(0).integers(90, 110, (HEIGHT, WIDTH), dtype=np.uint8)
+
+
+def _frame(belt, fruit, half=25):
+    """Belt with a dark square fruit at each (x, y) centre"""
+    frame = belt.copy()
+    for x, y in fruit:
+        frame[max(0, y - half):max(0, y + half), max(0, x - half):max(0, x + half)] = 30
+    return frame
+
+
+def _run(tracker, frames):
+    """Feed frames; returns (frame index, track) for every submission"""
+    submitted = []
+    for i, frame in enumerate(frames):
+        for track in tracker.update(frame, i * INTERVAL):
+            submitted.append((i, track))
+    return submitted
+
+
+def test_find_blobs_labels_separate_regions():
+    mask = np.zeros((HEIGHT, WIDTH), dtype=bool)
+    mask[40:80, 40:80] = True  # 5 x 5 cells
+    mask[40:80, 200:240] = True
+    mask[160:176, 100:156] = True  # 2 x 7 cells
+    mask[200:208, 300:308] = True  # One cell, below TRACKER_MIN_BLOB_CELLS
+    
+    blobs = sorted(find_blobs(mask, cell_size=8, min_cells=4), key=lambda blob: blob.centroid)
+    assert [blob.centroid for blob in blobs] == [(60.0, 60.0), (128.0, 168.0), (220.0, 60.0)]
+    assert [blob.area for blob in blobs] == [1600.0, 896.0, 1600.0]
+    assert blobs[0].bbox == (40, 40, 80, 80)
+    assert len(find_blobs(mask, cell_size=8, min_cells=1)) == 4
+
+
+def test_one_submission_per_fruit_at_its_best_frame():
+    belt = _belt()
+    frames = [belt] * 3
+    for i in range(50):
+        x = (i - 3) * 10  # Moving right, centred on frame 3 + 16 = 19
+        frames.append(_frame(belt, [(x, HEIGHT // 2)] if -25 < x < WIDTH + 25 else []))
+    frames += [belt] * 10
+    tracker = CentroidTracker()
+    
+    submitted = _run(tracker, frames)
+    assert len(submitted) == 1
+    index, track = submitted[0]
+    # Best placed when most central; submitted peak_frames later, not when it leaves view
+    assert abs(track.best_time / INTERVAL - 3 - 16 - 3) <= 1
+    assert index - round(track.best_time / INTERVAL) == tracker.peak_frames
+    assert tracker.get_stats()['submitted'] == 1
+
+
+def test_two_fruit_in_view_are_tracked_separately():
+    belt = _belt()
+    frames = [belt] * 3
+    for i in range(60):
+        fruit = [(x, y) for x, y in (((i - 3) * 10, HEIGHT // 3), ((i - 20) * 10, 2 * HEIGHT // 3))
+                 if -25 < x < WIDTH + 25]
+        frames.append(_frame(belt, fruit))
+    frames += [belt] * 10
+    tracker = CentroidTracker()
+    
+    submitted = _run(tracker, frames)
+    assert len(submitted) == 2
+    assert len({track.track_id for _, track in submitted}) == 2
+    assert tracker.get_stats()['active_tracks'] == 0
+
+
+def test_fruit_leaving_before_its_peak_is_submitted_on_exit():
+    belt = _belt()
+    # Grows while moving off the edge of the view: the score never stops improving in view
+    frames = [belt] * 3 + [_frame(belt, [(WIDTH - 60 + i * 5, HEIGHT // 2)], half=10 + i * 3)
+                           for i in range(6)] + [belt] * 10
+    tracker = CentroidTracker(peak_frames=20)
+    
+    submitted = _run(tracker, frames)
+    assert len(submitted) == 1
+    index, track = submitted[0]
+    assert index == 3 + 6 + tracker.max_missed  # Its first frame out of view is 3 + 6
+    assert track.hits >= tracker.min_hits
+
+
+def test_noise_shorter_than_min_hits_is_never_submitted():
+    belt = _belt()
+    frames = [belt] * 3 + [_frame(belt, [(WIDTH // 2, HEIGHT // 2)])] + [belt] * 10
+    assert _run(CentroidTracker(), frames) == []
+
+
+def test_zero_settings_are_kept():
+    tracker = CentroidTracker(max_missed=0, min_hits=0, peak_frames=0)
+    assert (tracker.max_missed, tracker.min_hits, tracker.peak_frames) == (0, 0, 0)
@@ -0,0 +1,68 @@
+"""
+Tests for edge-triggered IR detection on FakeGPIO, through the main loop's handlers
+"""
+import time
+import config
+from gpio_events import FakeGPIO, GPIOEventSource
+from ir_tracker import IRObjectTracker
+
+LOOP_LATENCY = 0.05
+
+
+def _loop_iteration(system):
+    """What FruitSortingSystem.run() does per wake-up in interrupt mode"""
+    for event in system.gpio_events.get_batch(timeout=0):
+        system.handle_gpio_event(event)
+    return system._poll_ir_tracker(time.monotonic())
+
+
+def test_event_source_queues_timestamped_edges():
+    gpio = FakeGPIO()
+    source = GPIOEventSource(gpio=gpio)
+    source.watch(config.IR_SENSOR_PIN, gpio.PUD_DOWN)
+    gpio.set_input(config.IR_SENSOR_PIN, gpio.HIGH)
+    gpio.set_input(config.IR_SENSOR_PIN, gpio.LOW)
+    
+    events = source.get_batch(timeout=0)
+    assert [event.level for event in events] == [gpio.HIGH, gpio.LOW]
+    assert events[0].timestamp <= events[1].timestamp
+    assert source.get_batch(timeout=0) == []
+    
+    tracker = IRObjectTracker()
+    for event in events:
+        tracker.feed(event.level == gpio.HIGH, event.timestamp)
+    assert tracker.poll(time.monotonic() + LOOP_LATENCY) is None
+    assert tracker.glitch_count == 1
+
+
+def test_glitch_during_loop_latency_is_not_a_fruit(system, monkeypatch):
+    monkeypatch.setattr(config, 'TRIGGER_MODE', 'ir_sensor')
+    system._setup_gpio_events()
+    gpio = system.gpio
+    
+    # ~25us pulse: both edges land while the loop is busy for 50ms
+    gpio.set_input(config.IR_SENSOR_PIN, gpio.HIGH)
+    gpio.set_input(config.IR_SENSOR_PIN, gpio.LOW)
+    time.sleep(LOOP_LATENCY)
+    
+    assert _loop_iteration(system) == []
+    assert system.ir_tracker.glitch_count == 1
+    assert system.ir_tracker.object_count == 0
+
+
+def test_fruit_in_beam_is_detected_once(system, monkeypatch):
+    monkeypatch.setattr(config, 'TRIGGER_MODE', 'ir_sensor')
+    system._setup_gpio_events()
+    gpio = system.gpio
+    
+    gpio.set_input(config.IR_SENSOR_PIN, gpio.HIGH)
+    rise = time.monotonic()
+    time.sleep(LOOP_LATENCY)
+    entered = _loop_iteration(system)
+    assert len(entered) == 1
+    assert entered[0].rise_time <= rise  # Timestamped at the edge, not when polled
+    
+    gpio.set_input(config.IR_SENSOR_PIN, gpio.LOW)
+    time.sleep(LOOP_LATENCY)
+    assert _loop_iteration(system) == []
+    assert system.ir_tracker.object_count == 1
@@ -0,0 +1,63 @@
+"""
+Tests for the outbound image spool: fsync timing, size accounting and replay pacing
+"""
+import time
+from types import SimpleNamespace
+from image_spool import ImageSpool, SpoolDrainer, SpoolRecord
+
+
+def test_drainer_syncs_idle_spool_while_disconnected(tmp_path):
+    spool = ImageSpool(str(tmp_path), fsync_batch=100, fsync_interval=0.05)
+    assert spool.append(SpoolRecord('fruit_images', b'jpeg', fruit_id='a'))
+    assert spool.get_stats()['unsynced'] == 1  # Batch not full, interval not checked yet
+    
+    # Broker unreachable: the publisher never has room
+    publisher = SimpleNamespace(window=8, get_stats=lambda: {'ready': False, 'backlog': 0})
+    drainer = SpoolDrainer(spool, publisher)
+    drainer.start()
+    try:
+        deadline = time.monotonic() + 2.0
+        while spool.get_stats()['unsynced'] and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        drainer.stop()
+        spool.close()
+    assert spool.get_stats()['unsynced'] == 0
+
+
+def test_running_size_matches_disk(tmp_path, monkeypatch):
+    spool = ImageSpool(str(tmp_path), max_bytes=4000, segment_bytes=1000, fsync_batch=100)
+    scans = []
+    segments = spool._segments
+    monkeypatch.setattr(spool, '_segments', lambda: scans.append(1) or segments())
+    
+    # Under the cap appends never list the directory
+    assert spool.append(SpoolRecord('fruit_images', b'x' * 300, fruit_id='a'))
+    assert not scans
+    for i in range(30):
+        assert spool.append(SpoolRecord('fruit_images', b'x' * 300, fruit_id=str(i)))
+        spool.flush()  # Make the active segment's size visible on disk
+        assert spool.size_bytes() == spool._scan_bytes()
+    assert spool.evicted_bytes > 0
+    assert spool.size_bytes() <= spool.max_bytes
+    
+    path = spool.take_oldest_segment()
+    spool.remove_segment(path)
+    spool.remove_segment(path)  # Already gone: not subtracted twice
+    assert spool.size_bytes() == spool._scan_bytes()
+    spool.close()
+    
+    # A restarted spool picks up the segments left on disk
+    assert ImageSpool(str(tmp_path)).size_bytes() == spool.size_bytes()
+
+
+def test_replay_waits_for_the_live_backlog_to_drain(tmp_path):
+    stats = {'ready': True, 'backlog': 0}
+    publisher = SimpleNamespace(window=16, get_stats=lambda: stats)
+    drainer = SpoolDrainer(ImageSpool(str(tmp_path)), publisher, max_backlog=3)
+    
+    assert drainer._has_room()
+    stats['backlog'] = 3
+    assert not drainer._has_room()
+    stats.update(backlog=0, ready=False)
+    assert not drainer._has_room()
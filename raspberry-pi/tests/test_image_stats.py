@@ -0,0 +1,102 @@
+"""
+Tests for the strided frame statistics and best-shot selection
+"""
+import numpy as np
+from PIL import Image, ImageFilter
+from frame_buffer import FrameRingBuffer
+from image_stats import ImageStatsEngine, BestShotSelector, LUMA_WEIGHTS
+
+TOLERANCE = 0.02  # Relative error of the strided estimates
+
+
+def _scene(height=480, width=640, seed=0):
+    """Belt gradient with a fruit and sensor noise"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    frame = np.stack([60 + 120 * x / width, 80 + 60 * y / height, 150 - 80 * x / width], axis=-1)
+    frame[(y - height / 2) ** 2 + (x - width / 2) ** 2 < (height / 4) ** 2] = (200, 90, 40)
+    frame += rng.normal(0, 10, frame.shape)
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+def _blurred(frame, radius):
+    if radius == 0:
+        return frame.copy()
+    return np.asarray(Image.fromarray(frame).filter(ImageFilter.GaussianBlur(radius)))
+
+
+def test_strided_stats_match_full_frame():
+    frame = _scene()
+    stats = ImageStatsEngine(step=4).compute(frame)
+    luma = frame @ LUMA_WEIGHTS
+    
+    assert abs(stats.brightness - luma.mean()) <= TOLERANCE * luma.mean()
+    assert abs(stats.contrast - luma.std()) <= TOLERANCE * luma.std()
+    assert abs(stats.noise - np.var(frame)) <= TOLERANCE * np.var(frame)
+    assert np.allclose(stats.channel_means(), frame.reshape(-1, 3).mean(axis=0), rtol=TOLERANCE)
+
+
+def test_lookup_table_stats_match_the_mapped_sample():
+    engine = ImageStatsEngine(step=4)
+    frame = _scene()
+    stats = engine.compute(frame)
+    lut = np.stack([np.clip(np.arange(256) * gain, 0, 255) for gain in (1.1, 1.0, 0.9)]).astype(np.uint8)
+    mapped = np.stack([lut[c][engine.sample(frame)[..., c]] for c in range(3)], axis=-1)
+    
+    assert np.isclose(stats.mapped_variance(lut), np.var(mapped.astype(np.float64)))
+    assert np.allclose(stats.channel_means(lut), mapped.reshape(-1, 3).mean(axis=0))
+
+
+def test_focus_ranks_sharper_frames_higher():
+    engine = ImageStatsEngine(step=2)
+    frame = _scene()
+    scores = [engine.compute(_blurred(frame, radius)).focus for radius in (0, 1, 2, 4)]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_stats_are_cached_per_frame_object():
+    engine = ImageStatsEngine()
+    frame = _scene()
+    assert engine.compute(frame) is engine.compute(frame)
+    assert engine.compute(frame.copy()) is not engine.compute(frame)
+    assert engine.get_stats()['cache_hits'] == 2
+
+
+def _burst(blur_radii, target_index):
+    """Buffered burst at 30 fps; returns the buffer and the target time of frame target_index"""
+    scene = _scene(240, 320)
+    buffer = FrameRingBuffer(len(blur_radii))
+    for i, radius in enumerate(blur_radii):
+        buffer.write(_blurred(scene, radius), i / 30)
+    return buffer, target_index / 30
+
+
+def test_best_shot_picks_the_sharpest_of_the_nearest_frames():
+    # Motion blur on either side of one sharp frame, one frame after the target
+    buffer, target = _burst([4, 3, 2, 0, 3, 4], target_index=2)
+    selector = BestShotSelector(ImageStatsEngine(), candidates=3, threshold=0)
+    
+    best, _ = selector.select(buffer.nearest(target, selector.candidates), view=lambda item: item[0])
+    assert best[1] == 3 / 30
+    assert selector.get_stats()['examined'] == 3
+
+
+def test_best_shot_never_uses_frames_outside_the_candidates():
+    # The sharpest frame is too far from the target to show the fruit in place
+    buffer, target = _burst([0, 3, 2, 2, 3, 4], target_index=4)
+    selector = BestShotSelector(ImageStatsEngine(), candidates=3, threshold=0)
+    
+    best, _ = selector.select(buffer.nearest(target, selector.candidates), view=lambda item: item[0])
+    assert best[1] == 3 / 30  # Sharpest of the three nearest, not frame 0
+
+
+def test_best_shot_stops_at_the_first_sharp_enough_frame():
+    buffer, target = _burst([0, 0, 0, 0], target_index=1)
+    engine = ImageStatsEngine()
+    sharp = engine.compute(buffer.latest()[0]).focus
+    selector = BestShotSelector(engine, candidates=4, threshold=sharp / 2)
+    
+    best, _ = selector.select(buffer.nearest(target, selector.candidates), view=lambda item: item[0])
+    assert best[1] == target  # Closest frame, nothing else copied out of the buffer
+    assert selector.get_stats()['examined'] == 1
+    assert buffer.get_stats()['served'] == 2  # latest() above, and the one candidate
@@ -0,0 +1,46 @@
+"""
+Tests for the glitch-filtered IR edge tracker
+"""
+from ir_tracker import IRObjectTracker
+
+FILTER = 0.01
+
+
+def _poll_all(tracker, now):
+    transitions = []
+    while True:
+        transition = tracker.poll(now)
+        if transition is None:
+            return transitions
+        transitions.append(transition)
+
+
+def test_glitch_is_discarded_when_polled_late():
+    tracker = IRObjectTracker(glitch_filter=FILTER)
+    # 25us pulse, both edges fed before a poll 50ms later
+    tracker.feed(True, 1.0)
+    tracker.feed(False, 1.000025)
+    assert _poll_all(tracker, 1.05) == []
+    assert tracker.glitch_count == 1
+    assert tracker.object_count == 0
+
+
+def test_object_is_confirmed_by_its_own_edges_when_polled_late():
+    tracker = IRObjectTracker(glitch_filter=FILTER)
+    # Object in the beam for 100ms, both edges queued before the poll
+    tracker.feed(True, 1.0)
+    tracker.feed(False, 1.1)
+    transitions = _poll_all(tracker, 1.2)
+    assert [kind for kind, _ in transitions] == ['enter', 'exit']
+    obj = transitions[0][1]
+    assert obj.rise_time == 1.0 and obj.fall_time == 1.1
+    assert tracker.glitch_count == 0
+
+
+def test_pending_edge_waits_for_the_filter():
+    tracker = IRObjectTracker(glitch_filter=FILTER)
+    tracker.feed(True, 1.0)
+    assert tracker.poll(1.005) is None
+    assert abs(tracker.time_until_pending(1.005) - 0.005) < 1e-9
+    kind, obj = tracker.poll(1.02)
+    assert kind == 'enter' and obj.rise_time == 1.0
@@ -0,0 +1,41 @@
+"""
+Tests for the pluggable JPEG encoders
+"""
+from io import BytesIO
+import pytest
+from PIL import Image
+from jpeg_encoder import ENCODERS, JPEGEncoder, PillowEncoder, select_encoder, _benchmark_frame
+
+AVAILABLE = [name for name, cls in ENCODERS.items() if cls.available()]
+
+
+@pytest.mark.parametrize('name', AVAILABLE)
+def test_encoder_produces_a_decodable_jpeg_of_the_frame_size(name):
+    frame = _benchmark_frame((320, 240))
+    data = ENCODERS[name]().encode(frame, 90)
+    
+    image = Image.open(BytesIO(data))
+    assert image.format == 'JPEG'
+    assert image.size == (320, 240)
+    assert image.mode == 'RGB'
+    # Colour order survives the round trip (OpenCV works in BGR)
+    decoded = image.convert('RGB').load()
+    red, green, blue = decoded[300, 2]  # Red ramp; green and blue near 0 at the top edge
+    assert red > green + 100 and red > blue + 100
+
+
+def test_lower_quality_gives_smaller_files():
+    frame = _benchmark_frame((320, 240))
+    encoder = PillowEncoder()
+    assert len(encoder.encode(frame, 50)) < len(encoder.encode(frame, 95))
+
+
+def test_base_class_cannot_be_instantiated():
+    with pytest.raises(TypeError):
+        JPEGEncoder()
+
+
+def test_unavailable_encoder_falls_back_to_an_available_one():
+    encoder = select_encoder('no-such-encoder', size=(64, 48), quality=80)
+    assert encoder.name in AVAILABLE
+    assert select_encoder('pillow').name == 'pillow'
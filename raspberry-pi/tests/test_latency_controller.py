@@ -0,0 +1,63 @@
+"""
+Tests for the latency budget controller's degradation ladder
+"""
+import time
+from types import SimpleNamespace
+import pytest
+import config
+from latency_controller import LatencyController
+
+BUDGET = 0.5
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    monkeypatch.setattr(config, 'LATENCY_DEGRADE_COOLDOWN', 0)
+    monkeypatch.setattr(config, 'LATENCY_RECOVER_COOLDOWN', 0)
+    camera = SimpleNamespace(jpeg_quality=95, image_enhancement=True, roi=None, output_size=(224, 224))
+    camera.set_roi = lambda roi, output_size: setattr(camera, 'output_size', output_size)
+    pipeline = SimpleNamespace(local_classifier=object(), force_local=False)
+    return LatencyController(camera, pipeline, budget=BUDGET)
+
+
+def _remote_result(system, latency, local_first):
+    """One fruit whose remote result arrives `latency` seconds after capture"""
+    fruit_id = system.registry.register(timeout=10)
+    system.registry.mark_captured(fruit_id, time.monotonic() - latency)
+    system.registry.mark_published(fruit_id)
+    if local_first:
+        system.handle_classification_result({'correlation_id': fruit_id, 'source': 'local',
+                                             'classification': config.CLASSIFICATION_FRESH})
+    system.handle_classification_result({'correlation_id': fruit_id, 'source': 'remote',
+                                         'classification': config.CLASSIFICATION_FRESH})
+
+
+def test_ladder_walks_down_and_back_up_through_local_rung(system, controller):
+    system.latency = controller
+    rungs = len(controller.ladder)
+    assert controller.ladder[-1].get('local_fallback')
+    
+    # Slow backend: step down to the local rung
+    for _ in range(rungs * config.LATENCY_MIN_SAMPLES):
+        _remote_result(system, 2 * BUDGET, local_first=controller.pipeline.force_local)
+    assert controller.level == rungs - 1
+    assert controller.pipeline.force_local
+    assert controller.camera.image_enhancement is False
+    
+    # Backend recovers: every fruit is still resolved locally first, the
+    # late remote results alone must bring the controller back up
+    for _ in range(rungs * config.LATENCY_WINDOW):
+        _remote_result(system, 0.1 * BUDGET, local_first=controller.pipeline.force_local)
+    assert controller.level == 0
+    assert controller.pipeline.force_local is False
+    assert controller.camera.jpeg_quality == 95
+    assert controller.camera.output_size == (224, 224)
+    assert len(controller.get_stats()['transitions']) == 2 * (rungs - 1)
+    assert controller.observed_count == len(system.actions)  # One gate action per fruit
+
+
+def test_local_rung_dropped_without_local_classifier(monkeypatch):
+    camera = SimpleNamespace(jpeg_quality=95, image_enhancement=True, roi=None, output_size=None)
+    pipeline = SimpleNamespace(local_classifier=None, force_local=False)
+    controller = LatencyController(camera, pipeline, budget=BUDGET)
+    assert not any(rung.get('local_fallback') for rung in controller.ladder)
@@ -0,0 +1,85 @@
+"""
+Tests for image message encoding/decoding and result format negotiation
+"""
+import json
+import pytest
+import config
+import message_format
+from message_format import (encode_image_message, decode_image_message, decode_result,
+                            CONTENT_TYPE_JPEG, CONTENT_TYPE_JSON, CONTENT_TYPE_MSGPACK,
+                            FORMAT_VERSION, FORMAT_VERSION_HEADER)
+
+JPEG = b'\xff\xd8\xff\xe0' + bytes(range(256)) * 4 + b'\xff\xd9'
+METADATA = {'timestamp': 1700000000.25, 'device_id': 'pi-01', 'fruit_id': 'ab' * 16}
+
+
+def test_binary_round_trip():
+    body, content_type, headers = encode_image_message(JPEG, METADATA, 'binary')
+    
+    assert content_type == CONTENT_TYPE_JPEG
+    assert body == JPEG  # No hex or base64 inflation
+    assert headers[FORMAT_VERSION_HEADER] == FORMAT_VERSION
+    assert decode_image_message(body, content_type, headers) == (JPEG, METADATA)
+
+
+def test_json_round_trip():
+    body, content_type, headers = encode_image_message(JPEG, METADATA, 'json')
+    
+    assert content_type == CONTENT_TYPE_JSON
+    assert headers is None
+    assert len(body) > 2 * len(JPEG)  # Hex doubles the image
+    assert decode_image_message(body.encode(), content_type) == (JPEG, METADATA)
+    # Old publishers sent JSON without a content_type
+    assert decode_image_message(body.encode(), None) == (JPEG, METADATA)
+
+
+@pytest.mark.skipif(not message_format.HAS_MSGPACK, reason="msgpack not installed")
+def test_envelope_round_trip():
+    body, content_type, headers = encode_image_message(JPEG, METADATA, 'envelope')
+    assert decode_image_message(body, content_type, headers) == (JPEG, METADATA)
+
+
+def test_resolve_format_falls_back(monkeypatch):
+    monkeypatch.setattr(message_format, 'HAS_MSGPACK', False)
+    assert message_format.resolve_format('envelope') == 'binary'
+    assert message_format.resolve_format('protobuf') == 'json'
+    monkeypatch.setattr(config, 'MESSAGE_FORMAT', 'binary')
+    assert message_format.resolve_format() == 'binary'
+
+
+def test_accepted_result_types_follow_msgpack(monkeypatch):
+    monkeypatch.setattr(message_format, 'HAS_MSGPACK', False)
+    assert message_format.accepted_result_types() == CONTENT_TYPE_JSON
+    with pytest.raises(ValueError):
+        decode_result(b'\x81\xa5class\xa5fresh', CONTENT_TYPE_MSGPACK)
+    
+    monkeypatch.setattr(message_format, 'HAS_MSGPACK', True)
+    assert message_format.accepted_result_types().split(',') == [CONTENT_TYPE_JSON, CONTENT_TYPE_MSGPACK]
+
+
+def test_results_default_to_json():
+    result = {'classification': 'fresh', 'confidence': 0.9}
+    assert decode_result(json.dumps(result).encode()) == result
+    assert decode_result(json.dumps(result).encode(), CONTENT_TYPE_JSON) == result
+
+
+def test_image_messages_advertise_accepted_result_types(monkeypatch):
+    from rabbitmq_client import RabbitMQClient
+    
+    monkeypatch.setattr(config, 'SPOOL_ENABLED', False)
+    monkeypatch.setattr(config, 'MESSAGE_FORMAT', 'binary')
+    client = RabbitMQClient()
+    published = []
+    client.publisher.is_ready = True
+    monkeypatch.setattr(client.publisher, 'publish',
+                        lambda routing_key, body, properties, fruit_id=None:
+                        published.append((body, properties)) or True)
+    
+    assert client.send_image(JPEG, dict(METADATA), correlation_id='ab' * 16, headers={'traceparent': '00-x'})
+    [(body, properties)] = published
+    assert properties.headers['x-accept'] == message_format.accepted_result_types()
+    assert properties.headers['traceparent'] == '00-x'
+    assert properties.correlation_id == 'ab' * 16
+    image, metadata = decode_image_message(body, properties.content_type, properties.headers)
+    # Binary messages share the headers with transport fields such as x-accept
+    assert image == JPEG and metadata.items() >= METADATA.items()
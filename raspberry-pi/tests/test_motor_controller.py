@@ -0,0 +1,63 @@
+"""
+Tests for the motor controller's sorting modes on FakeGPIO
+"""
+import time
+import threading
+import pytest
+import config
+from gpio_events import FakeGPIO
+from motor_controller import MotorController
+
+
+@pytest.fixture
+def motor(monkeypatch):
+    monkeypatch.setattr(config, 'SORTING_MODE', 'scheduled')
+    monkeypatch.setattr(config, 'SERVO_MOVE_TIME', 0)
+    motor = MotorController(gpio=FakeGPIO())
+    assert motor.initialize()
+    motor.start_conveyor()
+    yield motor
+    motor.cleanup()
+
+
+def test_scheduled_mode_never_stops_the_belt(motor):
+    speed = motor.current_conveyor_speed
+    assert speed > 0
+    
+    # Unschedulable fruit are rejected instead of stopping the belt
+    assert motor.sort_fruit(config.CLASSIFICATION_SPOILED) is False
+    motor.scheduler.stop()
+    assert motor.sort_fruit(config.CLASSIFICATION_SPOILED, detection_time=0.0) is False
+    assert motor.current_conveyor_speed == speed
+    assert motor.conveyor_pwm.duty_cycle == speed
+
+
+def test_scheduled_fruit_is_queued_for_the_gate(motor):
+    assert motor.sort_fruit(config.CLASSIFICATION_OTHER, detection_time=time.monotonic())
+    assert [fruit.angle for fruit in motor.scheduler.pending] == [config.SERVO_ANGLE_LEFT]
+
+
+def test_servo_positions_follow_angle_for(motor):
+    for classification in (config.CLASSIFICATION_FRESH, config.CLASSIFICATION_SPOILED,
+                           config.CLASSIFICATION_OTHER, 'unknown'):
+        motor.set_servo_for(classification)
+        assert motor.current_servo_angle == motor.angle_for(classification)
+
+
+def test_on_done_runs_when_the_servo_moves(motor):
+    moves = []
+    moved = threading.Event()
+    
+    def on_done(fired, start, end):
+        moves.append((fired, start, end, motor.current_servo_angle))
+        moved.set()
+    
+    detected = time.monotonic()
+    assert motor.sort_fruit(config.CLASSIFICATION_SPOILED, detection_time=detected,
+                            gate_distance=5.0, on_done=on_done)
+    assert not moves  # Scheduling returns before the gate is set
+    assert moved.wait(timeout=2.0)
+    
+    fired, start, end, angle = moves[0]
+    assert fired and detected <= start <= end
+    assert angle == motor.angle_for(config.CLASSIFICATION_SPOILED)
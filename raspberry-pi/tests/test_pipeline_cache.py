@@ -0,0 +1,91 @@
+"""
+Tests for the result cache path of the processing pipeline
+"""
+import numpy as np
+import config
+from fruit_registry import FruitRegistry
+from pipeline import ProcessingPipeline, PipelineStage, FruitJob
+from result_cache import ResultCache
+
+
+def _disc(colour):
+    """Grey belt with a disc at the tracker's best-placed spot"""
+    y, x = np.mgrid[0:224, 0:224]
+    frame = np.full((224, 224, 3), 110, dtype=np.uint8)
+    frame[(x - 112) ** 2 + (y - 112) ** 2 < 50 ** 2] = colour
+    return frame
+
+
+def _pipeline(results):
+    registry = FruitRegistry()
+    pipeline = ProcessingPipeline(camera=None, rabbitmq=None, registry=registry,
+                                  on_local_result=results.append, result_cache=ResultCache())
+    return pipeline, registry
+
+
+def _job(registry, frame, track_id):
+    job = FruitJob(fruit_id=registry.register(timeout=10), track_id=track_id)
+    job.frame = frame
+    return job
+
+
+def test_tracked_fruit_never_share_a_cached_result(monkeypatch):
+    monkeypatch.setattr(config, 'TRIGGER_MODE', 'continuous')
+    results = []
+    pipeline, registry = _pipeline(results)
+    
+    first = _job(registry, _disc((200, 40, 30)), track_id=1)
+    assert not pipeline._answer_from_cache(first)
+    pipeline.record_result(first.fruit_id, config.CLASSIFICATION_FRESH, 0.9)
+    
+    # Green fruit as dark as the red one: same dHash, different class
+    second = _job(registry, _disc((40, 120, 30)), track_id=2)
+    assert not pipeline._answer_from_cache(second)
+    assert results == []
+
+
+def test_untracked_repeat_capture_reuses_result(monkeypatch):
+    monkeypatch.setattr(config, 'TRIGGER_MODE', 'time_based')
+    results = []
+    pipeline, registry = _pipeline(results)
+    
+    first = _job(registry, _disc((200, 40, 30)), track_id=None)
+    assert not pipeline._answer_from_cache(first)
+    pipeline.record_result(first.fruit_id, config.CLASSIFICATION_FRESH, 0.9)
+    
+    again = _job(registry, _disc((200, 40, 30)), track_id=None)
+    assert pipeline._answer_from_cache(again)
+    assert results[0]['classification'] == config.CLASSIFICATION_FRESH
+
+
+class _Camera:
+    """Returns the same frame for every capture"""
+    
+    def __init__(self, frame):
+        self.frame = frame
+        
+    def capture_frame_at(self, capture_at):
+        return self.frame
+
+
+def test_cache_hit_counts_as_skipped_not_failed(monkeypatch):
+    monkeypatch.setattr(config, 'TRIGGER_MODE', 'time_based')
+    results = []
+    pipeline, registry = _pipeline(results)
+    pipeline.camera = _Camera(_disc((200, 40, 30)))
+    stage = pipeline.capture_stage
+    stage.next_stage = PipelineStage('next', lambda job: job, maxsize=10)
+    
+    first = FruitJob(fruit_id=registry.register(timeout=10))
+    for job in (first, FruitJob(fruit_id=registry.register(timeout=10)),
+                FruitJob(fruit_id=registry.register(timeout=10))):
+        stage.queue.put(job)
+    stage.start()
+    stage.queue.join()
+    stage.stop()
+    
+    # Later captures of the same scene are dropped while the first one's result is pending
+    stats = stage.get_stats()
+    assert (stats['processed'], stats['skipped'], stats['failed']) == (1, 2, 0)
+    assert stage.next_stage.queue.get_nowait() is first
+    assert stage.next_stage.queue.empty()
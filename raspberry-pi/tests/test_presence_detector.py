@@ -0,0 +1,87 @@
+"""
+Tests for the background-subtraction presence trigger
+"""
+import numpy as np
+import config
+from presence_detector import PresenceDetector, BackgroundModel, STALE_AFTER
+
+WIDTH, HEIGHT = config.CAMERA_LORES_SIZE
+INTERVAL = 0.05
+
+
+def _belt():
+    return np.random.default_rng(0).integers(90, 110, (HEIGHT, WIDTH), dtype=np.uint8)
+
+
+def _frame(belt, *centres, half_width=40):
+    """Belt with a dark object centred on each x"""
+    frame = belt.copy()
+    for x in centres:
+        frame[HEIGHT // 3:2 * HEIGHT // 3, max(0, x - half_width):max(0, x + half_width)] = 30
+    return frame
+
+
+def _transitions(detector, frames, start=0.0):
+    transitions = []
+    for i, frame in enumerate(frames):
+        transition = detector.update(frame, start + i * INTERVAL)
+        if transition:
+            transitions.append(transition[0])
+    return transitions
+
+
+def test_one_detection_per_object_crossing_the_zone():
+    belt = _belt()
+    # One object moving right at 12 px per frame, across the whole view
+    frames = [belt] * 5 + [_frame(belt, (i - 10) * 12) for i in range(50)] + [belt] * 10
+    detector = PresenceDetector()
+    
+    assert _transitions(detector, frames) == ['enter', 'exit']
+    assert detector.get_stats()['frames'] == len(frames)
+
+
+def test_each_of_two_objects_is_detected_once():
+    belt = _belt()
+    frames = [belt] * 5
+    for i in range(70):
+        frames.append(_frame(belt, *[x for x in ((i - 10) * 12, (i - 40) * 12) if -40 < x < WIDTH + 40]))
+    frames += [belt] * 10
+    
+    assert _transitions(PresenceDetector(), frames) == ['enter', 'exit', 'enter', 'exit']
+
+
+def test_stale_background_is_relearned():
+    belt = _belt()
+    lit = np.clip(belt.astype(np.int16) + 60, 0, 255).astype(np.uint8)  # Lights switched on
+    detector = PresenceDetector()
+    assert _transitions(detector, [belt] * 10) == []
+    
+    # After an idle gap the new scene becomes the background instead of a detection
+    resumed = 10 * INTERVAL + STALE_AFTER + 1.0
+    assert detector.update(lit, resumed) is None
+    assert _transitions(detector, [lit] * 10, start=resumed + INTERVAL) == []
+    assert detector.coverage == 0.0
+    
+    # Without the gap the same change is foreground
+    fresh = PresenceDetector()
+    _transitions(fresh, [belt] * 10)
+    fresh.update(lit, 10 * INTERVAL)
+    assert fresh.coverage == 1.0
+
+
+def test_object_standing_still_is_not_learned_quickly():
+    model = BackgroundModel(threshold=25, learning_rate=0.05)
+    belt = _belt()
+    model.apply(belt)
+    fruit = _frame(belt, WIDTH // 2)
+    covered = None
+    for _ in range(20):
+        covered = model.apply(fruit)
+    assert covered[HEIGHT // 2, WIDTH // 2]
+
+
+def test_zero_settings_are_kept():
+    detector = PresenceDetector(threshold=0, min_area=0, glitch_filter=0)
+    assert detector.min_area == 0
+    assert detector.background.threshold == 0
+    assert detector.tracker.glitch_filter == 0
@@ -0,0 +1,84 @@
+"""
+Tests for per-fruit traces and their JSONL output
+"""
+import os
+import json
+import time
+import secrets
+import config
+from tracing import Tracer, TRACE_FILE_NAME
+
+
+def _read_traces(directory):
+    with open(os.path.join(directory, TRACE_FILE_NAME)) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_finished_trace_is_written_as_one_jsonl_line(tmp_path):
+    tracer = Tracer(directory=str(tmp_path), flush_interval=0.05)
+    tracer.start()
+    
+    trace_id = secrets.token_hex(16)
+    detected = time.monotonic()
+    trace = tracer.start_trace(trace_id, detected)
+    trace.add_span('capture', detected, detected + 0.01)
+    publish = trace.add_span('publish', detected + 0.01, detected + 0.02, size=1234)
+    now = time.time()
+    trace.add_remote_spans([{'name': 'inference', 'start': now - 0.05, 'end': now},
+                            {'name': 'broken'}], publish)
+    assert trace.traceparent(publish) == f"00-{trace_id}-{publish.span_id}-01"
+    tracer.finish(trace, 'ok')
+    tracer.finish(trace, 'timeout')  # Finishing twice is ignored
+    tracer.stop()
+    
+    [written] = _read_traces(str(tmp_path))
+    assert written['trace_id'] == trace_id
+    assert written['status'] == 'ok'
+    spans = {span['name']: span for span in written['spans']}
+    assert list(spans) == ['detection', 'capture', 'publish', 'inference']  # Malformed span dropped
+    
+    root = spans['detection']['span_id']
+    assert spans['detection']['parent_id'] is None
+    assert spans['capture']['parent_id'] == root
+    assert spans['publish']['attributes'] == {'size': 1234}
+    assert spans['capture']['duration_ms'] == 10.0
+    assert spans['inference']['parent_id'] == spans['publish']['span_id']
+    assert spans['inference']['attributes'] == {'remote': True}
+    assert tracer.get_stats()['written'] == 1
+
+
+def test_oldest_unfinished_trace_is_abandoned():
+    tracer = Tracer(directory=None, max_active=2)
+    first = tracer.start_trace(secrets.token_hex(16), time.monotonic())
+    for _ in range(2):
+        tracer.start_trace(secrets.token_hex(16), time.monotonic())
+    
+    assert first.status == 'abandoned'
+    assert tracer.get(first.trace_id) is None
+    assert [trace['trace_id'] for trace in tracer.recent()] == [first.trace_id]
+
+
+def test_trace_stays_open_until_the_gate_moves(system, monkeypatch):
+    monkeypatch.setattr(config, 'SORTING_MODE', 'scheduled')
+    system.tracer = Tracer(directory=None)
+    fruit = system.registry.resolve(system.registry.register(time.monotonic()))
+    trace = system.tracer.start_trace(fruit.fruit_id, fruit.detection_time)
+    
+    callbacks = []
+    
+    def sort_fruit(classification, detection_time=None, gate_distance=None, on_done=None):
+        callbacks.append(on_done)
+        return True
+    
+    monkeypatch.setattr(system.motor, 'sort_fruit', sort_fruit)
+    action = (config.CLASSIFICATION_FRESH, fruit, trace, 'remote')
+    assert system._actuate(action) == action
+    assert trace.status is None and trace.find('servo') is None
+    
+    moved = time.monotonic()
+    callbacks[0](True, moved, moved + 0.2)
+    assert trace.status == 'remote'
+    servo = trace.find('servo').to_dict()
+    assert servo['duration_ms'] == 200.0
+    assert servo['attributes']['fired'] is True
+    assert trace.find('schedule') is not None
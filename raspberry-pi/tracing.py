@@ -0,0 +1,327 @@
+"""
+Per-Fruit Tracing
+Each fruit carries a trace from detection to the gate move, with a span
+per step (capture, enhance, encode, publish, broker round trip, result
+handling, servo). Finished traces are kept in an in-memory ring buffer
+and written by a background thread to rotating JSONL files, one trace
+per line.
+
+The fruit ID doubles as the trace ID, and the publish span is sent with
+the image as a W3C 'traceparent' AMQP header. A backend that returns a
+'spans' list with its result gets those spans stitched under the broker
+round trip.
+"""
+import os
+import json
+import time
+import queue
+import logging
+import secrets
+import threading
+from collections import OrderedDict, deque
+import config
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+TRACE_FILE_NAME = 'traces.jsonl'
+STATUS_OK = 'ok'
+
+
+def new_span_id():
+    """Random 64-bit span ID as 16 hex characters"""
+    return secrets.token_hex(8)
+
+
+class Span:
+    """One timed step of a fruit's trace"""
+    
+    __slots__ = ('name', 'span_id', 'parent_id', 'start', 'end', 'attributes')
+        
+    def __init__(self, name, start, end, parent_id=None, attributes=None):
+        self.name = name
+        self.span_id = new_span_id()
+        self.parent_id = parent_id
+        self.start = start  # Epoch seconds
+        self.end = end
+        self.attributes = attributes or {}
+        
+    def to_dict(self):
+        span = {
+            'name': self.name,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': round(self.start, 6),
+            'duration_ms': round((self.end - self.start) * 1000, 3)
+        }
+        if self.attributes:
+            span['attributes'] = self.attributes
+        return span
+
+
+class Trace:
+    """Spans of one fruit; every step adds its span from the thread it runs on"""
+        
+    def __init__(self, trace_id, detection_time):
+        """
+        Args:
+            trace_id (str): 32 hex characters (the registry's fruit ID)
+            detection_time (float): time.monotonic() of the detection
+        """
+        self.trace_id = trace_id
+        # Spans are recorded in time.monotonic() and stored as epoch seconds
+        self._offset = time.time() - time.monotonic()
+        self.spans = []
+        self.status = None
+        self.root = self.add_span('detection', detection_time, parent_id=None)
+        
+    def add_span(self, name, start, end=None, parent_id=False, **attributes):
+        """
+        Record a finished step
+        
+        Args:
+            name (str): Step name
+            start (float): time.monotonic() the step started
+            end (float): time.monotonic() the step ended, defaults to now
+            parent_id (str): Parent span ID, defaults to the detection span
+            **attributes: Extra span fields
+        
+        Returns:
+            Span: The recorded span
+        """
+        end = end if end is not None else time.monotonic()
+        if parent_id is False:
+            parent_id = self.root.span_id
+        span = Span(name, start + self._offset, end + self._offset, parent_id, attributes)
+        self.spans.append(span)  # list.append is atomic, stages run on different threads
+        return span
+        
+    def end_span(self, span, end=None):
+        """Move a span's end, for steps whose span ID is needed before they finish"""
+        span.end = (end if end is not None else time.monotonic()) + self._offset
+        
+    def find(self, name):
+        """Last span with this name, or None"""
+        for span in reversed(self.spans):
+            if span.name == name:
+                return span
+        return None
+        
+    def traceparent(self, span):
+        """W3C trace context header value pointing at a span"""
+        return f"00-{self.trace_id}-{span.span_id}-01"
+        
+    def add_remote_spans(self, spans, parent):
+        """
+        Stitch in spans reported by the backend
+        
+        Args:
+            spans (list): Dicts with 'name', 'start' and 'end' in epoch seconds
+                (backend clock) and optional 'attributes'
+            parent (Span): Span the backend spans are placed under
+        """
+        for remote in spans or []:
+            try:
+                span = Span(str(remote['name']), float(remote['start']), float(remote['end']),
+                            parent.span_id, dict(remote.get('attributes') or {}, remote=True))
+            except (KeyError, TypeError, ValueError):
+                logger.debug(f"Ignoring malformed backend span: {remote}")
+                continue
+            self.spans.append(span)
+        
+    def to_dict(self):
+        start = self.root.start
+        end = max(span.end for span in self.spans)
+        return {
+            'trace_id': self.trace_id,
+            'status': self.status,
+            'start': round(start, 6),
+            'duration_ms': round((end - start) * 1000, 3),
+            'spans': [span.to_dict() for span in self.spans]
+        }
+
+
+class Tracer:
+    """Creates per-fruit traces, keeps the recent ones and writes them to JSONL"""
+        
+    def __init__(self, directory=None, capacity=None, max_active=None, max_bytes=None,
+                 backups=None, flush_interval=None):
+        """
+        Args:
+            directory (str): Directory for the JSONL files (None keeps traces in memory only)
+            capacity (int): Finished traces kept in the ring buffer
+            max_active (int): Unfinished traces kept; the oldest are finished as 'abandoned'
+            max_bytes (int): Size at which the JSONL file is rotated
+            backups (int): Rotated files kept (traces.jsonl.1 ... .N)
+            flush_interval (float): Max seconds a finished trace waits to be written
+        """
+        self.directory = directory
+        self.capacity = capacity or config.TRACE_BUFFER_SIZE
+        self.max_active = max_active or config.TRACE_MAX_ACTIVE
+        self.max_bytes = max_bytes or config.TRACE_FILE_MAX_BYTES
+        self.backups = config.TRACE_FILE_BACKUPS if backups is None else backups
+        self.flush_interval = flush_interval or config.TRACE_FLUSH_INTERVAL
+        
+        self._active = OrderedDict()  # trace_id -> Trace
+        self._recent = deque(maxlen=self.capacity)
+        self._lock = threading.Lock()
+        self._pending = queue.Queue(maxsize=self.capacity)
+        self._thread = None
+        self._stop = threading.Event()
+        
+        # Statistics
+        self.finished_count = 0
+        self.written_count = 0
+        self.dropped_count = 0  # Finished traces not written because the writer fell behind
+        
+    def start_trace(self, trace_id, detection_time):
+        """
+        Begin a fruit's trace
+        
+        Args:
+            trace_id (str): The fruit ID
+            detection_time (float): time.monotonic() of the detection
+        
+        Returns:
+            Trace: The new trace
+        """
+        trace = Trace(trace_id, detection_time)
+        abandoned = []
+        with self._lock:
+            self._active[trace_id] = trace
+            while len(self._active) > self.max_active:
+                abandoned.append(self._active.popitem(last=False)[1])
+        for old in abandoned:
+            self.finish(old, 'abandoned')
+        return trace
+        
+    def get(self, trace_id):
+        """Unfinished trace by ID, or None"""
+        with self._lock:
+            return self._active.get(trace_id)
+        
+    def finish(self, trace, status=STATUS_OK):
+        """
+        Close a trace: keep it in the ring buffer and queue it for writing
+        
+        Args:
+            trace (Trace): The trace (None is ignored)
+            status (str): Outcome, e.g. 'ok', 'timeout', 'duplicate'
+        """
+        if trace is None:
+            return
+        with self._lock:
+            if self._active.pop(trace.trace_id, None) is None and trace.status is not None:
+                return  # Already finished
+            trace.status = status
+            self._recent.append(trace)
+            self.finished_count += 1
+        
+        if self.directory:
+            try:
+                self._pending.put_nowait(trace)
+            except queue.Full:
+                self.dropped_count += 1
+        
+    def recent(self, count=None):
+        """Most recent finished traces as dicts, newest last"""
+        with self._lock:
+            traces = list(self._recent)
+        if count:
+            traces = traces[-count:]
+        return [trace.to_dict() for trace in traces]
+        
+    def start(self):
+        """Start the background JSONL writer"""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._writer_loop, name="trace-writer", daemon=True)
+        self._thread.start()
+        logger.info(f"Writing fruit traces to {os.path.join(self.directory, TRACE_FILE_NAME)}")
+        
+    def stop(self):
+        """Write the remaining traces and stop the writer"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+        
+    def _path(self, index=0):
+        path = os.path.join(self.directory, TRACE_FILE_NAME)
+        return f"{path}.{index}" if index else path
+        
+    def _rotate(self):
+        """traces.jsonl -> .1 -> .2 ... the oldest beyond `backups` is deleted"""
+        if os.path.exists(self._path(self.backups)):
+            os.remove(self._path(self.backups))
+        for index in range(self.backups - 1, -1, -1):
+            if os.path.exists(self._path(index)):
+                os.replace(self._path(index), self._path(index + 1))
+        
+    def _drain(self):
+        """Take every queued trace"""
+        traces = []
+        while True:
+            try:
+                traces.append(self._pending.get_nowait())
+            except queue.Empty:
+                return traces
+        
+    def _write(self, traces):
+        """Append traces to the current file, rotating first if it is full"""
+        try:
+            path = self._path()
+            if os.path.exists(path) and os.path.getsize(path) >= self.max_bytes:
+                self._rotate()
+            with open(path, 'a') as f:
+                for trace in traces:
+                    f.write(json.dumps(trace.to_dict(), separators=(',', ':')) + '\n')
+            self.written_count += len(traces)
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Failed to write {len(traces)} trace(s): {e}")
+        
+    def _writer_loop(self):
+        # Batches writes: one open/append per flush interval, not per fruit
+        while not self._stop.wait(self.flush_interval):
+            traces = self._drain()
+            if traces:
+                self._write(traces)
+        traces = self._drain()
+        if traces:
+            self._write(traces)
+        
+    def get_stats(self):
+        """Get tracer statistics"""
+        with self._lock:
+            active = len(self._active)
+        return {
+            'active': active,
+            'finished': self.finished_count,
+            'written': self.written_count,
+            'dropped': self.dropped_count,
+            'directory': self.directory
+        }
+
+
+# Test function
+if __name__ == "__main__":
+    import tempfile
+    
+    tracer = Tracer(directory=tempfile.mkdtemp(), flush_interval=0.1)
+    tracer.start()
+    
+    detected = time.monotonic()
+    trace = tracer.start_trace(secrets.token_hex(16), detected)
+    for step, seconds in (('capture', 0.01), ('enhance', 0.005), ('encode', 0.008), ('publish', 0.002)):
+        start = time.monotonic()
+        time.sleep(seconds)
+        span = trace.add_span(step, start)
+    print(f"traceparent: {trace.traceparent(span)}")
+    trace.add_remote_spans([{'name': 'inference', 'start': time.time() - 0.05, 'end': time.time()}], span)
+    tracer.finish(trace)
+    tracer.stop()
+    
+    print(json.dumps(tracer.recent(1)[0], indent=2))
+    print(f"Stats: {tracer.get_stats()}")